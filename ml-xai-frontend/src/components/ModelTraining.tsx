@@ -39,7 +39,7 @@ const ModelTraining = ({ uploadData, target, targetType, onTrainingComplete, onV
 
     setIsTraining(true);
     try {
-      const result = await trainModel(target);
+      const result = await trainModel(target, uploadData?.dataset_id);
       setTrainingResults(result);
       setTrainingComplete(true);
       onTrainingComplete(result)  // this is the prop function to update the trainingResults state in Index.tsx
@@ -24,7 +24,7 @@ const Results = ({ trainingResults }) => {
   const fetchExplanations = async (start = 0, end = 1) => {
     setIsLoading(true);
     try {
-      const result = await getExplanations(start, end);
+      const result = await getExplanations(start, end, trainingResults?.model_id);
       setExplanationsData(result);
       setRowRange({ start, end });
     } catch (error) {
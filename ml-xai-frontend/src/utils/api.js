@@ -28,19 +28,20 @@ export const uploadCSV = async (file) => {
   return response.data; // .data of the response contains what is actually returned by upload_csv()
 };
 
-// Train model
-export const trainModel = async (target) => {
+// Train model (datasetId comes from the upload response; without it the backend uses the latest upload)
+export const trainModel = async (target, datasetId = null) => {
   const response = await axios.post(`${BASE_URL}/train-model`, {
     target: target,
+    dataset_id: datasetId,
   });
 
   return response.data;
 };
 
-// Explain model
-export const getExplanations = async (start = 0, end = 1) => {
+// Explain model (modelId comes from the training response; without it the backend uses the latest model)
+export const getExplanations = async (start = 0, end = 1, modelId = null) => {
   const response = await axios.get(`${BASE_URL}/explain-model`, {
-    params: { start, end },
+    params: modelId ? { start, end, model_id: modelId } : { start, end },
   });
 
   return response.data;
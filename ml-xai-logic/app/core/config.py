@@ -0,0 +1,109 @@
+'''
+App configuration. Values can be overridden through environment variables or a .env file (read by python-decouple).
+'''
+import os
+from decouple import config
+
+# Storage locations (relative to the directory uvicorn is started from). Each upload/training run gets its own
+# directory under these roots, see app/utils/registry.py
+DATA_DIR = config("DATA_DIR", default="data")
+ARTIFACTS_DIR = config("ARTIFACTS_DIR", default="artifacts")
+DATASETS_DIR = config("DATASETS_DIR", default=f"{DATA_DIR}/datasets")
+MODELS_DIR = config("MODELS_DIR", default=f"{ARTIFACTS_DIR}/models")
+
+# Registry retention: entries unused for longer than this, or beyond the size budget (least recently used first), are evicted
+ARTIFACT_MAX_AGE_HOURS = config("ARTIFACT_MAX_AGE_HOURS", default=7 * 24, cast=float)
+DATASETS_MAX_TOTAL_BYTES = config("DATASETS_MAX_TOTAL_BYTES", default=10 * 1024 ** 3, cast=int) # 10 GB
+MODELS_MAX_TOTAL_BYTES = config("MODELS_MAX_TOTAL_BYTES", default=20 * 1024 ** 3, cast=int) # 20 GB
+
+# Content-addressed dedupe: identical uploads reuse the stored dataset, and training the same dataset content with the
+# same target and config returns the stored model, metrics and explanation cache instead of refitting
+DEDUPE_ARTIFACTS = config("DEDUPE_ARTIFACTS", default=True, cast=bool)
+
+# SHAP explanation cache (the on-disk tier lives in each model's directory)
+# The in-memory tier holds at most SHAP_MEMORY_CACHE_SIZE entries and SHAP_MEMORY_CACHE_MAX_BYTES of heap arrays; entries
+# backed by the disk tier are memory-mapped and only count against the entry limit
+SHAP_MEMORY_CACHE_SIZE = config("SHAP_MEMORY_CACHE_SIZE", default=4, cast=int)
+SHAP_MEMORY_CACHE_MAX_BYTES = config("SHAP_MEMORY_CACHE_MAX_BYTES", default=512 * 1024 ** 2, cast=int) # 512 MB
+# A request that finds an explanation being computed by another worker/job waits for it. The computing process touches
+# its marker every EXPLANATION_HEARTBEAT_SECONDS; a marker whose owner process is gone, or that has not been touched for
+# EXPLANATION_INFLIGHT_TIMEOUT seconds, is considered abandoned and the waiter computes the entry itself
+EXPLANATION_HEARTBEAT_SECONDS = config("EXPLANATION_HEARTBEAT_SECONDS", default=5, cast=float)
+EXPLANATION_INFLIGHT_TIMEOUT = config("EXPLANATION_INFLIGHT_TIMEOUT", default=60, cast=float)
+
+# Post-training precompute (background job): full SHAP matrix of X_test + global importances, so explain requests only
+# read stored data. Matrices with more than PRECOMPUTE_MAX_VALUES values (rows x features x outputs) only get the
+# global importances precomputed, local rows are then computed per request as usual.
+PRECOMPUTE_EXPLANATIONS = config("PRECOMPUTE_EXPLANATIONS", default=False, cast=bool)
+PRECOMPUTE_MAX_VALUES = config("PRECOMPUTE_MAX_VALUES", default=25_000_000, cast=int)
+
+# Warm model cache (per worker): at most this many models / bytes of model + X_test artifacts stay loaded
+MODEL_CACHE_SIZE = config("MODEL_CACHE_SIZE", default=4, cast=int)
+MODEL_CACHE_MAX_BYTES = config("MODEL_CACHE_MAX_BYTES", default=2 * 1024 ** 3, cast=int) # 2 GB
+
+# Global importances are estimated on at most this many X_test rows; local explanations always use the exact rows requested
+GLOBAL_SHAP_SAMPLE_SIZE = config("GLOBAL_SHAP_SAMPLE_SIZE", default=1000, cast=int)
+
+# Budgeted explanation mode (/explain-model?mode=budgeted): global sample size used when no budget is given
+BUDGETED_DEFAULT_ROWS = config("BUDGETED_DEFAULT_ROWS", default=200, cast=int)
+
+# Parallel SHAP: matrices with at least SHAP_PARALLEL_MIN_ROWS rows are split into shards of SHAP_SHARD_ROWS rows
+# and explained on SHAP_WORKERS processes (1 disables the pool). Every uvicorn worker creates its own pool, so the
+# default splits the cores between the WEB_CONCURRENCY workers (the variable uvicorn reads for its worker count; set
+# it instead of passing --workers, or set SHAP_WORKERS explicitly) rather than starting workers x cores processes.
+WEB_CONCURRENCY = config("WEB_CONCURRENCY", default=1, cast=int)
+SHAP_WORKERS = config("SHAP_WORKERS", default=max((os.cpu_count() or 1) // max(WEB_CONCURRENCY, 1), 1), cast=int)
+SHAP_SHARD_ROWS = config("SHAP_SHARD_ROWS", default=250, cast=int)
+SHAP_PARALLEL_MIN_ROWS = config("SHAP_PARALLEL_MIN_ROWS", default=500, cast=int)
+
+# Streaming explanations (/explain-model/stream): local explanations are computed and sent in batches of this many rows
+EXPLAIN_STREAM_BATCH_ROWS = config("EXPLAIN_STREAM_BATCH_ROWS", default=50, cast=int)
+
+# Batch scoring (/predict-explain): maximum number of raw rows per request
+PREDICT_MAX_ROWS = config("PREDICT_MAX_ROWS", default=10_000, cast=int)
+
+# Categorical encoding used by training: one_hot (dense dummies), sparse_one_hot or ordinal (see app/ml_core/preprocessing.py).
+# CATEGORICAL_MAX_LEVELS > 0 keeps only the most frequent levels per column and buckets the rest (0 = keep all levels)
+TRAIN_ENCODING = config("TRAIN_ENCODING", default="one_hot")
+CATEGORICAL_MAX_LEVELS = config("CATEGORICAL_MAX_LEVELS", default=0, cast=int)
+
+# Training profile (fast, balanced or accurate, see TRAINING_PROFILES in app/ml_core/train.py): tree depth/leaf caps
+# and a model size cap. TRAIN_CV_FOLDS >= 2 adds k-fold cross-validated metrics, with folds run on TRAIN_CV_WORKERS
+# processes (-1 = all cores). MODEL_COMPRESSION is the zlib level of saved models. The default 0 keeps them uncompressed,
+# so the SHAP pool processes and the warm model cache of every API worker memory-map one shared copy from the page
+# cache; a compressed model is smaller on disk but decompressed into the memory of every process that loads it.
+TRAIN_PROFILE = config("TRAIN_PROFILE", default="balanced")
+TRAIN_CV_FOLDS = config("TRAIN_CV_FOLDS", default=0, cast=int)
+TRAIN_CV_WORKERS = config("TRAIN_CV_WORKERS", default=-1, cast=int)
+MODEL_COMPRESSION = config("MODEL_COMPRESSION", default=0, cast=int)
+
+# CSV upload limits and streaming parser settings
+MAX_UPLOAD_BYTES = config("MAX_UPLOAD_BYTES", default=2 * 1024 ** 3, cast=int) # 2 GB
+MAX_UPLOAD_ROWS = config("MAX_UPLOAD_ROWS", default=10_000_000, cast=int)
+CSV_CHUNK_ROWS = config("CSV_CHUNK_ROWS", default=100_000, cast=int)
+CSV_DTYPE_SAMPLE_ROWS = config("CSV_DTYPE_SAMPLE_ROWS", default=10_000, cast=int) # leading rows used to infer column dtypes
+
+# Approximate profiling (POST /profile-csv): the CSV is streamed in CSV_CHUNK_ROWS chunks and summarized with mergeable
+# sketches (see app/utils/sketch.py), so memory stays bounded for files far larger than MAX_UPLOAD_BYTES.
+# PROFILE_WORKERS > 1 sketches chunks on a process pool.
+MAX_PROFILE_BYTES = config("MAX_PROFILE_BYTES", default=50 * 1024 ** 3, cast=int) # 50 GB
+PROFILE_WORKERS = config("PROFILE_WORKERS", default=1, cast=int)
+PROFILE_HLL_PRECISION = config("PROFILE_HLL_PRECISION", default=14, cast=int) # 2^14 registers: ~0.8% standard error
+PROFILE_EXACT_DISTINCT_LIMIT = config("PROFILE_EXACT_DISTINCT_LIMIT", default=10_000, cast=int) # distinct counts are exact up to this
+PROFILE_COERCION_SAMPLE_ROWS = config("PROFILE_COERCION_SAMPLE_ROWS", default=1_000, cast=int) # per chunk, for text columns
+
+# Background jobs (training / SHAP precomputation) run on a process pool of this many workers.
+# JOB_MAX_QUEUED bounds the waiting + running jobs per API worker; further submissions are rejected with 429.
+JOBS_DIR = config("JOBS_DIR", default=f"{ARTIFACTS_DIR}/jobs")
+JOB_MAX_WORKERS = config("JOB_MAX_WORKERS", default=2, cast=int)
+JOB_MAX_QUEUED = config("JOB_MAX_QUEUED", default=8, cast=int)
+# A running job refreshes its state file every JOB_HEARTBEAT_SECONDS; a running/cancelling job whose heartbeat is older
+# than JOB_STALE_SECONDS (its process died, e.g. with the API worker that submitted it) is reported as failed/cancelled
+JOB_HEARTBEAT_SECONDS = config("JOB_HEARTBEAT_SECONDS", default=10, cast=float)
+JOB_STALE_SECONDS = config("JOB_STALE_SECONDS", default=300, cast=float)
+# A job still queued JOB_QUEUE_TIMEOUT seconds after it was submitted is reported as failed: its pool (and the API
+# worker that owned it) is gone, or the queue is so far behind that the caller should resubmit
+JOB_QUEUE_TIMEOUT = config("JOB_QUEUE_TIMEOUT", default=6 * 3600, cast=float)
+
+# Import and exercise the SHAP/scikit-learn stack in a background thread at startup (see app/core/warmup.py)
+WARMUP_ON_STARTUP = config("WARMUP_ON_STARTUP", default=True, cast=bool)
@@ -0,0 +1,246 @@
+'''
+Background job subsystem: training and SHAP precomputation run on a bounded process pool, so a long RandomForest fit
+never blocks the event loop of the API worker.
+
+Job types:
+- train:      fits a model (optionally followed by the precompute stage in the same job)
+- precompute: post-training stage, stores the model's base values, SHAP matrix and global importances (see
+              precompute_explanations in app/ml_core/explain.py) so explain requests only read stored data
+
+Job state is kept as one JSON file per job under JOBS_DIR, so any uvicorn worker can answer status/result requests.
+The job process writes its own final state and refreshes a heartbeat while it runs; a running job whose heartbeat
+stops (its process died, e.g. together with the API worker that submitted it) is reported as failed after
+JOB_STALE_SECONDS, and a job that never left the queue is failed JOB_QUEUE_TIMEOUT after it was created. Cancellation is cooperative: a marker file is checked by the job between training stages and
+between batches of trees while the forest is fitted.
+'''
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from app.core.config import JOBS_DIR, JOB_MAX_WORKERS, JOB_MAX_QUEUED, PRECOMPUTE_EXPLANATIONS, JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS, \
+    JOB_QUEUE_TIMEOUT
+from app.utils.artifact_store import load_frame
+from app.utils.profile import load_profile
+from app.utils.registry import dataset_path, profile_path, resolve_dataset_id, resolve_model_id
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+_executor = None
+_active_jobs = {} # job_id -> Future, for jobs submitted by this worker
+_lock = threading.Lock()
+_state_lock = threading.Lock() # a job's main thread and its heartbeat thread both update its state file
+
+
+class JobQueueFullError(RuntimeError):
+    pass
+
+class UnknownJobError(LookupError):
+    pass
+
+class JobCancelledError(Exception):
+    pass
+
+
+############################################################
+### Job state files
+
+def _job_path(job_id: str) -> str:
+    if not isinstance(job_id, str) or not _ID_PATTERN.match(job_id):
+        raise UnknownJobError(f"Invalid job id: {job_id!r}")
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+def _cancel_marker(job_id: str) -> str:
+    return _job_path(job_id) + ".cancel"
+
+def _write_job(job_id: str, state: dict):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _job_path(job_id)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def _read_job(job_id: str) -> dict:
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise UnknownJobError(f"Unknown job id: {job_id}")
+
+def _update_job(job_id: str, **fields):
+    with _state_lock:
+        state = _read_job(job_id)
+        state.update(fields, updated_at=time.time())
+        _write_job(job_id, state)
+        return state
+
+# A running/cancelling job without a heartbeat for JOB_STALE_SECONDS, or a job queued for JOB_QUEUE_TIMEOUT, has no
+# process left to finish it (or will not get one in time); its final state is written here, by whichever worker reads it first
+def _expire_stale_job(job_id: str, state: dict) -> dict:
+    if state["status"] == "queued":
+        if time.time() - state["created_at"] <= JOB_QUEUE_TIMEOUT:
+            return state
+        with _lock:
+            future = _active_jobs.get(job_id)
+        if future is not None and not future.cancel():
+            return state # it is just starting in this worker's pool
+        return _update_job(job_id, status="failed", stage=None, error=f"Job was not started within {JOB_QUEUE_TIMEOUT:g} seconds")
+    if state["status"] not in ("running", "cancelling"):
+        return state
+    if time.time() - (state.get("heartbeat_at") or state["updated_at"]) <= JOB_STALE_SECONDS:
+        return state
+    if state["status"] == "cancelling":
+        return _update_job(job_id, status="cancelled", stage=None)
+    return _update_job(job_id, status="failed", stage=None, error=f"Job stopped responding (no heartbeat for {JOB_STALE_SECONDS:g} seconds)")
+
+def get_job(job_id: str) -> dict:
+    return _expire_stale_job(job_id, _read_job(job_id))
+
+
+############################################################
+### Work executed inside the pool processes
+
+def run_training_job(job_id: str, dataset_id: str, target: str, precompute_explanations: bool = False, encoding: str = None,
+                     training_profile: str = None, cv_folds: int = None) -> dict:
+    # Imported here so the API process does not need the training stack just to queue a job
+    from app.ml_core.train import train_model
+
+    def progress(fraction, stage):
+        if os.path.exists(_cancel_marker(job_id)):
+            raise JobCancelledError()
+        _update_job(job_id, status="running", progress=round(fraction, 2), stage=stage)
+
+    progress(0.0, "loading dataset")
+    df = load_frame(dataset_path(dataset_id))
+    if target not in df.columns:
+        raise ValueError("Invalid target column")
+
+    result = train_model(df, target, load_profile(profile_path(dataset_id)), dataset_id, progress=progress, encoding=encoding,
+                         training_profile=training_profile, cv_folds=cv_folds)
+
+    if precompute_explanations:
+        from app.ml_core.explain import precompute_explanations
+        progress(0.9, "precomputing explanations")
+        result = {**result, "precompute": precompute_explanations(result["model_id"])}
+
+    return result
+
+def run_precompute_job(job_id: str, model_id: str) -> dict:
+    from app.ml_core.explain import precompute_explanations
+    if os.path.exists(_cancel_marker(job_id)):
+        raise JobCancelledError()
+    _update_job(job_id, status="running", stage="precomputing explanations")
+    return precompute_explanations(model_id)
+
+def _heartbeat(job_id: str, stop: threading.Event):
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            _update_job(job_id, heartbeat_at=time.time())
+        except UnknownJobError:
+            return
+
+# Entry point of every job in the pool: runs fn(job_id, *args) with a heartbeat and records the outcome from the job
+# process itself, so it does not depend on the submitting API worker still being alive
+def _run_job(job_id: str, fn, *args):
+    _update_job(job_id, heartbeat_at=time.time())
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop), daemon=True).start()
+    try:
+        result = fn(job_id, *args)
+    except JobCancelledError:
+        _update_job(job_id, status="cancelled", stage=None)
+        raise
+    except Exception as e:
+        _update_job(job_id, status="failed", stage=None, error=str(e) or type(e).__name__)
+        raise
+    finally:
+        stop.set()
+    _update_job(job_id, status="succeeded", progress=1.0, stage=None, result=result)
+
+
+############################################################
+### Submission and control (API process)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn instead of fork: the API process has threads (threadpool, event loop) that must not be forked
+        _executor = ProcessPoolExecutor(max_workers=JOB_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+# Backstop for jobs that never recorded their outcome: cancelled before they started, or their pool process died
+def _on_job_done(job_id: str, future):
+    with _lock:
+        _active_jobs.pop(job_id, None)
+    try:
+        if _read_job(job_id)["status"] in FINISHED_STATES:
+            return
+    except UnknownJobError:
+        return
+    if future.cancelled() or isinstance(future.exception(), JobCancelledError):
+        _update_job(job_id, status="cancelled", stage=None)
+    else:
+        error = future.exception()
+        _update_job(job_id, status="failed", stage=None, error=(str(error) or type(error).__name__) if error else "Job ended without a result")
+
+def _submit_job(job_type: str, params: dict, fn, *args) -> dict:
+    with _lock:
+        # Queue depth = jobs of this worker that are waiting or running
+        if len(_active_jobs) >= JOB_MAX_QUEUED:
+            raise JobQueueFullError(f"Too many background jobs in progress (limit {JOB_MAX_QUEUED}). Try again later.")
+
+        job_id = uuid.uuid4().hex[:16]
+        state = {
+            "job_id": job_id,
+            "type": job_type,
+            "status": "queued",
+            "progress": 0.0,
+            "stage": None,
+            "params": params,
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        }
+        _write_job(job_id, state)
+        future = _get_executor().submit(_run_job, job_id, fn, *args)
+        _active_jobs[job_id] = future
+    future.add_done_callback(lambda f: _on_job_done(job_id, f))
+    return state
+
+# precompute_explanations=None follows the PRECOMPUTE_EXPLANATIONS setting
+def submit_training_job(target: str, dataset_id: str = None, precompute_explanations: bool = None, encoding: str = None,
+                        training_profile: str = None, cv_folds: int = None) -> dict:
+    dataset_id = resolve_dataset_id(dataset_id)
+    if precompute_explanations is None:
+        precompute_explanations = PRECOMPUTE_EXPLANATIONS
+    params = {"target": target, "dataset_id": dataset_id, "precompute_explanations": precompute_explanations, "encoding": encoding,
+              "training_profile": training_profile, "cv_folds": cv_folds}
+    return _submit_job("train", params, run_training_job, dataset_id, target, precompute_explanations, encoding, training_profile, cv_folds)
+
+def submit_precompute_job(model_id: str = None) -> dict:
+    model_id = resolve_model_id(model_id)
+    return _submit_job("precompute", {"model_id": model_id}, run_precompute_job, model_id)
+
+def cancel_job(job_id: str) -> dict:
+    state = get_job(job_id)
+    if state["status"] in FINISHED_STATES:
+        return state
+
+    # Queued jobs of this worker are dropped right away; running ones stop at their next stage or tree batch boundary
+    with _lock:
+        future = _active_jobs.get(job_id)
+    if future is not None and future.cancel():
+        return get_job(job_id)
+
+    open(_cancel_marker(job_id), "w").close()
+    return _update_job(job_id, status="cancelling")
+
+def shutdown_jobs():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
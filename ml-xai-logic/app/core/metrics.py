@@ -0,0 +1,122 @@
+'''
+Lightweight instrumentation: timing spans around pipeline stages, a few counters/histograms, and a Prometheus
+text rendering of them for GET /metrics.
+
+- span("train.fit") times a block, records it in the stage histogram and in the current request's breakdown
+- the request middleware (app/main.py) times every request; when the client sends "X-Debug-Timing: 1" the stage
+  breakdown of that request is returned in a Server-Timing response header
+- metrics are per process: with several uvicorn workers, each one reports its own numbers
+'''
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_COUNT_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_lock = threading.Lock()
+_metrics = []
+
+# Stage timings of the request being served: list of (stage, seconds), or None outside a request
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help_text, self.labelnames = name, help_text, labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=_DURATION_BUCKETS):
+        self.name, self.help_text, self.labelnames, self.buckets = name, help_text, labelnames, buckets
+        self._values = {} # label values -> [bucket counts..., sum, count]
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with _lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, state in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, state):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram("xai_http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status"))
+STAGE_SECONDS = Histogram("xai_stage_duration_seconds", "Duration of pipeline stages.", ("stage",))
+DATASET_ROWS = Histogram("xai_dataset_rows", "Rows of processed datasets/matrices.", ("source",), _COUNT_BUCKETS)
+DATASET_COLUMNS = Histogram("xai_dataset_columns", "Columns of processed datasets/matrices.", ("source",), _COUNT_BUCKETS)
+CACHE_REQUESTS = Counter("xai_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+
+
+############################################################
+### Helpers used across the app
+
+@contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+def record_shape(source: str, rows: int, columns: int):
+    DATASET_ROWS.observe(rows, source=source)
+    DATASET_COLUMNS.observe(columns, source=source)
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+# Request-scoped stage breakdown (used by the middleware). Spans inside run_in_threadpool share the same list.
+def start_request_timings():
+    return _request_timings.set([])
+
+def finish_request_timings(token) -> list:
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return timings
+
+def format_server_timing(timings: list) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings)
+
+def render_metrics() -> str:
+    with _lock:
+        lines = [line for metric in _metrics for line in metric.render()]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,54 @@
+'''
+Request body size limits for the upload routes, enforced before the body is parsed.
+
+FastAPI parses (and Starlette spools to disk) the whole multipart body before a handler that takes an UploadFile runs,
+so a size check in the handler only fires after an oversized file has been received and written. This ASGI middleware
+rejects it up front instead:
+
+- a Content-Length above the route's limit gets a 413 without reading the body
+- bodies without a Content-Length (chunked) or with a wrong one are counted while they are received, and the request
+  fails with a 413 as soon as the limit is crossed
+
+The limits are on the whole request body; MULTIPART_OVERHEAD_BYTES leaves room for the multipart framing around the
+file, whose exact size is still checked after parsing (app/utils/io.py) on the routes that take an UploadFile.
+'''
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large(limit: int) -> str:
+    return f"Request body is larger than the maximum upload size of {limit} bytes."
+
+
+class UploadSizeLimitMiddleware:
+    # limits: {path: maximum file size in bytes}
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        max_body = limit + MULTIPART_OVERHEAD_BYTES
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_body:
+            await JSONResponse({"detail": _too_large(limit)}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # Raised while FastAPI reads the body, so it becomes a 413 response before the handler runs
+                    raise HTTPException(status_code=413, detail=_too_large(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,76 @@
+'''
+Startup warmup and readiness. shap and scikit-learn are imported lazily (on the first train/explain request), so a
+worker accepts requests almost immediately. The warmup runs the expensive first-use work in a background thread
+instead of inside the first user request:
+
+- imports the SHAP/scikit-learn stack (numba, llvmlite, scipy.stats, ...)
+- fits two tiny forests and explains them, so TreeSHAP's compiled code paths and caches are initialised
+- loads the most recently trained model into the warm model cache
+
+GET /health reports both states: "accepting_requests" is true as soon as the app is up, "warm" once warmup is done.
+GET /health/ready answers 503 while the warmup is still running (for load balancer/orchestrator readiness probes);
+a failed or disabled warmup does not keep the worker out of rotation, its first requests just pay the import cost.
+'''
+import threading
+import time
+from app.core.metrics import span
+
+_state = {"status": "cold", "started_at": None, "finished_at": None, "error": None}
+_lock = threading.Lock()
+
+
+def _warm_ml_stack():
+    import numpy as np
+    import pandas as pd
+    import shap
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+    from app.ml_core.explain import group_contributions
+
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({"a": rng.normal(size=64), "b": rng.normal(size=64), "c_x": rng.integers(0, 2, size=64).astype(bool)})
+    for model, y in ((RandomForestRegressor(n_estimators=4, max_depth=3), X["a"] * 2 + X["b"]),
+                     (RandomForestClassifier(n_estimators=4, max_depth=3), X["a"] > 0)):
+        model.fit(X, y)
+        values = shap.Explainer(model).shap_values(X.iloc[:8])
+        group_contributions(np.asarray(values)[..., 0] if np.ndim(values) == 3 else values, X.columns)
+
+def _warm_latest_model():
+    from app.ml_core.model_cache import get_warm_model
+    from app.utils.registry import UnknownArtifactError, resolve_model_id
+    try:
+        get_warm_model(resolve_model_id())
+    except (UnknownArtifactError, OSError):
+        pass # nothing trained yet (or it was just evicted)
+
+def warm_up():
+    with _lock:
+        if _state["status"] in ("warming", "warm"):
+            return
+        _state.update(status="warming", started_at=time.time(), error=None)
+    try:
+        with span("startup.warmup"):
+            _warm_ml_stack()
+            _warm_latest_model()
+        _state.update(status="warm", finished_at=time.time())
+    except Exception as e:
+        # A failed warmup only means the first requests pay the cost; the worker still serves them
+        _state.update(status="failed", finished_at=time.time(), error=str(e) or type(e).__name__)
+
+def start_background_warmup() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def disable_warmup():
+    _state.update(status="disabled")
+
+def readiness() -> dict:
+    state = dict(_state)
+    if state["started_at"] is not None and state["finished_at"] is not None:
+        state["duration_seconds"] = round(state["finished_at"] - state["started_at"], 3)
+    return {
+        "accepting_requests": True,
+        "warm": state["status"] == "warm",
+        "ready": state["status"] not in ("cold", "warming"),
+        "warmup": state,
+    }
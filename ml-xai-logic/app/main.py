@@ -1,9 +1,32 @@
-from fastapi import FastAPI # class used to create my web application
-from app.routes import controller
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request # class used to create my web application
+from fastapi.responses import PlainTextResponse, JSONResponse
+from app.routes import controller, jobs
+from app.core.jobs import shutdown_jobs
+from app.ml_core.parallel_shap import shutdown_shap_pool
+from app.utils.io import shutdown_profile_pool
+from app.core.config import WARMUP_ON_STARTUP, MAX_UPLOAD_BYTES, MAX_PROFILE_BYTES
+from app.core.upload_limits import UploadSizeLimitMiddleware
+from app.core.warmup import start_background_warmup, disable_warmup, readiness
+from app.core.metrics import HTTP_REQUEST_SECONDS, start_request_timings, finish_request_timings, format_server_timing, render_metrics
 from fastapi.middleware.cors import CORSMiddleware
 
 
-app = FastAPI(title="ML Prediction Explanation Interface") # Initializing my app as an instance of the FastAPI class
+# Startup/shutdown hooks: the ML stack is warmed up in the background (the app accepts requests meanwhile);
+# the background job, SHAP and profiling process pools are created lazily and torn down with the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ON_STARTUP:
+        start_background_warmup()
+    else:
+        disable_warmup()
+    yield
+    shutdown_jobs()
+    shutdown_shap_pool()
+    shutdown_profile_pool()
+
+app = FastAPI(title="ML Prediction Explanation Interface", lifespan=lifespan) # Initializing my app as an instance of the FastAPI class
 
 # Added to fix CORS middleware issue
 app.add_middleware(
@@ -14,13 +37,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Oversized uploads are rejected before FastAPI spools the body to disk (see app/core/upload_limits.py)
+app.add_middleware(UploadSizeLimitMiddleware, limits={
+    "/upload-csv": MAX_UPLOAD_BYTES,
+    "/predict-explain/csv": MAX_UPLOAD_BYTES,
+    "/profile-csv": MAX_PROFILE_BYTES,
+})
+
+# Times every request (labelled by route template, not raw path, to keep label cardinality bounded).
+# Send "X-Debug-Timing: 1" to get the stage breakdown of a request back in a Server-Timing header.
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    token = start_request_timings()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = finish_request_timings(token)
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=getattr(route, "path", "unmatched"), status=status)
+    if request.headers.get("x-debug-timing") == "1":
+        response.headers["Server-Timing"] = format_server_timing(timings + [("total", elapsed)])
+    return response
+
 app.include_router(controller.router)
+app.include_router(jobs.router)
 @app.get("/") # route decorator - home page of API
 def read_root():
     return {
         "message": "API is working"
         }
 
+# Liveness/readiness: "accepting_requests" vs "warm" (see app/core/warmup.py)
+@app.get("/health")
+def health():
+    return readiness()
+
+@app.get("/health/ready") # 503 while the warmup is still running
+def health_ready():
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.get("/metrics") # Prometheus scrape endpoint (per worker process)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # uvicorn app.main:app --reload 
 '''
     uvicorn --> The ASGI server that runs your app
@@ -0,0 +1,207 @@
+# Explanation cache: SHAP results are expensive, so we keep them around per (model, X_test) pair.
+# Two tiers: a small in-memory LRU in front of an on-disk store in the model's directory (survives restarts and is shared by workers).
+# Entries read from (or just written to) disk are memory-mapped, so the in-memory tier mostly holds handles into the page
+# cache; heap-resident arrays are bounded by SHAP_MEMORY_CACHE_MAX_BYTES.
+# Each training run writes a new model directory, so entries of an older model are never served for a newer one.
+# get_or_compute_explanation makes sure an entry is computed only once: concurrent requests (threads of this worker,
+# other workers, the background precompute job) wait for the computation in flight instead of starting a duplicate.
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+import joblib
+import numpy as np
+from app.core.config import SHAP_MEMORY_CACHE_SIZE, SHAP_MEMORY_CACHE_MAX_BYTES, EXPLANATION_INFLIGHT_TIMEOUT, EXPLANATION_HEARTBEAT_SECONDS
+from app.core.metrics import span, record_cache_lookup
+
+_memory_cache = OrderedDict() # key -> (entry, heap bytes), most recently used at the end
+_fingerprints = {} # path -> ((mtime_ns, size), sha256) so unchanged files are not re-hashed on every request
+_inflight = {} # key -> Event, for computations running in this process
+_lock = threading.Lock()
+_POLL_SECONDS = 0.2
+
+
+def file_fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    _fingerprints[path] = (signature, digest.hexdigest())
+    return digest.hexdigest()
+
+
+# Cache key = hash of the model artifact + hash of the test matrix
+def explanation_cache_key(model_path: str, x_test_path: str) -> str:
+    combined = file_fingerprint(model_path) + file_fingerprint(x_test_path)
+    return hashlib.sha256(combined.encode()).hexdigest()
+
+
+def _disk_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"{key}.joblib")
+
+
+# Heap memory held by an entry: its numpy arrays, except memory-mapped ones (those live in the shared page cache)
+def _entry_nbytes(entry: dict) -> int:
+    arrays = []
+    for value in entry.values():
+        arrays.extend(value if isinstance(value, (list, tuple)) else [value])
+    return sum(a.nbytes for a in arrays if isinstance(a, np.ndarray) and not isinstance(a, np.memmap))
+
+def _remember(key: str, entry: dict):
+    with _lock:
+        _memory_cache[key] = (entry, _entry_nbytes(entry))
+        _memory_cache.move_to_end(key)
+        # evict least recently used; the newest entry is always kept, even if it alone exceeds the byte budget
+        while len(_memory_cache) > 1 and (len(_memory_cache) > SHAP_MEMORY_CACHE_SIZE
+                                          or sum(nbytes for _, nbytes in _memory_cache.values()) > SHAP_MEMORY_CACHE_MAX_BYTES):
+            _memory_cache.popitem(last=False)
+
+
+# Returns the cached entry (dict with shap_values, base_values, global_importances) or None on a miss
+def get_cached_explanation(key: str, cache_dir: str):
+    with _lock:
+        cached = _memory_cache.get(key)
+        if cached is not None:
+            _memory_cache.move_to_end(key)
+            record_cache_lookup("explanation_memory", hit=True)
+            return cached[0]
+    record_cache_lookup("explanation_memory", hit=False)
+
+    path = _disk_path(cache_dir, key)
+    if not os.path.exists(path):
+        record_cache_lookup("explanation_disk", hit=False)
+        return None
+    try:
+        entry = joblib.load(path, mmap_mode="r") # large SHAP matrices are mapped from the page cache, not copied
+    except Exception:
+        record_cache_lookup("explanation_disk", hit=False)
+        return None # a half-written or corrupted file is treated as a miss
+    record_cache_lookup("explanation_disk", hit=True)
+    _remember(key, entry)
+    return entry
+
+
+# Writes the entry to disk and returns it memory-mapped from there, so the computed arrays need not stay on the heap
+def store_explanation(key: str, entry: dict, cache_dir: str) -> dict:
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so other workers never read a partial entry
+    tmp_path = f"{_disk_path(cache_dir, key)}.{os.getpid()}.tmp"
+    joblib.dump(entry, tmp_path)
+    os.replace(tmp_path, _disk_path(cache_dir, key))
+    try:
+        entry = joblib.load(_disk_path(cache_dir, key), mmap_mode="r")
+    except Exception:
+        pass # replaced concurrently: keep the computed copy
+    _remember(key, entry)
+    return entry
+
+
+
+def _marker_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"{key}.inflight")
+
+def _claim_marker(marker: str) -> bool:
+    try:
+        fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        json.dump({"pid": os.getpid(), "host": socket.gethostname()}, f)
+    return True
+
+def _heartbeat(marker: str, stop: threading.Event):
+    while not stop.wait(EXPLANATION_HEARTBEAT_SECONDS):
+        try:
+            os.utime(marker)
+        except OSError:
+            return
+
+def _owner_alive(owner: dict) -> bool:
+    if owner.get("host") != socket.gethostname():
+        return True # another machine sharing the directory: only the heartbeat can tell
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, KeyError, TypeError):
+        pass
+    return True
+
+# A marker is abandoned when its heartbeat stopped or its owner process (on this host) no longer exists
+def _marker_abandoned(marker: str) -> bool:
+    try:
+        if time.time() - os.path.getmtime(marker) > EXPLANATION_INFLIGHT_TIMEOUT:
+            return True
+        with open(marker) as f:
+            return not _owner_alive(json.load(f))
+    except (OSError, ValueError):
+        return False # just released, or claimed and not written yet
+
+# Cross-process part: a marker file created with O_EXCL (holding the owner's pid and host) says which process computes
+# the entry; everyone else polls for the cache file. The owner touches the marker while it computes; abandoned markers
+# (crashed or killed owner) are taken over.
+def _compute_once(key: str, cache_dir: str, compute):
+    os.makedirs(cache_dir, exist_ok=True)
+    marker = _marker_path(cache_dir, key)
+    with span("explain.wait_inflight"):
+        while not _claim_marker(marker):
+            if os.path.exists(_disk_path(cache_dir, key)):
+                entry = get_cached_explanation(key, cache_dir)
+                if entry is not None:
+                    return entry
+            if _marker_abandoned(marker):
+                try:
+                    os.remove(marker)
+                except OSError:
+                    pass # taken over by another waiter in the meantime
+                continue
+            time.sleep(_POLL_SECONDS)
+
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(marker, stop), daemon=True).start()
+    try:
+        entry = get_cached_explanation(key, cache_dir) # may have been stored between our first lookup and the claim
+        if entry is None:
+            entry = store_explanation(key, compute(), cache_dir)
+        return entry
+    finally:
+        stop.set()
+        try:
+            os.remove(marker)
+        except OSError:
+            pass
+
+# Returns the cached entry for key, computing it with compute() (and storing it) on a miss
+def get_or_compute_explanation(key: str, cache_dir: str, compute):
+    entry = get_cached_explanation(key, cache_dir)
+    if entry is not None:
+        return entry
+
+    while True:
+        with _lock:
+            event = _inflight.get(key)
+            if event is None:
+                event = _inflight[key] = threading.Event()
+                break
+        # Another thread of this worker is computing it
+        with span("explain.wait_inflight"):
+            event.wait()
+        entry = get_cached_explanation(key, cache_dir)
+        if entry is not None:
+            return entry
+
+    try:
+        return _compute_once(key, cache_dir, compute)
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        event.set()
@@ -1,30 +1,39 @@
 # SHAP logic
-import shap
+# shap itself is only imported by the warm model cache when a model is first explained (see app/core/warmup.py)
 import pandas as pd
-import joblib
 import numpy as np
-import os
+import time
+from functools import lru_cache
+from app.core.config import GLOBAL_SHAP_SAMPLE_SIZE, BUDGETED_DEFAULT_ROWS, EXPLAIN_STREAM_BATCH_ROWS, PRECOMPUTE_MAX_VALUES
+from app.utils.registry import resolve_model_id, model_path, x_test_path, shap_cache_dir
+from app.core.metrics import span, record_shape
+from app.ml_core.model_cache import get_warm_model
+from app.ml_core.parallel_shap import sharded_shap_values
+from app.ml_core.preprocessing import PreprocessingError, transform, densify
+from app.ml_core.cache import explanation_cache_key, get_or_compute_explanation, store_explanation
 
 ############################################################
 ### Common utilities (used in both tasks)
 
-def load_model_and_test_data():
-    # Load saved model and X_test
-    model = joblib.load("artifacts/latest_model.pkl")
-    model_name = type(model).__name__
-    if model_name == 'RandomForestRegressor':
-        task = 'regression'
-    else:
-        task = 'classification'
-    X_test = pd.read_csv("artifacts/X_test.csv")
-    return model, X_test, task
+def load_model_and_test_data(model_id):
+    # Saved model and X_test come from the per-worker warm cache; they are only loaded from disk when they changed
+    entry = get_warm_model(model_id)
+    return entry["model"], entry["X_test"], entry["task"]
+
+def get_feature_groups(warm_entry):
+    preprocessor = warm_entry["preprocessor"]
+    return preprocessor.get("feature_groups") if preprocessor is not None else None
 
 # Group one-hot encoded features to their base name
-def get_feature_group_map(columns):
+# feature_groups: input feature of each column, persisted with the model's preprocessor. Older models without it
+# fall back to splitting the column name at the first "_" (which misgroups names that contain "_" themselves)
+def get_feature_group_map(columns, feature_groups=None):
     mapping = {}
-    for col in columns:
+    for idx, col in enumerate(columns):
+        if feature_groups is not None:
+            base = feature_groups[idx]
         # For one-hot encoded features, split at the first "_"
-        if "_" in col:
+        elif "_" in col:
             base = col.split("_")[0]
         else:
             base = col
@@ -33,49 +42,71 @@ def get_feature_group_map(columns):
         mapping[base].append(col)
     return mapping
 
-############################################################
-### Regression
-def group_global_shap_values_regression(global_vals, columns):
-    mapping = get_feature_group_map(columns)
-    grouped = []
-    for base_feature, subcols in mapping.items():
-        indices = [columns.get_loc(c) for c in subcols] # get_loc returns the index of the column
-        total_importance = sum(global_vals[i] for i in indices)
-        grouped.append({
-            "feature": base_feature,
-            "importance": round(total_importance, 3)
-        })
+# Precomputed group-aggregation matrix: a sparse (num_columns, num_groups) indicator where entry [c, g] is 1 when
+# encoded column c belongs to base feature g. Grouping SHAP values then becomes one matrix multiply instead of Python loops.
+@lru_cache(maxsize=8)
+def _build_group_matrix(columns: tuple, feature_groups: tuple = None):
+    from scipy import sparse
+    mapping = get_feature_group_map(columns, feature_groups)
+    groups = list(mapping.keys())
+    position = {col: idx for idx, col in enumerate(columns)}
+    row_idx, col_idx = [], []
+    for group_idx, subcols in enumerate(mapping.values()):
+        for c in subcols:
+            row_idx.append(position[c])
+            col_idx.append(group_idx)
+    matrix = sparse.csr_matrix((np.ones(len(row_idx)), (row_idx, col_idx)), shape=(len(columns), len(groups)))
+    return groups, matrix
+
+def get_group_matrix(columns, feature_groups=None):
+    return _build_group_matrix(tuple(columns), tuple(feature_groups) if feature_groups is not None else None)
+
+# values: (..., num_columns) -> (..., num_groups)
+def group_contributions(values, columns, feature_groups=None):
+    groups, matrix = get_group_matrix(columns, feature_groups)
+    values = np.asarray(values, dtype=float)
+    flat = values.reshape(-1, values.shape[-1])
+    grouped = np.asarray(flat @ matrix)
+    return groups, grouped.reshape(values.shape[:-1] + (len(groups),))
+
+def sort_grouped_importances(groups, importances):
+    grouped = [{"feature": feature, "importance": importance} for feature, importance in zip(groups, np.round(importances, 3).tolist())]
     grouped.sort(key=lambda x: x["importance"], reverse=True)
     return grouped
 
-def compute_local_shap_values_regression(model, X_test, shap_values, base_values, start=0, end=1):
-    # shape_dict = {}
-    # shape_dict["shap_values"] = shap_values.shape
-    # shape_dict["global_importances"] = global_importances.shape
+############################################################
+### Regression
+def group_global_shap_values_regression(global_vals, columns, feature_groups=None):
+    groups, grouped_vals = group_contributions(global_vals, columns, feature_groups)
+    return sort_grouped_importances(groups, grouped_vals)
 
-    # Local explanations: For the queried rows, corresponding shap values (from shap_values) are processed with a grouping logic and explanation is added as a dictionary.
-    local_explanations = []
-    mapping = get_feature_group_map(X_test.columns)
-
-    for i in range(start, min(end, len(X_test))):
-        row = X_test.iloc[i:i+1]
-        prediction = model.predict(row)[0]
-        shap_row = shap_values[i]
-
-        local_explanation = {} # A map for each feature's contribution for the current row
-        for feature, subcols in mapping.items():
-            feature_contribution = sum(shap_row[X_test.columns.get_loc(c)] for c in subcols)
-            local_explanation[feature] = round(feature_contribution, 3)
-        
-        # Sum of all feature's shap value for a prediction = deviation of model output from baseline
-        # verify shap values make sense by checking the difference of shap values and model deviation from baseline are equal
-        sum_of_shap_values = sum(local_explanation.values())
-        check = sum_of_shap_values - (prediction - base_values[0]) # This should be zero for any row
+# shap_values here only covers the requested rows, i.e. shap_values[0] belongs to X_test.iloc[start]
+# Returns the local explanation of the rows as arrays (used as is by the columnar response format)
+def compute_local_arrays_regression(model, X_test, shap_values, base_values, start=0, end=1, feature_groups=None):
+    # Local explanations: For the queried rows, corresponding shap values (from shap_values) are processed with a grouping logic
+    rows = X_test.iloc[start:end]
+    groups, _ = get_group_matrix(X_test.columns, feature_groups)
+    if len(rows) == 0:
+        return {"features": groups, "row_index": np.arange(start, start), "prediction": np.empty(0), "contributions": np.empty((0, len(groups))), "check": np.empty(0)}
+    predictions = model.predict(rows) # one batched predict call for the whole range
+    groups, contributions = group_contributions(shap_values[:len(rows)], X_test.columns, feature_groups) # (num_rows, num_groups)
+    contributions = np.round(contributions, 3)
+
+    # Sum of all feature's shap value for a prediction = deviation of model output from baseline
+    # verify shap values make sense by checking the difference of shap values and model deviation from baseline are equal
+    checks = contributions.sum(axis=1) - (predictions - base_values[0]) # This should be zero for any row
+    return {"features": groups, "row_index": np.arange(start, start + len(rows)), "prediction": predictions, "contributions": contributions, "check": checks}
 
+def compute_local_shap_values_regression(model, X_test, shap_values, base_values, start=0, end=1, feature_groups=None):
+    arrays = compute_local_arrays_regression(model, X_test, shap_values, base_values, start, end, feature_groups)
+    groups = arrays["features"]
+    # Local explanations: explanation of each row is added as a dictionary
+    local_explanations = []
+    for row_index, prediction, row_contributions, check in zip(arrays["row_index"].tolist(), arrays["prediction"].tolist(), arrays["contributions"].tolist(), arrays["check"].tolist()):
         local_explanations.append({
-            "row_index": i,
+            "row_index": row_index,
             "prediction": prediction,
-            "shap_contributions": local_explanation,
+            "shap_contributions": dict(zip(groups, row_contributions)),
             "check": check
         })
     return local_explanations
@@ -94,105 +125,346 @@ def convert_predictions_and_class_labels(val):
     else:
         return str(val)  # Fallback to string representation
     
-def group_global_shap_values_classification(global_importances, columns, classes):
-    num_classes = global_importances.shape[1] # here, global_importances has a shape (num_features, classes), say (20, 6)
-    feature_mapping = get_feature_group_map(columns)
+def group_global_shap_values_classification(global_importances, columns, classes, feature_groups=None):
+    # here, global_importances has a shape (num_features, classes), say (20, 6); grouping runs on all classes at once
+    groups, grouped_vals = group_contributions(global_importances.T, columns, feature_groups) # (num_classes, num_groups)
     grouped = []
-
-    for class_idx in range(num_classes):
-        global_importances_current_class = global_importances[:, class_idx]
-        
-        # Group features
-        grouped_global_importances_current_class = []
-        for feature, subcols in feature_mapping.items():
-            indices = [columns.get_loc(c) for c in subcols]
-            total_importance_for_current_feature = sum(global_importances_current_class[i] for i in indices)
-            grouped_global_importances_current_class.append({
-                "feature": feature,
-                "importance": round(total_importance_for_current_feature, 3)
-            })
-        
-        grouped_global_importances_current_class.sort(key=lambda x: x["importance"], reverse=True)
+    for class_idx, class_importances in enumerate(grouped_vals):
         grouped.append({
             "class": convert_predictions_and_class_labels(classes[class_idx]),
-            "features": grouped_global_importances_current_class,
+            "features": sort_grouped_importances(groups, class_importances),
         })
 
     return grouped
 
-def compute_local_shap_values_classification(model, X_test, shap_values, base_values, start=0, end=1):
+# Same convention as the regression case: shap_values[0] belongs to X_test.iloc[start]
+def compute_local_arrays_classification(model, X_test, shap_values, base_values, start=0, end=1, feature_groups=None):
+    rows = X_test.iloc[start:end]
+    classes = [convert_predictions_and_class_labels(c) for c in model.classes_]
+    groups, _ = get_group_matrix(X_test.columns, feature_groups)
+    if len(rows) == 0:
+        return {"features": groups, "classes": classes, "row_index": np.arange(start, start), "prediction": [],
+                "probability": np.empty((0, len(classes))), "contributions": np.empty((0, len(classes), len(groups))), "check": np.empty((0, len(classes)))}
+
+    # One batched call each for labels and probabilities
+    probas = model.predict_proba(rows) # (num_rows, num_classes)
+    predictions = model.classes_[np.argmax(probas, axis=1)] # same rule RandomForestClassifier.predict uses
+
+    # (num_rows, num_features, num_classes) -> (num_rows, num_classes, num_groups) in a single multiply
+    groups, contributions = group_contributions(np.transpose(shap_values[:len(rows)], (0, 2, 1)), X_test.columns, feature_groups)
+    contributions = np.round(contributions, 3)
+    # Sum of contributions should equal proba - base_value; similar logic as in regression case
+    checks = np.round(contributions.sum(axis=2), 3) - np.round(probas - np.asarray(base_values), 3)
+    return {"features": groups, "classes": classes, "row_index": np.arange(start, start + len(rows)),
+            "prediction": [convert_predictions_and_class_labels(p) for p in predictions],
+            "probability": probas, "contributions": contributions, "check": checks}
+
+def compute_local_shap_values_classification(model, X_test, shap_values, base_values, start=0, end=1, feature_groups=None):
+    arrays = compute_local_arrays_classification(model, X_test, shap_values, base_values, start, end, feature_groups)
+    groups, classes = arrays["features"], arrays["classes"]
+
     local_explanations = []
-    feature_mapping = get_feature_group_map(X_test.columns)
-    num_classes = shap_values.shape[2]
-    classes = model.classes_
-
-    for i in range(start, min(end, len(X_test))):
-        
-        row = X_test.iloc[i: i+1]
-        prediction = model.predict(row)[0]
-        proba = model.predict_proba(row)[0]
-
-
-        current_row_shap_values = shap_values[i] # (n_features, num_classes)
-
-        class_explanations = []
-        for class_idx in range(num_classes):
-            current_class_shap_values = current_row_shap_values[:, class_idx] # (n_features, )
-
-            contributions = {}
-
-            for feature, subcols in feature_mapping.items():
-                indices = [X_test.columns.get_loc(c) for c in subcols]
-                contributions[feature] = round(float(sum(current_class_shap_values[i] for i in indices)), 3)
-            
-            class_explanations.append({
-                "class": convert_predictions_and_class_labels(classes[class_idx]),
-                "contributions": contributions,
-                "probability": float(proba[class_idx]),
-                # Sum of contributions should equal proba - base_value; similar logic as in regression case
-                "check": round(sum(contributions.values()), 3) - round(proba[class_idx] - base_values[class_idx], 3)
-            })
-        
+    for offset, row_index in enumerate(arrays["row_index"].tolist()):
+        row_contributions, row_probas, row_checks = arrays["contributions"][offset].tolist(), arrays["probability"][offset].tolist(), arrays["check"][offset].tolist()
+        class_explanations = [{
+            "class": classes[class_idx],
+            "contributions": dict(zip(groups, row_contributions[class_idx])),
+            "probability": row_probas[class_idx],
+            "check": row_checks[class_idx]
+        } for class_idx in range(len(classes))]
+
         local_explanations.append({
-            "row_index": i,
-            "prediction": convert_predictions_and_class_labels(prediction),
+            "row_index": row_index,
+            "prediction": arrays["prediction"][offset],
             "class_wise_feature_contributions": class_explanations
         })
 
-        return local_explanations
+    return local_explanations
+
+# Columnar variant of the local explanations: feature and class names once, values as flat row-major arrays
+# (contributions: num_rows x num_features for regression, num_rows x num_classes x num_features for classification)
+def columnar_local_explanations(arrays) -> dict:
+    columnar = {
+        "features": list(arrays["features"]),
+        "row_index": arrays["row_index"].tolist(),
+        "prediction": arrays["prediction"].tolist() if isinstance(arrays["prediction"], np.ndarray) else list(arrays["prediction"]),
+        "contributions": {"shape": list(arrays["contributions"].shape), "values": arrays["contributions"].ravel().tolist()},
+        "check": {"shape": list(arrays["check"].shape), "values": arrays["check"].ravel().tolist()},
+    }
+    if "classes" in arrays:
+        columnar["classes"] = arrays["classes"]
+        columnar["probability"] = {"shape": list(arrays["probability"].shape), "values": arrays["probability"].ravel().tolist()}
+    return columnar
+
+def summarize_check_array(checks):
+    checks = np.abs(np.asarray(checks, dtype=float)).ravel()
+    if len(checks) == 0:
+        return None
+    return {"max_abs": round(float(checks.max()), 6), "mean_abs": round(float(checks.mean()), 6)}
+
+EXPLANATION_MODES = ("exact", "budgeted")
+EXPLANATION_OUTPUTS = ("verbose", "columnar", "arrays")
 
 ############################################################
-# Main driver function for /explain-model endpoint
-def shap_values(start=0, end=1):
-    model, X_test, task = load_model_and_test_data()
+### Global and local explanations are computed separately:
+### global importances once per model (on a bounded sample), local SHAP only for the requested rows
 
-    # Build a SHAP explainer object.
-    explainer = shap.Explainer(model) # Explainer class automatically detects the model type
-    base_values = explainer.expected_value
-    shap_values = explainer.shap_values(X_test) # shape: (num_rows, num_features) fore regression; (num_rows, num_features, num_classes) and is an np array
-    global_importances = np.abs(shap_values).mean(axis=0) # Global importance (mean absolute SHAP value across rows)
+def sample_for_global_importance(X_test):
+    if len(X_test) <= GLOBAL_SHAP_SAMPLE_SIZE:
+        return X_test
+    return X_test.sample(n=GLOBAL_SHAP_SAMPLE_SIZE, random_state=42)
 
+# Stratified sample for budgeted mode: strata are the predicted class (classification) or prediction deciles
+# (regression), each represented proportionally, so a small sample still covers every region of the model output
+def stratified_sample(model, X_test, task, num_rows):
+    if num_rows >= len(X_test):
+        return X_test
+    predictions = model.predict(X_test)
     if task == 'regression':
-        grouped_global_importances = group_global_shap_values_regression(global_importances, X_test.columns)
-        local_explanations = compute_local_shap_values_regression(model, X_test, shap_values, base_values, start, end)
+        strata = pd.qcut(predictions, q=min(10, num_rows), labels=False, duplicates="drop")
+    else:
+        strata = predictions
 
-        return {
-            "model_type": type(model).__name__,
-            # "baseline": base_values,
-            "global_feature_importance": grouped_global_importances,
-            "local_explanations": local_explanations,
-        }
+    rng = np.random.default_rng(42)
+    indices = []
+    for stratum in pd.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        take = max(1, int(round(num_rows * len(members) / len(X_test))))
+        indices.extend(rng.choice(members, size=min(take, len(members)), replace=False))
+    return X_test.iloc[np.sort(indices)]
 
-    else:
-        grouped_global_importances = group_global_shap_values_classification(global_importances, X_test.columns, model.classes_)
-        local_explanations = compute_local_shap_values_classification(model, X_test, shap_values, base_values, start, end)
+# Translates a row and/or time budget into a sample size. The time budget is converted using the measured cost of a small pilot batch.
+def budgeted_sample_size(explainer, X_test, budget_rows=None, budget_seconds=None):
+    num_rows = budget_rows or BUDGETED_DEFAULT_ROWS
+    if budget_seconds is not None:
+        pilot = X_test.iloc[:min(20, len(X_test))]
+        started = time.perf_counter()
+        explainer.shap_values(densify(pilot))
+        seconds_per_row = max((time.perf_counter() - started) / max(len(pilot), 1), 1e-6)
+        num_rows = min(num_rows, int(budget_seconds / seconds_per_row)) if budget_rows else int(budget_seconds / seconds_per_row)
+    return max(1, min(num_rows, len(X_test)))
+
+# Cache key suffix of a budgeted entry: keyed on the requested budget (not on the pilot-derived sample size, which
+# jitters from request to request). Time budgets are bucketed to two significant digits.
+def budget_cache_suffix(X_test, budget_rows=None, budget_seconds=None) -> tuple:
+    budget_rows = min(budget_rows, len(X_test)) if budget_rows else None
+    budget_seconds = float(f"{budget_seconds:.2g}") if budget_seconds is not None else None
+    seconds = "none" if budget_seconds is None else budget_seconds # an explicit 0 is a (one-row) budget, not "no budget"
+    return f"budgeted-rows{budget_rows or 'default'}-seconds{seconds}", budget_rows, budget_seconds
 
+def compute_global_explanation(model, X_test, task, explainer, model_id, X_sample=None, feature_groups=None):
+    if X_sample is None:
+        X_sample = sample_for_global_importance(X_test)
+    with span("explain.global_shap"):
+        sample_shap_values = sharded_shap_values(model_path(model_id), X_sample, explainer) # shape: (num_rows, num_features) fore regression; (num_rows, num_features, num_classes) and is an np array
+    global_importances = np.abs(sample_shap_values).mean(axis=0) # Global importance (mean absolute SHAP value across rows)
+
+    with span("explain.global_grouping"):
+        if task == 'regression':
+            grouped_global_importances = group_global_shap_values_regression(global_importances, X_test.columns, feature_groups)
+        else:
+            grouped_global_importances = group_global_shap_values_classification(global_importances, X_test.columns, model.classes_, feature_groups)
+
+    return {
+        # When the sample is the whole test set the full matrix is kept, so local rows can be sliced instead of recomputed
+        "shap_values": sample_shap_values if len(X_sample) == len(X_test) else None,
+        "base_values": explainer.expected_value,
+        "global_importances": grouped_global_importances,
+        "global_sample_size": len(X_sample),
+    }
+
+# approximate=True uses the explainer's fast path-attribution (Saabas) algorithm instead of exact TreeSHAP
+def compute_local_shap_rows(explainer, X_test, cached, start, end, model_id, approximate=False):
+    if cached["shap_values"] is not None:
+        return cached["shap_values"][start:end]
+    return sharded_shap_values(model_path(model_id), X_test.iloc[start:end], explainer, approximate=approximate) # large ranges are split across processes
+
+# Additivity error of the returned rows, taken from the "check" field of each local explanation (should be ~0)
+def additivity_checks(local_explanations, task):
+    if task == 'regression':
+        return [abs(e["check"]) for e in local_explanations]
+    return [abs(c["check"]) for e in local_explanations for c in e["class_wise_feature_contributions"]]
+
+def summarize_additivity_error(local_explanations, task):
+    checks = additivity_checks(local_explanations, task)
+    if not checks:
+        return None
+    return {"max_abs": round(max(checks), 6), "mean_abs": round(sum(checks) / len(checks), 6)}
+
+# Loads the warm model and the (cached) global explanation for model_id. Everything a page of local explanations needs.
+def prepare_explanation(model_id=None, mode="exact", budget_rows=None, budget_seconds=None) -> dict:
+    if mode not in EXPLANATION_MODES:
+        raise ValueError(f"Unknown explanation mode: {mode}. Expected one of {EXPLANATION_MODES}")
+    model_id = resolve_model_id(model_id)
+    # Model, X_test and the SHAP explainer object are built once per model and kept alive in the warm cache
+    with span("explain.model_load"):
+        warm = get_warm_model(model_id)
+    model, X_test, task, explainer = warm["model"], warm["X_test"], warm["task"], warm["explainer"]
+    feature_groups = get_feature_groups(warm)
+
+    # Global importances only depend on the model and X_test, so they are computed once and then served from the cache
+    # (or precomputed right after training). A request arriving while they are being computed waits for that result.
+    cache_key = explanation_cache_key(model_path(model_id), x_test_path(model_id))
+    if mode == "budgeted":
+        suffix, budget_rows, budget_seconds = budget_cache_suffix(X_test, budget_rows, budget_seconds)
+        cache_key = f"{cache_key}-{suffix}" # budgeted results never replace the exact entry
+
+    def compute():
+        X_sample = None
+        if mode == "budgeted":
+            # The pilot that converts a time budget into rows only runs on a cache miss
+            num_rows = budgeted_sample_size(explainer, X_test, budget_rows, budget_seconds)
+            X_sample = stratified_sample(model, X_test, task, num_rows)
+        return compute_global_explanation(model, X_test, task, explainer, model_id, X_sample, feature_groups)
+    cached = get_or_compute_explanation(cache_key, shap_cache_dir(model_id), compute)
+
+    return {"model_id": model_id, "model": model, "X_test": X_test, "task": task, "explainer": explainer, "mode": mode, "cached": cached,
+            "feature_groups": feature_groups}
+
+# Post-training stage (run as a background job, see app/core/jobs.py): computes the exact explanation entry up front,
+# with the SHAP matrix of the whole test set when it has at most PRECOMPUTE_MAX_VALUES values, so /explain-model
+# pages are slices of stored data. Larger test sets get the sample-based global importances only.
+def precompute_explanations(model_id=None) -> dict:
+    model_id = resolve_model_id(model_id)
+    started = time.perf_counter()
+    warm = get_warm_model(model_id)
+    model, X_test, task, explainer = warm["model"], warm["X_test"], warm["task"], warm["explainer"]
+    feature_groups = get_feature_groups(warm)
+    num_outputs = 1 if task == 'regression' else len(model.classes_)
+    full_matrix = len(X_test) * X_test.shape[1] * num_outputs <= PRECOMPUTE_MAX_VALUES
+
+    cache_key = explanation_cache_key(model_path(model_id), x_test_path(model_id))
+    def compute():
+        return compute_global_explanation(model, X_test, task, explainer, model_id, X_test if full_matrix else None, feature_groups)
+    with span("precompute.explanations"):
+        cached = get_or_compute_explanation(cache_key, shap_cache_dir(model_id), compute)
+        if full_matrix and cached["shap_values"] is None:
+            # A request got there first and stored the sample-based entry: replace it with the full matrix
+            cached = store_explanation(cache_key, compute(), shap_cache_dir(model_id))
+
+    return {
+        "model_id": model_id,
+        "rows": len(X_test),
+        "full_matrix": cached["shap_values"] is not None,
+        "global_sample_size": cached["global_sample_size"],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+def clamp_row_range(context, start, end) -> tuple:
+    start, end = max(start, 0), min(end, len(context["X_test"]))
+    return start, max(start, end)
+
+# Local explanations: the explainer only runs on the requested rows, so the cost grows with the page size
+# arrays=True returns the explanation as arrays (compute_local_arrays_*) instead of one dict per row
+def explain_rows(context, start, end, arrays=False):
+    model, X_test, task, cached = context["model"], context["X_test"], context["task"], context["cached"]
+    with span("explain.local_shap"):
+        shap_values = compute_local_shap_rows(context["explainer"], X_test, cached, start, end, context["model_id"], approximate=(context["mode"] == "budgeted"))
+    base_values = cached["base_values"]
+
+    with span("explain.local_grouping"):
+        if task == 'regression':
+            compute = compute_local_arrays_regression if arrays else compute_local_shap_values_regression
+        else:
+            compute = compute_local_arrays_classification if arrays else compute_local_shap_values_classification
+        local_explanations = compute(model, X_test, shap_values, base_values, start, end, context["feature_groups"])
+    record_shape("explain_rows", end - start, X_test.shape[1])
+    return local_explanations
+
+def global_summary(context) -> dict:
+    return {
+        "model_id": context["model_id"],
+        "model_type": type(context["model"]).__name__,
+        # "baseline": base_values,
+        "explanation_mode": context["mode"],
+        "global_feature_importance": context["cached"]["global_importances"],
+        "global_sample_size": context["cached"]["global_sample_size"],
+    }
+
+############################################################
+# Main driver function for /explain-model endpoint. model_id=None explains the most recently trained model
+# mode: "exact" (TreeSHAP, global importances on the configured sample) or "budgeted" (stratified sample sized by
+# budget_rows/budget_seconds for global importances and approximate local attributions), for a fast first answer
+# output: "verbose" (one dict per row, the default), "columnar" (see columnar_local_explanations) or "arrays" (the
+# numpy arrays of compute_local_arrays_*, not JSON-serializable; for binary encoders like the Arrow response)
+def shap_values(start=0, end=1, model_id=None, mode="exact", budget_rows=None, budget_seconds=None, output="verbose"):
+    if output not in EXPLANATION_OUTPUTS:
+        raise ValueError(f"Unknown output format: {output}. Expected one of {EXPLANATION_OUTPUTS}")
+    context = prepare_explanation(model_id, mode, budget_rows, budget_seconds)
+    start, end = clamp_row_range(context, start, end)
+
+    if output != "verbose":
+        arrays = explain_rows(context, start, end, arrays=True)
+        if output == "arrays":
+            return {**global_summary(context), "additivity_error": summarize_check_array(arrays["check"]), "local_explanations": arrays}
         return {
-            "model_type": type(model).__name__,
-            # "baseline": base_values,
-            "global_feature_importance": grouped_global_importances,
-            "local_explanations": local_explanations,
+            **global_summary(context),
+            "format": "columnar",
+            "additivity_error": summarize_check_array(arrays["check"]),
+            "local_explanations": columnar_local_explanations(arrays),
         }
 
+    local_explanations = explain_rows(context, start, end)
+    return {
+        **global_summary(context),
+        "additivity_error": summarize_additivity_error(local_explanations, context["task"]),
+        "local_explanations": local_explanations,
+    }
 
+# Streaming variant for /explain-model/stream: yields the global part first, then the local explanations batch by
+# batch as they are computed, then the additivity summary. Only one batch is held in memory at a time.
+# Call prepare_explanation first, so unknown models/bad parameters fail before anything is sent.
+def stream_shap_values(context, start=0, end=1, batch_rows=None):
+    start, end = clamp_row_range(context, start, end)
+    batch_rows = max(batch_rows or EXPLAIN_STREAM_BATCH_ROWS, 1)
+    yield {"event": "global", "start": start, "end": end, **global_summary(context)}
+
+    max_check, sum_checks, num_checks = 0.0, 0.0, 0
+    for batch_start in range(start, end, batch_rows):
+        batch_end = min(batch_start + batch_rows, end)
+        local_explanations = explain_rows(context, batch_start, batch_end)
+        checks = additivity_checks(local_explanations, context["task"])
+        max_check, sum_checks, num_checks = max([max_check] + checks), sum_checks + sum(checks), num_checks + len(checks)
+        yield {"event": "local", "start": batch_start, "end": batch_end, "local_explanations": local_explanations}
+
+    additivity_error = {"max_abs": round(max_check, 6), "mean_abs": round(sum_checks / num_checks, 6)} if num_checks else None
+    yield {"event": "done", "additivity_error": additivity_error}
+
+############################################################
+# Batch scoring for new rows (/predict-explain): raw rows go through the model's persisted preprocessing transform,
+# then predictions and grouped SHAP values are computed for the whole batch at once. row_index in the output is the
+# position of the row in the request.
+def score_and_explain(rows: pd.DataFrame, model_id=None) -> dict:
+    model_id = resolve_model_id(model_id)
+    with span("explain.model_load"):
+        warm = get_warm_model(model_id)
+    model, task, explainer, preprocessor = warm["model"], warm["task"], warm["explainer"], warm["preprocessor"]
+    if preprocessor is None:
+        raise PreprocessingError(f"Model {model_id} has no saved preprocessing transform; retrain it to score new rows.")
+
+    with span("explain.preprocess"):
+        X, positions, skipped_rows, unseen_categories = transform(preprocessor, rows)
+    record_shape("scored_rows", len(X), X.shape[1])
+
+    local_explanations = []
+    if len(X):
+        with span("explain.local_shap"):
+            shap_values = sharded_shap_values(model_path(model_id), X, explainer) # large batches are split across processes
+        with span("explain.local_grouping"):
+            if task == 'regression':
+                local_explanations = compute_local_shap_values_regression(model, X, shap_values, explainer.expected_value, 0, len(X), preprocessor.get("feature_groups"))
+            else:
+                local_explanations = compute_local_shap_values_classification(model, X, shap_values, explainer.expected_value, 0, len(X), preprocessor.get("feature_groups"))
+        for explanation, position in zip(local_explanations, positions.tolist()):
+            explanation["row_index"] = position
 
+    return {
+        "model_id": model_id,
+        "model_type": type(model).__name__,
+        "task": task,
+        "scored_rows": len(local_explanations),
+        "skipped_rows": skipped_rows,
+        "unseen_categories": unseen_categories,
+        "additivity_error": summarize_additivity_error(local_explanations, task),
+        "explanations": local_explanations,
+    }
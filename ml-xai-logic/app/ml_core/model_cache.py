@@ -0,0 +1,85 @@
+# Warm model cache: keeps unpickled models, their X_test and a ready-to-use SHAP explainer in memory per worker,
+# so repeated /explain-model calls pay the joblib.load / explainer construction cost once.
+# Entries are LRU-evicted by count and by artifact size, and reloaded when the artifact's mtime/size changes.
+import os
+import threading
+from collections import OrderedDict
+from app.core.config import MODEL_CACHE_SIZE, MODEL_CACHE_MAX_BYTES
+from app.core.metrics import span, record_cache_lookup
+from app.utils.artifact_store import load_frame, load_model, is_compressed
+from app.utils.registry import model_path, x_test_path, preprocessor_path
+from app.ml_core.preprocessing import load_preprocessor, encode
+
+_entries = OrderedDict() # model_id -> entry dict, most recently used at the end
+_lock = threading.Lock()
+_load_locks = {} # model_id -> lock, so concurrent requests for a cold model load it only once
+
+
+def _signature(model_id: str) -> tuple:
+    model_stat, x_test_stat = os.stat(model_path(model_id)), os.stat(x_test_path(model_id))
+    return (model_stat.st_mtime_ns, model_stat.st_size, x_test_stat.st_mtime_ns, x_test_stat.st_size)
+
+
+def _model_memory(model, model_id: str, file_size: int) -> int:
+    if not is_compressed(model_path(model_id)):
+        return file_size # the on-disk size is what gets mapped
+    from app.ml_core.train import forest_nbytes
+    return int(sum(forest_nbytes(model)))
+
+def _load(model_id: str, signature: tuple) -> dict:
+    import shap # heavy (numba/llvmlite); imported on first use so workers start fast
+    # Uncompressed models are memory-mapped (see load_model); compressed ones are decompressed into memory
+    with span("explain.model_unpickle"):
+        model = load_model(model_path(model_id))
+    task = 'regression' if type(model).__name__ == 'RandomForestRegressor' else 'classification'
+    preprocessor = load_preprocessor(preprocessor_path(model_id)) # None for models trained before it was persisted
+    with span("explain.load_x_test"):
+        X_test = load_frame(x_test_path(model_id)) # memory-mapped, exact dtypes
+        if preprocessor is not None and preprocessor.get("x_test_format") == "raw":
+            X_test, _ = encode(preprocessor, X_test) # sparse-encoded models keep raw test rows on disk
+    with span("explain.explainer_build"):
+        explainer = shap.Explainer(model) # Explainer class automatically detects the model type
+    return {
+        "signature": signature,
+        "model": model,
+        "task": task,
+        "X_test": X_test,
+        "explainer": explainer,
+        "preprocessor": preprocessor,
+        "size": _model_memory(model, model_id, signature[1]) + signature[3], # memory estimate used for eviction
+    }
+
+
+def _evict():
+    # Always keep the most recently used entry, even if it alone exceeds the byte budget
+    while len(_entries) > 1 and (len(_entries) > MODEL_CACHE_SIZE or sum(e["size"] for e in _entries.values()) > MODEL_CACHE_MAX_BYTES):
+        _entries.popitem(last=False)
+
+
+# Returns the warm entry for model_id: dict with model, task, X_test, explainer and preprocessor
+def get_warm_model(model_id: str) -> dict:
+    signature = _signature(model_id)
+    with _lock:
+        entry = _entries.get(model_id)
+        if entry is not None and entry["signature"] == signature:
+            _entries.move_to_end(model_id)
+            record_cache_lookup("model", hit=True)
+            return entry
+        load_lock = _load_locks.setdefault(model_id, threading.Lock())
+
+    with load_lock:
+        # Another request may have loaded it while we were waiting
+        with _lock:
+            entry = _entries.get(model_id)
+            if entry is not None and entry["signature"] == signature:
+                _entries.move_to_end(model_id)
+                return entry
+
+        record_cache_lookup("model", hit=False)
+        entry = _load(model_id, signature)
+        with _lock:
+            _entries[model_id] = entry
+            _entries.move_to_end(model_id)
+            _evict()
+            _load_locks.pop(model_id, None)
+    return entry
@@ -0,0 +1,77 @@
+'''
+Parallel explanation engine: TreeSHAP is single-threaded, so large matrices are split into row shards and explained
+on a pool of processes. Each pool process loads a model once (memory-mapped when it is stored uncompressed, so the
+tree arrays are shared through the page cache instead of copied per process) and keeps its explainer for later shards.
+'''
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from app.core.config import SHAP_WORKERS, SHAP_SHARD_ROWS, SHAP_PARALLEL_MIN_ROWS
+from app.ml_core.preprocessing import densify
+from app.utils.artifact_store import load_model
+
+_executor = None
+_lock = threading.Lock()
+
+# Per pool process: model path -> ((mtime_ns, size), explainer)
+_worker_explainers = {}
+
+
+############################################################
+### Work executed inside the pool processes
+
+def _worker_explainer(model_path: str):
+    import shap
+    stat = os.stat(model_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _worker_explainers.get(model_path)
+    if cached is None or cached[0] != signature:
+        model = load_model(model_path) # memory-mapped unless the model is saved compressed
+        cached = (signature, shap.Explainer(model))
+        _worker_explainers.clear() # one model per process is enough; keeps worker memory flat
+        _worker_explainers[model_path] = cached
+    return cached[1]
+
+def _explain_shard(model_path: str, X_shard, shap_kwargs: dict):
+    return _worker_explainer(model_path).shap_values(X_shard, **shap_kwargs)
+
+
+############################################################
+### Sharding (API process)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=SHAP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def should_parallelize(num_rows: int) -> bool:
+    # Daemonic processes (e.g. multiprocessing.Pool workers) cannot start their own pool
+    return SHAP_WORKERS > 1 and num_rows >= SHAP_PARALLEL_MIN_ROWS and not multiprocessing.current_process().daemon
+
+def shard_bounds(num_rows: int, shard_rows: int = SHAP_SHARD_ROWS) -> list:
+    # Use at least one shard per worker so small-but-parallel inputs still use every core
+    shard_rows = max(1, min(shard_rows, -(-num_rows // SHAP_WORKERS)))
+    return [(start, min(start + shard_rows, num_rows)) for start in range(0, num_rows, shard_rows)]
+
+# Same result as explainer.shap_values(X): (num_rows, num_features) for regression, (num_rows, num_features, num_classes)
+# for classification. explainer is used directly when X is too small to be worth sharding; base values do not depend
+# on the rows, so callers keep taking them from explainer.expected_value. shap_kwargs (e.g. approximate=True) are
+# passed through to shap_values. Sparse-encoded X is densified one shard at a time.
+def sharded_shap_values(model_path: str, X, explainer, **shap_kwargs):
+    if not should_parallelize(len(X)):
+        return explainer.shap_values(densify(X), **shap_kwargs)
+
+    executor = _get_executor()
+    futures = [executor.submit(_explain_shard, model_path, densify(X.iloc[start:end]), shap_kwargs) for start, end in shard_bounds(len(X))]
+    return np.concatenate([future.result() for future in futures], axis=0) # shards come back in submission order
+
+def shutdown_shap_pool():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,173 @@
+'''
+Fitted preprocessing transform, persisted next to every model (preprocessor.json), so new raw rows can be scored
+and explained with exactly the columns the model was trained on.
+
+It records what train_model does: the dropped columns, the input columns with their dtypes, the category vocabulary
+of every categorical column, the encoding strategy, the final encoded column order and the input feature each encoded
+column belongs to (used to group SHAP values). transform() replays it on a batch of rows in one vectorized pass:
+
+- dropped and unknown extra columns are ignored, missing input columns are an error
+- rows with missing/unparseable values are skipped (training drops them too) and reported by position
+- category levels outside the kept vocabulary go to the rare-level bucket when there is one, otherwise they encode to
+  all-zero dummies (ordinal: -1); levels that never occurred in training are counted per column as unseen
+
+Encoding strategies:
+- one_hot:        dense dummy columns (pd.get_dummies), one per category level
+- sparse_one_hot: same columns stored as pandas sparse arrays, so wide categorical data stays small in memory;
+                  the forest is fitted on the sparse matrix directly
+- ordinal:        one integer code column per categorical feature (tree models split on the codes natively)
+With max_categories > 0, only the most frequent max_categories - 1 levels of a column are kept and the rest share
+the OTHER_LEVEL bucket.
+'''
+import json
+import os
+import pandas as pd
+
+PREPROCESSOR_VERSION = 3
+ENCODING_STRATEGIES = ("one_hot", "sparse_one_hot", "ordinal")
+OTHER_LEVEL = "__other__"
+
+
+class PreprocessingError(ValueError):
+    pass
+
+
+def _kept_levels(series: pd.Series, max_categories: int) -> tuple:
+    # Same levels (and order) get_dummies uses; stored as strings because that is how they appear in column names
+    values = series.astype(str)
+    levels = [str(level) for level in pd.Categorical(values).categories]
+    if not max_categories or len(levels) <= max_categories:
+        return levels, []
+    counts = values.value_counts()
+    frequent = set(counts.sort_index(kind="stable").sort_values(ascending=False, kind="stable").index[:max(max_categories - 1, 1)])
+    return [level for level in levels if level in frequent] + [OTHER_LEVEL], [level for level in levels if level not in frequent]
+
+def _encoded_layout(input_columns: list, encoding: str) -> tuple:
+    if encoding == "ordinal":
+        return [c["name"] for c in input_columns], [c["name"] for c in input_columns]
+    # get_dummies order: untouched columns first, then the dummies of each categorical column
+    numeric = [c["name"] for c in input_columns if c["kind"] == "numeric"]
+    dummies = [(f"{c['name']}_{level}", c["name"]) for c in input_columns if c["kind"] == "categorical" for level in c["categories"]]
+    return numeric + [name for name, _ in dummies], numeric + [group for _, group in dummies]
+
+
+# X: feature frame right before encoding (dropped columns and NaN rows already removed)
+def fit_preprocessor(X: pd.DataFrame, dropped_columns: list, encoding: str = "one_hot", max_categories: int = 0) -> dict:
+    if encoding not in ENCODING_STRATEGIES:
+        raise PreprocessingError(f"Unknown encoding: {encoding}. Expected one of {ENCODING_STRATEGIES}")
+    categorical = set(X.select_dtypes(include=["object", "string", "category"]).columns) # what get_dummies encodes
+    input_columns = []
+    for col in X.columns:
+        if col in categorical:
+            # other_levels: training levels folded into the OTHER_LEVEL bucket; they are known values, not unseen ones
+            levels, other_levels = _kept_levels(X[col], max_categories)
+            input_columns.append({"name": col, "kind": "categorical", "dtype": str(X[col].dtype), "categories": levels,
+                                  "bucketed": bool(other_levels), "other_levels": other_levels})
+        else:
+            input_columns.append({"name": col, "kind": "numeric", "dtype": str(X[col].dtype)})
+
+    encoded_columns, feature_groups = _encoded_layout(input_columns, encoding)
+    return {
+        "version": PREPROCESSOR_VERSION,
+        "encoding": encoding,
+        "max_categories": max_categories,
+        "dropped_columns": list(dropped_columns),
+        "input_columns": input_columns,
+        "encoded_columns": encoded_columns,
+        "feature_groups": feature_groups, # input feature of each encoded column, same order
+    }
+
+
+# Back to the training dtype only when that is lossless: coerced input like 2.9 for an int64 column stays float
+# (casting would truncate it to 2); the forest works on floats either way
+def _numeric_values(values: pd.Series, dtype: str) -> pd.Series:
+    if values.dtype == dtype:
+        return values
+    try:
+        cast = values.astype(dtype)
+    except (TypeError, ValueError, OverflowError):
+        return values
+    return cast if (cast == values).all() else values
+
+# X: clean input frame (input columns only, no missing values). Returns (encoded frame, {column: count of values outside the vocabulary})
+def encode(preprocessor: dict, X: pd.DataFrame) -> tuple:
+    encoding = preprocessor.get("encoding", "one_hot")
+    X = X.copy()
+    unseen_categories = {}
+    categorical = []
+    for column in preprocessor["input_columns"]:
+        name = column["name"]
+        if column["kind"] == "numeric":
+            X[name] = _numeric_values(X[name], column["dtype"])
+            continue
+        values = X[name].astype(str)
+        known = values.isin(column["categories"])
+        # Version 2 preprocessors did not record the bucketed training levels: everything outside the kept ones counts as unseen
+        unseen = int((~(known | values.isin(column.get("other_levels", [])))).sum())
+        if column.get("bucketed"):
+            values = values.where(known, OTHER_LEVEL)
+        if unseen:
+            unseen_categories[name] = unseen
+        encoded = pd.Categorical(values, categories=column["categories"])
+        X[name] = encoded.codes.astype("int32") if encoding == "ordinal" else encoded
+        categorical.append(name)
+
+    if encoding == "ordinal":
+        return X[preprocessor["encoded_columns"]], unseen_categories
+
+    sparse = encoding == "sparse_one_hot"
+    X = pd.get_dummies(X, columns=categorical, sparse=sparse)
+    if sparse:
+        # Every column has to be sparse for scikit-learn to take the frame as a sparse matrix
+        for column in preprocessor["input_columns"]:
+            if column["kind"] == "numeric":
+                X[column["name"]] = pd.arrays.SparseArray(X[column["name"]], fill_value=X[column["name"]].dtype.type(0))
+    return X.reindex(columns=preprocessor["encoded_columns"], fill_value=False), unseen_categories
+
+
+# Returns (X, row_positions, skipped_rows, unseen_categories):
+# X is encoded and aligned to the model's columns; row_positions maps each row of X back to its position in df;
+# skipped_rows lists {"row_index", "reason"} for rows that could not be encoded
+def transform(preprocessor: dict, df: pd.DataFrame) -> tuple:
+    names = [c["name"] for c in preprocessor["input_columns"]]
+    missing = [name for name in names if name not in df.columns]
+    if missing:
+        raise PreprocessingError(f"Missing input columns: {missing}")
+
+    df = df.reset_index(drop=True)
+    columns = {}
+    for column in preprocessor["input_columns"]:
+        series = df[column["name"]]
+        if column["kind"] == "numeric":
+            columns[column["name"]] = series if series.dtype == column["dtype"] else pd.to_numeric(series, errors="coerce")
+        else:
+            columns[column["name"]] = series
+    X = pd.DataFrame(columns, index=df.index)
+
+    null_mask = X.isnull()
+    invalid = null_mask.any(axis=1)
+    skipped_rows = [{"row_index": int(position), "reason": f"missing or invalid values in {X.columns[null_mask.loc[position]].tolist()}"}
+                    for position in X.index[invalid]]
+    X, unseen_categories = encode(preprocessor, X.loc[~invalid])
+    return X, X.index.to_numpy(), skipped_rows, unseen_categories
+
+
+# SHAP's tree explainer works on dense input: sparse-encoded rows are densified right before they are explained
+def densify(X: pd.DataFrame) -> pd.DataFrame:
+    if len(X.columns) and all(isinstance(dtype, pd.SparseDtype) for dtype in X.dtypes):
+        return X.sparse.to_dense()
+    return X
+
+
+def save_preprocessor(preprocessor: dict, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(preprocessor, f)
+
+
+# Returns the persisted transform, or None for models trained before it was saved
+def load_preprocessor(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
@@ -1,86 +1,336 @@
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, confusion_matrix, mean_squared_error, precision_score, recall_score, f1_score, mean_absolute_error, r2_score
 import pandas as pd
 from app.utils.io import check_high_cardinality_and_identifiers
+from app.utils.profile import DatasetProfile, profile_dataframe
+from app.utils.artifact_store import save_frame, frame_fingerprint, save_model
+from app.core.metrics import span, record_shape
+from app.utils.registry import create_model, mark_latest, enforce_retention, model_path, x_test_path, preprocessor_path, read_meta, \
+    find_by_key, register_key, touch_entry, save_result, load_result
+from app.ml_core.preprocessing import fit_preprocessor, encode, save_preprocessor, PREPROCESSOR_VERSION
+from app.core.config import TRAIN_ENCODING, CATEGORICAL_MAX_LEVELS, DEDUPE_ARTIFACTS, TRAIN_PROFILE, TRAIN_CV_FOLDS, TRAIN_CV_WORKERS
+import hashlib
+import importlib.metadata
 import joblib
+import json
 import os
+import tempfile
+import time
+import numpy as np
 
+# Everything besides the data, target, encoding, training profile and CV folds that changes the fitted model or its
+# result. Part of the dedupe key, so bump or extend it whenever training changes in a way that should not reuse older models.
+TRAINING_CONFIG = {"model": "random_forest", "test_size": 0.2, "split_random_state": 42}
 
-def train_model(df: pd.DataFrame, target: str):
+# Forest settings per training profile. max_model_mb caps the in-memory size of the fitted forest: trees are grown in
+# batches and no more are grown once the next batch would exceed the cap (a forest of fewer trees is still a valid,
+# slightly noisier forest). "accurate" is the unbounded scikit-learn default. Every profile fits on all cores.
+TRAINING_PROFILES = {
+    "fast": {"n_estimators": 50, "max_depth": 10, "max_leaf_nodes": 256, "min_samples_leaf": 5, "max_model_mb": 10},
+    "balanced": {"n_estimators": 100, "max_depth": 16, "max_leaf_nodes": 2048, "min_samples_leaf": 2, "max_model_mb": 50},
+    "accurate": {"n_estimators": 100, "max_depth": None, "max_leaf_nodes": None, "min_samples_leaf": 1, "max_model_mb": None},
+}
+MAX_CV_FOLDS = 20
+
+
+class TrainingConfigError(ValueError):
+    pass
+
+
+# Content key of a training run: (dataset content, target, preprocessing, training profile, CV and split config, and
+# the preprocessor format and scikit-learn versions, so an upgrade of either never serves a model built by the old one)
+def training_key(df: pd.DataFrame, target: str, dataset_id: str = None, encoding: str = None, training_profile: str = None, cv_folds: int = None) -> str:
+    training_profile = training_profile or TRAIN_PROFILE
+    content_hash = None
+    if dataset_id is not None:
+        try:
+            content_hash = read_meta("dataset", dataset_id).get("content_hash") # computed at upload time
+        except (OSError, ValueError):
+            pass
+    key = {
+        "dataset": content_hash or frame_fingerprint(df),
+        "target": target,
+        "encoding": encoding or TRAIN_ENCODING,
+        "max_categories": CATEGORICAL_MAX_LEVELS,
+        "training_profile": training_profile,
+        "model_params": TRAINING_PROFILES.get(training_profile),
+        "cv_folds": TRAIN_CV_FOLDS if cv_folds is None else cv_folds,
+        **TRAINING_CONFIG,
+        "preprocessor_version": PREPROCESSOR_VERSION,
+        "sklearn_version": importlib.metadata.version("scikit-learn"), # read from the package metadata, without importing it
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+# Stored result of an identical earlier training run (its model, X_test and explanation cache are reused as they are)
+def _reuse_trained_model(key: str, dataset_id: str = None):
+    model_id = find_by_key("model", key)
+    result = load_result(model_id) if model_id else None
+    if result is None:
+        return None
+    touch_entry("model", model_id)
+    mark_latest("model", model_id)
+    return {**result, "dataset_id": dataset_id or result.get("dataset_id"), "reused": True}
+
+
+def _evaluate(task: str, y_true, y_pred, digits: int = 2) -> dict:
+    from sklearn.metrics import accuracy_score, confusion_matrix, mean_squared_error, precision_score, recall_score, f1_score, mean_absolute_error, r2_score
+    if task == "classification":
+        return {
+            "accuracy": round(accuracy_score(y_true, y_pred), digits),
+            "confusion_matrix": confusion_matrix(y_true, y_pred).tolist(),
+            "precision": round(precision_score(y_true, y_pred, average="weighted"), digits),
+            "recall": round(recall_score(y_true, y_pred, average="weighted"), digits),
+            "f1_score": round(f1_score(y_true, y_pred, average="weighted"), digits)
+        }
+    return {
+        "mse": round(mean_squared_error(y_true, y_pred), digits),
+        "mae": round(mean_absolute_error(y_true, y_pred), digits),
+        "r2": round(r2_score(y_true, y_pred), digits)
+    }
+
+# In-memory size of a fitted forest: node and value arrays of every tree (what dominates pickles and TreeSHAP's copies)
+def forest_nbytes(model, trees=None) -> list:
+    return [tree.tree_.__getstate__()["nodes"].nbytes + tree.tree_.value.nbytes for tree in (trees or model.estimators_)]
+
+# Upper bound of one tree's size before anything is fitted: a tree has at most 2 * leaves - 1 nodes, and its leaves
+# are bounded by max_leaf_nodes and by the training rows / min_samples_leaf. None when nothing bounds the leaves.
+def tree_nbytes_bound(model, num_rows: int, num_values: int):
+    from sklearn.tree._tree import NODE_DTYPE
+    bounds = [model.max_leaf_nodes] if model.max_leaf_nodes else []
+    if isinstance(model.min_samples_leaf, int): # a float min_samples_leaf is a fraction of the rows
+        bounds.append(num_rows // max(model.min_samples_leaf, 1))
+    if not bounds:
+        return None
+    return (2 * max(min(bounds), 1) - 1) * (NODE_DTYPE.itemsize + 8 * num_values)
+
+def _as_matrix(X: pd.DataFrame):
+    # Plain float32 matrix (what the forest converts its input to anyway); sparse-encoded frames stay sparse
+    if len(X.columns) and all(isinstance(dtype, pd.SparseDtype) for dtype in X.dtypes):
+        return X.sparse.to_coo().tocsr().astype(np.float32)
+    return X.to_numpy(dtype=np.float32)
+
+def _fit_and_score_fold(model, X, y, train_index, test_index, task):
+    model.fit(X[train_index], y[train_index])
+    return _evaluate(task, y[test_index], model.predict(X[test_index]), digits=6)
+
+# k-fold cross-validated metrics (mean and std over folds). Folds are fitted in parallel processes; the encoded matrix
+# is written once and memory-mapped by every fold worker instead of being copied to each of them.
+def cross_validate(model, X: pd.DataFrame, y: pd.Series, task: str, folds: int) -> dict:
+    from joblib import Parallel, delayed
+    from sklearn.base import clone
+    from sklearn.model_selection import KFold, StratifiedKFold
+    y_values = y.to_numpy()
+    splitter = KFold(n_splits=folds, shuffle=True, random_state=TRAINING_CONFIG["split_random_state"])
+    if task == "classification" and y.value_counts().min() >= folds:
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=TRAINING_CONFIG["split_random_state"])
+    fold_model = clone(model).set_params(n_jobs=1) # the folds already use the cores
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="xai-cv-") as tmp_dir:
+        matrix_path = os.path.join(tmp_dir, "X.joblib")
+        joblib.dump(_as_matrix(X), matrix_path)
+        X_shared = joblib.load(matrix_path, mmap_mode="r")
+        scores = Parallel(n_jobs=TRAIN_CV_WORKERS)(
+            delayed(_fit_and_score_fold)(fold_model, X_shared, y_values, train_index, test_index, task)
+            for train_index, test_index in splitter.split(np.zeros(len(y_values)), y_values)
+        )
+
+    metrics = {}
+    for name in scores[0]:
+        if name == "confusion_matrix":
+            continue
+        values = [score[name] for score in scores]
+        metrics[name] = {"mean": round(float(np.mean(values)), 4), "std": round(float(np.std(values)), 4)}
+    return {"folds": folds, "stratified": isinstance(splitter, StratifiedKFold), "metrics": metrics, "seconds": round(time.perf_counter() - started, 3)}
+
+# Median single-row prediction time and the per-row time of the batch prediction on the test set
+def _inference_latency(model, X_test: pd.DataFrame, batch_seconds: float, repeats: int = 5) -> dict:
+    timings = []
+    for i in range(min(repeats, len(X_test))):
+        started = time.perf_counter()
+        model.predict(X_test.iloc[i:i + 1])
+        timings.append(time.perf_counter() - started)
+    return {
+        "single_row_ms": round(float(np.median(timings)) * 1000, 3) if timings else None,
+        "batch_rows": len(X_test),
+        "batch_per_row_ms": round(batch_seconds * 1000 / len(X_test), 4) if len(X_test) else None,
+    }
+
+
+# Fits the forest in batches of trees (warm_start), each batch adding trees to the same forest. Progress is reported
+# after each batch, so a background job can be cancelled during a long fit instead of only after it.
+# max_bytes bounds the fit itself: the first batch is sized by tree_nbytes_bound, later ones by the mean size of the
+# trees grown so far, and growing stops once no further tree fits. Returns the number of trees fitted.
+def _fit_in_batches(model, X, y, report, start: float, end: float, batches: int = 10, max_bytes: int = None) -> int:
+    from sklearn.base import is_classifier
+    total = model.n_estimators
+    batch = max(1, -(-total // batches))
+    fitted, used = 0, 0
+    model.set_params(warm_start=True)
+    while fitted < total:
+        count = min(total, fitted + batch)
+        if max_bytes:
+            if fitted:
+                affordable = fitted + int((max_bytes - used) // (used / fitted))
+            else:
+                bound = tree_nbytes_bound(model, X.shape[0], len(np.unique(y)) if is_classifier(model) else 1) # values per node
+                affordable = max(int(max_bytes // bound), 1) if bound else count
+            count = min(count, affordable)
+            if count <= fitted:
+                break
+        model.set_params(n_estimators=count)
+        model.fit(X, y)
+        fitted = count
+        used = sum(forest_nbytes(model)) if max_bytes else 0
+        report(start + (end - start) * fitted / total, "fitting")
+    if max_bytes and used > max_bytes and fitted > 1:
+        # Trees larger than the running mean can overshoot the cap slightly: drop the few last ones that do not fit
+        keep = max(int(np.searchsorted(np.cumsum(forest_nbytes(model)), max_bytes, side="right")), 1)
+        model.estimators_ = model.estimators_[:keep]
+        fitted = keep
+    model.set_params(warm_start=False, n_estimators=fitted)
+    return fitted
+
+
+# profile: DatasetProfile computed at upload time; reused so columns are not re-scanned here
+# dataset_id: registry ID of df, recorded with the model. Every fit writes a new model ID (see app/utils/registry.py);
+# with DEDUPE_ARTIFACTS a repeated run on the same content/target/config returns the stored model instead of refitting
+# progress: optional callback(fraction, stage) used by background jobs to report progress (and to cancel between stages
+# and between batches of trees while fitting)
+# encoding: categorical encoding strategy (see app/ml_core/preprocessing.py), TRAIN_ENCODING by default
+# training_profile: key of TRAINING_PROFILES, TRAIN_PROFILE by default
+# cv_folds: >= 2 adds k-fold cross-validated metrics (cv_metrics); 0 disables them; TRAIN_CV_FOLDS by default
+def train_model(df: pd.DataFrame, target: str, profile: DatasetProfile = None, dataset_id: str = None, progress=None, encoding: str = None,
+                training_profile: str = None, cv_folds: int = None):
+    # scikit-learn is imported on first use: it is the slowest import of the app and only training needs it
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+    from sklearn.model_selection import train_test_split
+    report = progress or (lambda fraction, stage: None)
+    encoding = encoding or TRAIN_ENCODING
+    training_profile = training_profile or TRAIN_PROFILE
+    cv_folds = TRAIN_CV_FOLDS if cv_folds is None else cv_folds
+    if training_profile not in TRAINING_PROFILES:
+        raise TrainingConfigError(f"Unknown training profile: {training_profile}. Expected one of {list(TRAINING_PROFILES)}")
+    if cv_folds and not 2 <= cv_folds <= MAX_CV_FOLDS:
+        raise TrainingConfigError(f"cv_folds must be 0 or between 2 and {MAX_CV_FOLDS}")
+    if DEDUPE_ARTIFACTS:
+        with span("train.dedupe_lookup"):
+            key = training_key(df, target, dataset_id, encoding, training_profile, cv_folds)
+            reused = _reuse_trained_model(key, dataset_id)
+        if reused is not None:
+            return reused
+    report(0.05, "preprocessing")
+    if profile is None or not profile.matches(df):
+        with span("train.profile"):
+            profile = profile_dataframe(df)
     X = df.drop(columns=[target]) # Drop the target column from the dataframe
     y = df[target] # Target column
 
     # 1. Preprocessing: Drop constant columns, completely null columns, and likely identifiers
-    _, likely_identifiers = check_high_cardinality_and_identifiers(X)
-    drop_cols = likely_identifiers + [col for col in X.columns if X[col].nunique() <= 1]
+    with span("train.cardinality_checks"):
+        _, likely_identifiers = check_high_cardinality_and_identifiers(X, profile)
+        drop_cols = likely_identifiers + [col for col in X.columns if profile[col].nunique <= 1]
     X = X.drop(columns=drop_cols) # Removes any rows in X that have NaNs
     
     # 2. Handle missing values: remove rows with missing values
-    # Step 1: Drop rows where y is missing
-    non_null_mask = y.notnull()
-    X = X.loc[non_null_mask]
-    y = y.loc[non_null_mask]
+    with span("train.missing_values"):
+        # Step 1: Drop rows where y is missing
+        non_null_mask = y.notnull()
+        X = X.loc[non_null_mask]
+        y = y.loc[non_null_mask]
 
-    # Step 2: Drop remaining NaNs in X
-    X = X.dropna()
-    y = y.loc[X.index]  # realign just in case
+        # Step 2: Drop remaining NaNs in X
+        X = X.dropna()
+        y = y.loc[X.index]  # realign just in case
 
 
     # 3. Encoding and Transformations
-    # One hot encoding for object/categorical features
-    X = pd.get_dummies(X)
+    # Categorical features are one-hot (dense or sparse) or ordinal encoded, optionally with rare levels bucketed
+    report(0.15, "encoding")
+    with span("train.encoding"):
+        # The fitted transform (drops, category vocabulary, column order) is saved with the model for scoring new rows
+        preprocessor = fit_preprocessor(X, drop_cols, encoding, CATEGORICAL_MAX_LEVELS)
+        X_raw = X
+        X, _ = encode(preprocessor, X)
+    record_shape("train_features", len(X), X.shape[1])
 
 
     # Basic type detection: placeholder detection criteria
+    settings = dict(TRAINING_PROFILES[training_profile])
+    max_model_mb = settings.pop("max_model_mb")
     if y.dtype in ['float64', 'int64'] and y.nunique() > 15:
         task = "regression"
-        model = RandomForestRegressor()
+        model = RandomForestRegressor(n_jobs=-1, **settings)
     else:
         task = "classification"
-        model = RandomForestClassifier()
+        model = RandomForestClassifier(n_jobs=-1, **settings)
 
    
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TRAINING_CONFIG["test_size"], random_state=TRAINING_CONFIG["split_random_state"])
+    report(0.2, "fitting")
+    with span("train.fit"):
+        started = time.perf_counter()
+        requested_trees = model.n_estimators
+        if progress is None and not max_model_mb:
+            model.fit(X_train, y_train)
+        else:
+            _fit_in_batches(model, X_train, y_train, report, 0.2, 0.55, max_bytes=max_model_mb * 1024 ** 2 if max_model_mb else None)
+        fit_seconds = time.perf_counter() - started
+    # Served predictions are single requests on a shared server: one thread each instead of a pool per call
+    model.set_params(n_jobs=None)
 
-    # After the training is done, we can save the model in artifacts folder (not tracked by git)
-    os.makedirs("artifacts", exist_ok=True)
-    joblib.dump(model, "artifacts/latest_model.pkl")
-    X_test.to_csv("artifacts/X_test.csv", index=False) # Save X_test in the artifacts folder
+    cv_metrics = None
+    if cv_folds:
+        report(0.6, "cross-validating")
+        with span("train.cross_validate"):
+            cv_metrics = cross_validate(model, X, y, task, cv_folds)
 
-    if task == "classification":
-        acc = accuracy_score(y_test, y_pred)
-        cm = confusion_matrix(y_test, y_pred).tolist()
-        precision = precision_score(y_test, y_pred, average="weighted")
-        recall = recall_score(y_test, y_pred, average="weighted")
-        f1 = f1_score(y_test, y_pred, average="weighted")
+    report(0.8, "evaluating")
+    with span("train.predict"):
+        started = time.perf_counter()
+        y_pred = model.predict(X_test)
+        batch_seconds = time.perf_counter() - started
+        inference_latency = _inference_latency(model, X_test, batch_seconds)
 
-    else:
-        mse = mean_squared_error(y_test, y_pred)
-        mae = mean_absolute_error(y_test, y_pred)
-        r2 = r2_score(y_test, y_pred)
+    # After the training is done, we can save the model in its own artifacts folder (not tracked by git)
+    report(0.85, "saving artifacts")
+    with span("train.save_artifacts"):
+        model_id = create_model(dataset_id, target, key if DEDUPE_ARTIFACTS else None)
+        if encoding == "sparse_one_hot":
+            # Arrow has no sparse columns: keep the compact raw rows instead, they are re-encoded when the model is loaded
+            preprocessor["x_test_format"] = "raw"
+            save_frame(X_raw.loc[X_test.index], x_test_path(model_id))
+        else:
+            save_frame(X_test, x_test_path(model_id)) # Save X_test in the artifacts folder (typed columnar format, not CSV)
+        save_preprocessor(preprocessor, preprocessor_path(model_id))
+        save_model(model, model_path(model_id)) # written last: the model only becomes visible once it is complete
+        mark_latest("model", model_id)
+        enforce_retention("model", keep=(model_id,))
+
+    with span("train.metrics"):
+        metrics = _evaluate(task, y_test, y_pred)
         
-    return {
+    result = {
+        "model_id": model_id,
+        "dataset_id": dataset_id,
         "task": task,
         "model_type": type(model).__name__,
-        "metrics": {
-            "accuracy": round(acc, 2),
-            "confusion_matrix": cm,
-            "precision": round(precision, 2),
-            "recall": round(recall, 2),
-            "f1_score": round(f1, 2)
-        } if task == "classification" else {
-            "mse": round(mse, 2),
-            "mae": round(mae, 2),
-            "r2": round(r2, 2)
-        },
+        "metrics": metrics,
+        "cv_metrics": cv_metrics,
+        "training_profile": training_profile,
+        "model_params": {**settings, "n_estimators": model.n_estimators, "n_estimators_requested": requested_trees},
+        "model_size_bytes": os.path.getsize(model_path(model_id)), # on disk (compressed when MODEL_COMPRESSION > 0)
+        "model_memory_bytes": int(sum(forest_nbytes(model))),
+        "fit_seconds": round(fit_seconds, 3),
+        "inference_latency": inference_latency,
         "final_columns": X.columns.tolist(),
         "dropped_columns": drop_cols,
         "row_count_before_preprocessing": len(df),
         "row_count_after_preprocessing": len(X),
-        "feature_encoding": "one_hot",
-        "missing_value_strategy": "drop"
+        "feature_encoding": encoding,
+        "missing_value_strategy": "drop",
+        "reused": False,
     }
+    save_result(model_id, result)
+    if DEDUPE_ARTIFACTS:
+        register_key("model", key, model_id)
+    return result
@@ -4,28 +4,105 @@ The API layer. It defines what API endpoints exist and what they trigger.
 This is where the API routes live.
 '''
 
-from fastapi import APIRouter, UploadFile, HTTPException, Query
-from app.utils.io import read_uploaded_csv, validate_dataframe
+from fastapi import APIRouter, UploadFile, HTTPException, Query, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.exceptions import HTTPException as StarletteHTTPException
+import asyncio
+import json
+from app.utils.io import read_uploaded_csv, validate_dataframe, profile_csv_approximate, UploadTooLargeError, CsvBodyStream, \
+    UnsupportedUploadError
+from app.utils.profile import profile_dataframe, save_profile, load_profile
+from app.utils.artifact_store import save_frame, load_frame, frame_fingerprint
+from app.utils.response_formats import RESPONSE_FORMATS, negotiate_format, explanation_to_arrow_ipc
+from app.utils.registry import UnknownArtifactError, create_dataset, dataset_path, profile_path, mark_latest, resolve_dataset_id, enforce_retention, find_by_key, register_key, touch_entry
 from pydantic import BaseModel
+from typing import Optional, List, Dict, Any
 import pandas as pd
-from app.ml_core.train import train_model
-from app.ml_core.explain import shap_values
+from app.ml_core.train import train_model, TrainingConfigError
+from app.ml_core.explain import shap_values, prepare_explanation, stream_shap_values, score_and_explain, EXPLANATION_MODES
+from app.ml_core.preprocessing import PreprocessingError, ENCODING_STRATEGIES
+from app.core.config import PREDICT_MAX_ROWS, DEDUPE_ARTIFACTS, PRECOMPUTE_EXPLANATIONS
+from app.core.jobs import submit_precompute_job, JobQueueFullError
+from app.core.metrics import span, record_shape
 
 router = APIRouter() # Create a router instance. Lets you modularize routes — good for scaling APIs.
 
+# Parsing, validation and saving are blocking pandas work, so they run in a worker thread instead of on the event loop
+def ingest_csv(file: UploadFile) -> dict:
+    with span("io.read_csv"):
+        df = read_uploaded_csv(file)
+    record_shape("upload", len(df), df.shape[1])
+    with span("io.fingerprint"):
+        content_hash = frame_fingerprint(df)
+
+    # The same content was uploaded before: reuse that dataset (and its profile) instead of writing a copy
+    dataset_id = find_by_key("dataset", content_hash) if DEDUPE_ARTIFACTS else None
+    profile = load_profile(profile_path(dataset_id)) if dataset_id else None
+    if profile is not None:
+        with span("io.validate"):
+            validation = validate_dataframe(df, profile)
+        touch_entry("dataset", dataset_id)
+        mark_latest("dataset", dataset_id)
+        return {"dataset_id": dataset_id, "reused": True, **validation}
+
+    with span("io.profile"):
+        profile = profile_dataframe(df) # single profiling pass shared by validation and training
+    with span("io.validate"):
+        validation = validate_dataframe(df, profile)
+
+    # Optional: Save it for reuse. If you observe corrupted csv files are mostly handled in except block so it's not even saved temporarily. It means in many cases, corrupted files are (mostly) not even allowed to enter the pipeline let alone dealing with that in a later step.
+    # Each new upload gets its own dataset ID, so concurrent uploads never overwrite each other
+    dataset_id = create_dataset(content_hash)
+    with span("io.save_dataset"):
+        save_profile(profile, profile_path(dataset_id))
+        save_frame(df, dataset_path(dataset_id)) # written last: the dataset only becomes visible once it is complete
+    register_key("dataset", content_hash, dataset_id)
+    mark_latest("dataset", dataset_id)
+    enforce_retention("dataset", keep=(dataset_id,))
+
+    return {"dataset_id": dataset_id, "reused": False, **validation}
+
 @router.post("/upload-csv") # define a POST endpoint at /upload-csv. Expects a file in request body
 async def upload_csv(file: UploadFile):
     if not file.filename.endswith(".csv"):
         raise HTTPException(status_code=400, detail="Only CSV files are supported.")
 
     try:
-        df = read_uploaded_csv(file)
-        validation = validate_dataframe(df)
+        return await run_in_threadpool(ingest_csv, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Optional: Save it for reuse. If you observe corrupted csv files are mostly handled in except block so it's not even saved temporarily. It means in many cases, corrupted files are (mostly) not even allowed to enter the pipeline let alone dealing with that in a later step.
-        df.to_csv("data/last_uploaded.csv", index=False)
+# Approximate profile of a CSV that may be far too large to upload for training (multi-GB): parsed while the body is
+# still arriving (nothing is spooled to disk) and summarized by mergeable sketches in bounded memory, nothing is stored.
+# Takes the same multipart form as /upload-csv or a raw CSV body. Same validation output as /upload-csv (target
+# candidates, cardinality and identifier warnings) plus per-column error bounds of the estimates.
+def profile_csv(stream) -> dict:
+    with span("io.profile_approximate"):
+        profile = profile_csv_approximate(stream)
+    record_shape("profile", profile.row_count, len(profile.columns))
+    with span("io.validate"):
+        return validate_dataframe(None, profile)
 
-        return validation
+@router.post("/profile-csv")
+async def profile_csv_endpoint(request: Request):
+    stream = CsvBodyStream()
+    profiling = asyncio.ensure_future(run_in_threadpool(profile_csv, stream)) # reads the body while it is received
+    try:
+        try:
+            await stream.feed(request)
+        finally:
+            result = await asyncio.gather(profiling, return_exceptions=True)
+        if isinstance(result[0], BaseException):
+            raise result[0]
+        return result[0]
+    except StarletteHTTPException:
+        raise # 413 from the body size limit (app/core/upload_limits.py), raised while the body is read
+    except UnsupportedUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -37,23 +114,144 @@ This keeps the code clean and secure — no manual request.json()["target"] or c
 
 class TrainRequest(BaseModel):
     target: str
+    dataset_id: Optional[str] = None # defaults to the most recent upload
+    encoding: Optional[str] = None # one_hot, sparse_one_hot or ordinal; TRAIN_ENCODING by default
+    precompute_explanations: Optional[bool] = None # PRECOMPUTE_EXPLANATIONS by default
+    training_profile: Optional[str] = None # fast, balanced or accurate; TRAIN_PROFILE by default
+    cv_folds: Optional[int] = None # >= 2 adds k-fold cross-validated metrics, 0 disables them; TRAIN_CV_FOLDS by default
 
+# Training is blocking (pandas + model.fit), so it runs in a worker thread to keep the event loop responsive.
+# For long fits use POST /jobs/train instead, which runs on the background process pool.
+# With precompute_explanations the explanations are computed afterwards by a background job (precompute_job_id in
+# the response); explain requests arriving before it finishes wait for it instead of computing them a second time.
 @router.post("/train-model")
 async def train_endpoint(request: TrainRequest):
+    if request.encoding is not None and request.encoding not in ENCODING_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {list(ENCODING_STRATEGIES)}")
     try:
-        df = pd.read_csv("data/last_uploaded.csv")
+        dataset_id = resolve_dataset_id(request.dataset_id)
+        df = await run_in_threadpool(load_frame, dataset_path(dataset_id))
         if request.target not in df.columns:
             raise HTTPException(status_code=400, detail="Invalid target column")
         
-        result = train_model(df, request.target)
+        result = await run_in_threadpool(train_model, df, request.target, load_profile(profile_path(dataset_id)), dataset_id, None, request.encoding,
+                                         request.training_profile, request.cv_folds)
+        precompute = PRECOMPUTE_EXPLANATIONS if request.precompute_explanations is None else request.precompute_explanations
+        if precompute:
+            try:
+                job = await run_in_threadpool(submit_precompute_job, result["model_id"])
+                result = {**result, "precompute_job_id": job["job_id"]}
+            except JobQueueFullError:
+                result = {**result, "precompute_job_id": None} # explanations are then computed by the first explain request
         return result
+    except HTTPException:
+        raise
+    except TrainingConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnknownArtifactError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Query parameters are are specified in the URL after a ?. so if not provided, it will default to 0 and 5.
+# model_id defaults to the most recently trained model
+# mode=budgeted returns a fast approximate answer within budget_rows (global sample size) and/or budget_seconds;
+# mode=exact (default) is the full TreeSHAP result
 @router.get("/explain-model")
-async def explain_endpoint(start: int = Query(0), end: int = Query(1)):
+async def explain_endpoint(start: int = Query(0), end: int = Query(1), model_id: Optional[str] = Query(None),
+                           mode: str = Query("exact"), budget_rows: Optional[int] = Query(None, ge=1),
+                           budget_seconds: Optional[float] = Query(None, gt=0), format: Optional[str] = Query(None),
+                           accept: Optional[str] = Header(None)):
+    if mode not in EXPLANATION_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(EXPLANATION_MODES)}")
+    # format=verbose (default) | columnar | arrow, or the matching media type in the Accept header (see app/utils/response_formats.py)
+    response_format = negotiate_format(format, accept)
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(RESPONSE_FORMATS)}")
+    try:
+        if response_format == "verbose":
+            return await run_in_threadpool(shap_values, start, end, model_id, mode, budget_rows, budget_seconds)
+        # Compact formats are returned directly, skipping FastAPI's per-value jsonable_encoder pass
+        if response_format == "arrow":
+            payload = await run_in_threadpool(shap_values, start, end, model_id, mode, budget_rows, budget_seconds, "arrays")
+            return Response(await run_in_threadpool(explanation_to_arrow_ipc, payload), media_type=RESPONSE_FORMATS["arrow"])
+        payload = await run_in_threadpool(shap_values, start, end, model_id, mode, budget_rows, budget_seconds, "columnar")
+        return JSONResponse(payload, media_type=RESPONSE_FORMATS["columnar"])
+    except UnknownArtifactError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Streaming variant of /explain-model: global importances first, then local explanations in batches as they are
+# computed, so clients can render the first rows right away. format=ndjson (one JSON object per line) or sse
+# (server-sent events, event name = "global" / "local" / "done" / "error").
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def format_stream_event(payload: dict, fmt: str) -> str:
+    data = json.dumps(jsonable_encoder(payload))
+    if fmt == "sse":
+        return f"event: {payload['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def explanation_stream(context, start, end, batch_rows, fmt):
     try:
-        return shap_values(start, end)
+        for payload in stream_shap_values(context, start, end, batch_rows):
+            yield format_stream_event(payload, fmt)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        # The status code is already sent at this point, so failures are reported in-band
+        yield format_stream_event({"event": "error", "detail": str(e)}, fmt)
+
+@router.get("/explain-model/stream")
+async def explain_stream_endpoint(start: int = Query(0), end: int = Query(1), model_id: Optional[str] = Query(None),
+                                  mode: str = Query("exact"), budget_rows: Optional[int] = Query(None, ge=1),
+                                  budget_seconds: Optional[float] = Query(None, gt=0),
+                                  batch_rows: Optional[int] = Query(None, ge=1), format: str = Query("ndjson")):
+    if mode not in EXPLANATION_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(EXPLANATION_MODES)}")
+    if format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(STREAM_FORMATS)}")
+    try:
+        # Model loading and global importances happen before the response starts, so errors still get a status code
+        context = await run_in_threadpool(prepare_explanation, model_id, mode, budget_rows, budget_seconds)
+    except UnknownArtifactError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # A sync generator: StreamingResponse iterates it in the threadpool, one batch at a time
+    return StreamingResponse(explanation_stream(context, start, end, batch_rows, format), media_type=STREAM_FORMATS[format],
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Real-time inference path: score and explain new raw rows (same columns as the uploaded dataset; the target and
+# dropped columns may be omitted) with a trained model. Rows are sent as JSON records or as a CSV file.
+class PredictRequest(BaseModel):
+    rows: List[Dict[str, Any]]
+    model_id: Optional[str] = None # defaults to the most recently trained model
+
+async def run_score_and_explain(rows: pd.DataFrame, model_id: Optional[str]):
+    if len(rows) > PREDICT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_MAX_ROWS} rows can be scored per request.")
+    try:
+        return await run_in_threadpool(score_and_explain, rows, model_id)
+    except UnknownArtifactError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PreprocessingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/predict-explain")
+async def predict_explain_endpoint(request: PredictRequest):
+    return await run_score_and_explain(pd.DataFrame.from_records(request.rows), request.model_id)
+
+@router.post("/predict-explain/csv")
+async def predict_explain_csv_endpoint(file: UploadFile, model_id: Optional[str] = Query(None)):
+    if not file.filename.endswith(".csv"):
+        raise HTTPException(status_code=400, detail="Only CSV files are supported.")
+    try:
+        rows = await run_in_threadpool(read_uploaded_csv, file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await run_score_and_explain(rows, model_id)
@@ -0,0 +1,79 @@
+'''
+Routes for background jobs: submit training or explanation precomputation, poll status/progress, fetch the result, cancel.
+'''
+
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import Optional
+from app.core.jobs import submit_training_job, submit_precompute_job, get_job, cancel_job, JobQueueFullError, UnknownJobError
+from app.utils.registry import UnknownArtifactError
+from app.ml_core.preprocessing import ENCODING_STRATEGIES
+from app.ml_core.train import TRAINING_PROFILES, MAX_CV_FOLDS
+
+router = APIRouter(prefix="/jobs")
+
+class TrainJobRequest(BaseModel):
+    target: str
+    dataset_id: Optional[str] = None # defaults to the most recent upload
+    precompute_explanations: Optional[bool] = None # also precompute explanations once the model is trained; PRECOMPUTE_EXPLANATIONS by default
+    encoding: Optional[str] = None # categorical encoding strategy, TRAIN_ENCODING by default
+    training_profile: Optional[str] = None # fast, balanced or accurate; TRAIN_PROFILE by default
+    cv_folds: Optional[int] = None # >= 2 adds k-fold cross-validated metrics, 0 disables them; TRAIN_CV_FOLDS by default
+
+# Returns immediately with a job_id; poll GET /jobs/{job_id} for progress
+@router.post("/train", status_code=202)
+async def submit_train_job(request: TrainJobRequest):
+    if request.encoding is not None and request.encoding not in ENCODING_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {list(ENCODING_STRATEGIES)}")
+    if request.training_profile is not None and request.training_profile not in TRAINING_PROFILES:
+        raise HTTPException(status_code=400, detail=f"training_profile must be one of {list(TRAINING_PROFILES)}")
+    if request.cv_folds and not 2 <= request.cv_folds <= MAX_CV_FOLDS:
+        raise HTTPException(status_code=400, detail=f"cv_folds must be 0 or between 2 and {MAX_CV_FOLDS}")
+    try:
+        return await run_in_threadpool(submit_training_job, request.target, request.dataset_id, request.precompute_explanations, request.encoding,
+                                       request.training_profile, request.cv_folds)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except UnknownArtifactError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+class PrecomputeJobRequest(BaseModel):
+    model_id: Optional[str] = None # defaults to the most recently trained model
+
+@router.post("/precompute", status_code=202)
+async def submit_precompute(request: PrecomputeJobRequest):
+    try:
+        return await run_in_threadpool(submit_precompute_job, request.model_id)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except UnknownArtifactError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    try:
+        state = get_job(job_id)
+    except UnknownJobError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    state.pop("result", None) # the (possibly large) result has its own endpoint
+    return state
+
+@router.get("/{job_id}/result")
+async def job_result(job_id: str):
+    try:
+        state = get_job(job_id)
+    except UnknownJobError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if state["status"] == "failed":
+        raise HTTPException(status_code=500, detail=state.get("error"))
+    if state["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {state['status']}.")
+    return state["result"]
+
+@router.post("/{job_id}/cancel")
+async def job_cancel(job_id: str):
+    try:
+        return cancel_job(job_id)
+    except UnknownJobError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,88 @@
+'''
+Artifact store: datasets and test matrices are persisted as uncompressed Arrow IPC (Feather v2) files instead of CSV.
+
+- dtypes survive the round trip exactly (one-hot bool columns come back as bool, ints stay ints)
+- reads are memory-mapped: numeric columns are used straight from the page cache without parsing or copying
+- legacy .csv artifacts are migrated to .arrow transparently the first time they are read
+
+Models are joblib pickles, uncompressed by default so they are loaded memory-mapped and shared between processes.
+MODEL_COMPRESSION > 0 compresses them with zlib: smaller on disk, but decompressed into memory by every loader.
+'''
+import hashlib
+import os
+import joblib
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from app.core.config import MODEL_COMPRESSION
+
+
+def _to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # Object columns mixing python types (e.g. ints and strings) have no Arrow type: store their values as text
+        df = df.copy()
+        for col in df.columns:
+            if pd.api.types.is_object_dtype(df[col]):
+                df[col] = df[col].where(df[col].isnull(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def save_frame(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Write to a temporary file first: readers that still have the old file memory-mapped keep a valid copy
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(_to_arrow_table(df), tmp_path, compression="uncompressed") # uncompressed so reads can be zero-copy
+    os.replace(tmp_path, path)
+
+
+def legacy_csv_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".csv"
+
+
+# Converts an existing CSV artifact to the columnar format next to it and returns the new path
+def migrate_csv_artifact(csv_path: str, path: str = None) -> str:
+    path = path or os.path.splitext(csv_path)[0] + ".arrow"
+    save_frame(pd.read_csv(csv_path), path)
+    return path
+
+
+def load_frame(path: str, columns: list = None) -> pd.DataFrame:
+    if not os.path.exists(path):
+        legacy_path = legacy_csv_path(path)
+        if not os.path.exists(legacy_path):
+            raise FileNotFoundError(f"No artifact found at {path}")
+        migrate_csv_artifact(legacy_path, path)
+
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    # split_blocks avoids consolidating columns into 2D blocks, which lets numeric columns stay zero-copy views of the mapped file
+    return table.to_pandas(split_blocks=True)
+
+
+# Content hash of a parsed frame: column names, dtypes and every value in order, hashed vectorized (no CSV bytes
+# needed). Identical uploads get the same fingerprint even when the file bytes differ (line endings, quoting, ...)
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    digest = hashlib.sha256()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    if len(df):
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def save_model(model, path: str, compress: int = None):
+    compress = MODEL_COMPRESSION if compress is None else compress
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path, compress=compress)
+    os.replace(tmp_path, path)
+
+def is_compressed(path: str) -> bool:
+    # An uncompressed joblib file is a plain pickle, which starts with the PROTO opcode (0x80)
+    with open(path, "rb") as f:
+        return f.read(1) != b"\x80"
+
+def load_model(path: str):
+    # mmap_mode lets numpy arrays inside the pickle be mapped from the page cache instead of copied into the heap;
+    # it does not apply to compressed files (joblib would warn and ignore it)
+    return joblib.load(path) if is_compressed(path) else joblib.load(path, mmap_mode="r")
@@ -1,37 +1,45 @@
-from fastapi import UploadFile
+from fastapi import UploadFile, Request
 import pandas as pd
-import os
+import asyncio
 import io
-from pandas.api.types import is_numeric_dtype, is_string_dtype, is_categorical_dtype
+import math
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from app.core.config import MAX_UPLOAD_BYTES, MAX_UPLOAD_ROWS, CSV_CHUNK_ROWS, CSV_DTYPE_SAMPLE_ROWS, PROFILE_WORKERS
+from app.utils.profile import DatasetProfile, profile_dataframe
+from app.utils.sketch import FrameSketch, sketch_frame
+
+_profile_executor = None
+_profile_lock = threading.Lock()
 
-def detect_column_types(df: pd.DataFrame) -> dict:
+def detect_column_types(df: pd.DataFrame, profile: DatasetProfile = None) -> dict:
+    profile = profile or profile_dataframe(df)
     result = {
         "numeric": [],
         "categorical": []
     }
 
-    for col in df.columns:
-        series = df[col]
-        nunique = series.nunique()
+    for column in profile.columns:
+        col = column.name
 
         # Step 1: If it's already numeric
-        if pd.api.types.is_numeric_dtype(series):
-            if nunique > 15:
+        if column.dtype_class == "numeric":
+            if column.nunique > 15:
                 result["numeric"].append(col)
             else:
                 result["categorical"].append(col)
 
         # Step 2: If it's string or categorical type
-        elif pd.api.types.is_string_dtype(series) or pd.api.types.is_categorical_dtype(series):
+        elif column.dtype_class == "string":
             result["categorical"].append(col)
 
         # Step 3: Try to coerce to numeric (e.g., object that looks like numbers)
         else:
-            coerced = pd.to_numeric(series, errors='coerce')
-            valid_ratio = coerced.notnull().sum() / len(series)
-
-            if valid_ratio > 0.8:  # It's mostly coercible to numeric
-                if coerced.nunique() > 15:
+            if column.numeric_ratio > 0.8:  # It's mostly coercible to numeric
+                if column.numeric_nunique > 15:
                     result["numeric"].append(col)
                 else:
                     result["categorical"].append(col)
@@ -42,42 +50,264 @@ def detect_column_types(df: pd.DataFrame) -> dict:
 
 
 
+class UploadTooLargeError(ValueError):
+    pass
+
+
+def _upload_size(stream) -> int:
+    # UploadFile is already spooled to a temp file by Starlette, so seeking is cheap and nothing is copied
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def _infer_sample_dtypes(stream) -> dict:
+    # Pin the dtypes of float and text columns from a leading sample, so every chunk is parsed the same way.
+    # Integer/bool columns are left to the parser: a later chunk with missing values would not fit them.
+    sample = pd.read_csv(stream, nrows=CSV_DTYPE_SAMPLE_ROWS)
+    stream.seek(0)
+    return {
+        col: dtype for col, dtype in sample.dtypes.items()
+        if pd.api.types.is_float_dtype(dtype) or pd.api.types.is_object_dtype(dtype)
+    }
+
+
+def _read_csv_in_chunks(stream, dtypes: dict) -> pd.DataFrame:
+    chunks = []
+    row_count = 0
+    chunk_kinds = {} # column -> set of dtype kinds seen across chunks
+    for chunk in pd.read_csv(stream, dtype=dtypes, chunksize=CSV_CHUNK_ROWS):
+        row_count += len(chunk)
+        if row_count > MAX_UPLOAD_ROWS:
+            raise UploadTooLargeError(f"CSV has more than the maximum of {MAX_UPLOAD_ROWS} rows.")
+        for col, dtype in chunk.dtypes.items():
+            chunk_kinds.setdefault(col, set()).add(dtype.kind)
+        chunks.append(chunk)
+
+    # A column that is numeric in one chunk and text in another would end up with mixed python types; signal a re-read
+    if any("O" in kinds and len(kinds) > 1 for kinds in chunk_kinds.values()):
+        raise ValueError("Inconsistent column types across chunks")
+
+    if not chunks:
+        return pd.read_csv(stream) # header-only file: let pandas produce the usual empty frame/error
+    return pd.concat(chunks, ignore_index=True, copy=False)
+
+
 # function takes in the CSV file (of type FastAPI UploadFile) and returns a dataframe
+# The upload is parsed straight from the spooled file in row chunks (no full copy of the bytes in memory),
+# and oversized files are rejected before/while parsing (the request body itself is already capped before it is spooled,
+# see app/core/upload_limits.py). It is blocking, so async callers should run it in a threadpool.
 def read_uploaded_csv(file: UploadFile) -> pd.DataFrame: 
+    stream = file.file
+    size = _upload_size(stream)
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(f"CSV is {size} bytes; the maximum upload size is {MAX_UPLOAD_BYTES} bytes.")
+
     try:
-        contents = file.file.read()
-        df = pd.read_csv(io.BytesIO(contents)) # io.BytesIO(contents) -> wrapping the raw bytes in a file-like object in memory
+        dtypes = _infer_sample_dtypes(stream)
+        try:
+            df = _read_csv_in_chunks(stream, dtypes)
+        except UploadTooLargeError:
+            raise
+        except ValueError:
+            # The sample was not representative (e.g. text further down a float column): fall back to a single unpinned pass
+            stream.seek(0)
+            df = pd.read_csv(stream, nrows=MAX_UPLOAD_ROWS + 1)
+            if len(df) > MAX_UPLOAD_ROWS:
+                raise UploadTooLargeError(f"CSV has more than the maximum of {MAX_UPLOAD_ROWS} rows.")
         return df
+    except UploadTooLargeError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error reading CSV: {str(e)}")
+
+
+def _get_profile_executor() -> ProcessPoolExecutor:
+    global _profile_executor
+    with _profile_lock:
+        if _profile_executor is None:
+            # spawn instead of fork: the API process has threads that must not be forked
+            _profile_executor = ProcessPoolExecutor(max_workers=PROFILE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _profile_executor
+
+def shutdown_profile_pool():
+    global _profile_executor
+    with _profile_lock:
+        if _profile_executor is not None:
+            _profile_executor.shutdown(wait=False, cancel_futures=True)
+            _profile_executor = None
+
+
+# Request body as a blocking binary stream, fed from the event loop while a worker thread reads it. Nothing is spooled:
+# at most _BODY_QUEUE_CHUNKS received chunks wait in memory, and the receiving side pauses while the queue is full.
+# Accepts a raw CSV body (any non-multipart content type) or a multipart form whose "file" field is a .csv file.
+_BODY_QUEUE_CHUNKS = 16
+
+class UnsupportedUploadError(ValueError):
+    pass
+
+class CsvBodyStream(io.RawIOBase):
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=_BODY_QUEUE_CHUNKS)
+        self._pending = b""
+        self._eof = False
+        self.reader_done = threading.Event() # set when the reading side stops early (parse error): stop receiving
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                raise item
+            if item is None:
+                self._eof = True
+            self._pending = item or b""
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    async def _put(self, item):
+        while not self.reader_done.is_set():
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.005)
+
+    # Called from the request handler: forwards the CSV bytes of the body, then end-of-file (or the error that stopped it)
+    async def feed(self, request: Request):
+        from python_multipart.multipart import MultipartParser, parse_options_header
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        try:
+            if content_type != b"multipart/form-data":
+                async for chunk in request.stream():
+                    await self._put(chunk)
+            else:
+                parts, headers, field = [], {}, []
+                def on_header_field(data, start, end):
+                    field.append(data[start:end])
+                def on_header_value(data, start, end):
+                    headers[b"".join(field).lower()] = headers.get(b"".join(field).lower(), b"") + data[start:end]
+                def on_header_end():
+                    field.clear()
+                def on_headers_finished():
+                    _, disposition = parse_options_header(headers.pop(b"content-disposition", b""))
+                    headers.clear()
+                    parts.append([disposition.get(b"name") == b"file", disposition.get(b"filename", b"")])
+                    if parts[-1][0] and not parts[-1][1].decode(errors="replace").endswith(".csv"):
+                        raise UnsupportedUploadError("Only CSV files are supported.")
+                received = []
+                def on_part_data(data, start, end):
+                    if parts and parts[-1][0]:
+                        received.append(bytes(data[start:end]))
+                parser = MultipartParser(options.get(b"boundary", b""), {
+                    "on_header_field": on_header_field, "on_header_value": on_header_value, "on_header_end": on_header_end,
+                    "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+                })
+                async for chunk in request.stream():
+                    parser.write(chunk)
+                    for data in received:
+                        await self._put(data)
+                    received.clear()
+                parser.finalize()
+                if not any(is_file for is_file, _ in parts):
+                    raise UnsupportedUploadError("No CSV file in the form (expected a \"file\" field).")
+        except BaseException as e:
+            await self._put(e if isinstance(e, Exception) else ValueError("Upload interrupted"))
+            raise
+        await self._put(None)
+
+
+# Approximate profile of an upload of any size: the CSV is streamed in chunks, each chunk is summarized into a
+# mergeable sketch (see app/utils/sketch.py) and dropped, so memory is bounded by a few chunks however large the file.
+# With PROFILE_WORKERS > 1 the chunks are sketched on a process pool (at most two chunks per worker in flight).
+# Chunks are parsed independently (no pinned dtypes): the sketches reconcile a column that changes type between chunks.
+# stream: any binary file object, typically a CsvBodyStream parsed while the request body is still arriving (the
+# MAX_PROFILE_BYTES limit is enforced on the body by app/core/upload_limits.py)
+def profile_csv_approximate(stream) -> DatasetProfile:
+    merged = FrameSketch()
+    try:
+        chunks = pd.read_csv(io.BufferedReader(stream, buffer_size=1024 * 1024) if isinstance(stream, io.RawIOBase) else stream, chunksize=CSV_CHUNK_ROWS)
+        if PROFILE_WORKERS <= 1 or multiprocessing.current_process().daemon:
+            for index, chunk in enumerate(chunks):
+                merged.merge(sketch_frame(chunk, seed=index))
+        else:
+            executor, pending = _get_profile_executor(), []
+            for index, chunk in enumerate(chunks):
+                pending.append(executor.submit(sketch_frame, chunk, index))
+                if len(pending) >= 2 * PROFILE_WORKERS:
+                    merged.merge(pending.pop(0).result())
+            for future in pending:
+                merged.merge(future.result())
+    except UnsupportedUploadError:
+        raise
     except Exception as e:
         raise ValueError(f"Error reading CSV: {str(e)}")
+    finally:
+        if isinstance(stream, CsvBodyStream):
+            stream.reader_done.set()
+    return merged.to_profile()
+
+
+# Per-column ~95% intervals of an approximate profile, for the API response
+def profile_error_bounds(profile: DatasetProfile) -> dict:
+    bounds = {}
+    for column in profile.columns:
+        non_null = profile.row_count - column.null_count
+        column_bounds = {
+            "nunique": {
+                "estimate": column.nunique,
+                "low": max(int(column.nunique * (1 - column.nunique_error)), 0),
+                "high": min(math.ceil(column.nunique * (1 + column.nunique_error)), non_null),
+                "exact": bool(column.nunique_error == 0),
+            },
+            "null_count": {"estimate": column.null_count, "exact": True},
+        }
+        if column.dtype_class == "other":
+            column_bounds["numeric_ratio"] = {
+                "estimate": round(column.numeric_ratio, 4),
+                "low": round(max(column.numeric_ratio - column.numeric_ratio_error, 0.0), 4),
+                "high": round(min(column.numeric_ratio + column.numeric_ratio_error, 1.0), 4),
+                "exact": bool(column.numeric_ratio_error == 0),
+            }
+        bounds[column.name] = column_bounds
+    return bounds
 
 
-def validate_dataframe(df: pd.DataFrame) -> dict:
+# profile: the DatasetProfile of df, computed by the caller at upload time (computed here if not given)
+# df may be None when a profile is given: everything below only reads the profile (this is how approximate
+# profiles of files that were never loaded are validated)
+def validate_dataframe(df: pd.DataFrame, profile: DatasetProfile = None) -> dict:
+    profile = profile or profile_dataframe(df)
+    columns = [column.name for column in profile.columns]
     # Deal with errors first
-    if df.shape[0] < 10:
+    if profile.row_count < 10:
         raise ValueError("Too few rows.")
-    if df.shape[1] < 2:
+    if len(columns) < 2:
         raise ValueError("Too few columns.")
-    if df.isnull().all().all():
+    if all(column.null_count == profile.row_count for column in profile.columns):
         raise ValueError("Dataframe contains only null values.")
     # Note: Pandas unable to read the file is handled by the read_uploaded_csv function
 
     # Detect column types
-    column_types = detect_column_types(df)
+    column_types = detect_column_types(df, profile)
     warnings = []
     # Look for null/missing values anywhere in the dataframe
-    if df.isnull().sum().any():
+    total_nulls = sum(column.null_count for column in profile.columns)
+    if total_nulls:
         warnings.append("Contains null values")
-    
-    total_nulls = int(df.isnull().sum().sum())
 
     
     # Same values for all rows in a column doesn't add any value while predicting
-    constant_cols = [col for col in df.columns if df[col].nunique() <= 1]
+    constant_cols = [column.name for column in profile.columns if column.nunique <= 1]
     if constant_cols:
         warnings.append(f"Constant or empty columns: {constant_cols}")
     
-    high_cardinality, likely_ids = check_high_cardinality_and_identifiers(df)
+    high_cardinality, likely_ids = check_high_cardinality_and_identifiers(df, profile)
     if high_cardinality:
         warnings.append(f"High cardinality columns: {high_cardinality}")
     if likely_ids:
@@ -86,35 +316,37 @@ def validate_dataframe(df: pd.DataFrame) -> dict:
     # Target candidates are columns that have more than 1 unique value and less than 90% of the rows are unique
     # Unique columns like identifiers doesn't help either. So primary identifiers like ID, Name, etc. are filtered out
 
-    target_candidates = [col for col in df.columns if df[col].nunique() > 1 and df[col].nunique() < df.shape[0] * 0.9]
+    target_candidates = [column.name for column in profile.columns if column.nunique > 1 and column.nunique < profile.row_count * 0.9]
 
-    return {
-        "columns": df.columns.tolist(),
+    validation = {
+        "columns": columns,
         "column_types": column_types,
-        "row_count": df.shape[0],
+        "row_count": profile.row_count,
         "missing_values": total_nulls,
-        "column_count": df.shape[1],
+        "column_count": len(columns),
         "target_candidates": target_candidates,
         "warnings": warnings
     }
+    if profile.approximate:
+        validation["profile_mode"] = "approximate"
+        validation["error_bounds"] = profile_error_bounds(profile)
+    return validation
 
-def check_high_cardinality_and_identifiers(df: pd.DataFrame) -> tuple:
+# Only the columns of df are checked (the profile may cover more, e.g. the target when df is the feature frame);
+# df may be None to check every profiled column
+def check_high_cardinality_and_identifiers(df: pd.DataFrame, profile: DatasetProfile = None) -> tuple:
+    profile = profile or profile_dataframe(df)
     high_cardinality = []
     likely_ids = []
-    identifier_keywords = ["id", "uuid", "name", "code", "ref", "number"]
 
-    for col in df.columns:
-        nunique = df[col].nunique()
-        total = len(df)
+    columns = profile.columns if df is None else [profile[col] for col in df.columns]
+    for column in columns:
+        col = column.name
         # High cardinality: >90% unique values
-        if nunique > 0.9 * total:
+        if column.high_cardinality:
             high_cardinality.append(col)
             # Further check if it likely represents an identifier (initial template logic to filter out identifiers). Obviously, likely_ids is a subset of high_cardinality
-            col_lower = col.lower()
-            if any(keyword in col_lower for keyword in identifier_keywords):
+            if column.likely_identifier:
                 likely_ids.append(col)
 
     return high_cardinality, likely_ids
-
-
-
@@ -0,0 +1,112 @@
+'''
+Column profiler: cardinality, null counts and type hints for every column, computed once at upload time.
+
+validate_dataframe, detect_column_types, check_high_cardinality_and_identifiers and train_model all read from the
+same DatasetProfile instead of re-scanning each column with nunique()/isnull(). The profile is persisted next to the
+uploaded dataset so /train-model can reuse it.
+
+For files too large to load, app/utils/sketch.py builds the same DatasetProfile from mergeable per-chunk sketches
+(approximate=True, with error bounds); see profile_csv_approximate in app/utils/io.py.
+'''
+import json
+import os
+from dataclasses import dataclass, asdict, field
+import pandas as pd
+
+identifier_keywords = ["id", "uuid", "name", "code", "ref", "number"]
+
+
+@dataclass
+class ColumnProfile:
+    name: str
+    dtype: str
+    dtype_class: str # "numeric", "string" (string/categorical) or "other" (mixed objects)
+    nunique: int
+    null_count: int
+    numeric_ratio: float = 1.0 # share of values coercible to numbers (only measured for "other" columns)
+    numeric_nunique: int = 0 # distinct values after numeric coercion (only measured for "other" columns)
+    high_cardinality: bool = False # >90% unique values
+    likely_identifier: bool = False # high cardinality and the name looks like an identifier
+    # Approximate profiles (app/utils/sketch.py) only: ~95% error bounds, relative for nunique, absolute for numeric_ratio
+    nunique_error: float = 0.0
+    numeric_ratio_error: float = 0.0
+
+
+@dataclass
+class DatasetProfile:
+    row_count: int
+    columns: list = field(default_factory=list) # list of ColumnProfile, in dataframe column order
+    approximate: bool = False # computed from sketches instead of the full frame
+
+    def __getitem__(self, name: str) -> ColumnProfile:
+        return self._by_name()[name]
+
+    def _by_name(self) -> dict:
+        if getattr(self, "_index", None) is None or len(self._index) != len(self.columns):
+            self._index = {c.name: c for c in self.columns}
+        return self._index
+
+    def matches(self, df: pd.DataFrame) -> bool:
+        # A persisted profile is only reused for the exact frame it was computed on
+        return not self.approximate and self.row_count == len(df) and [c.name for c in self.columns] == df.columns.tolist()
+
+    def to_dict(self) -> dict:
+        return {"row_count": self.row_count, "columns": [asdict(c) for c in self.columns], "approximate": self.approximate}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DatasetProfile":
+        return cls(row_count=data["row_count"], columns=[ColumnProfile(**c) for c in data["columns"]], approximate=data.get("approximate", False))
+
+
+def _dtype_class(series: pd.Series) -> str:
+    if pd.api.types.is_numeric_dtype(series):
+        return "numeric"
+    if pd.api.types.is_string_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+        return "string"
+    return "other"
+
+
+def profile_dataframe(df: pd.DataFrame) -> DatasetProfile:
+    row_count = len(df)
+    # One vectorized pass each for cardinality and nulls over the whole frame
+    nunique = df.nunique()
+    null_counts = df.isnull().sum()
+
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        profile = ColumnProfile(
+            name=col,
+            dtype=str(series.dtype),
+            dtype_class=_dtype_class(series),
+            nunique=int(nunique[col]),
+            null_count=int(null_counts[col]),
+        )
+        # Only mixed object columns need the (expensive) numeric coercion check
+        if profile.dtype_class == "other":
+            coerced = pd.to_numeric(series, errors='coerce')
+            profile.numeric_ratio = float(coerced.notnull().sum() / row_count) if row_count else 0.0
+            profile.numeric_nunique = int(coerced.nunique())
+
+        profile.high_cardinality = profile.nunique > 0.9 * row_count
+        profile.likely_identifier = profile.high_cardinality and any(keyword in col.lower() for keyword in identifier_keywords)
+        columns.append(profile)
+
+    return DatasetProfile(row_count=row_count, columns=columns)
+
+
+def save_profile(profile: DatasetProfile, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profile.to_dict(), f)
+
+
+# Returns the persisted profile, or None when it is missing/unreadable
+def load_profile(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return DatasetProfile.from_dict(json.load(f))
+    except (ValueError, KeyError, TypeError):
+        return None
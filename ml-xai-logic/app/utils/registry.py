@@ -0,0 +1,300 @@
+'''
+Dataset/model registry. Every upload gets a dataset ID and every training run a model ID, each with its own
+directory, so concurrent users (and multiple uvicorn workers) never overwrite each other's files:
+
+    data/datasets/<dataset_id>/    dataset.arrow, profile.json, meta.json
+    artifacts/models/<model_id>/   model.pkl, preprocessor.json, X_test.arrow, result.json, shap_cache/, meta.json
+
+All state lives on disk, so every worker sees the same registry. A "latest" pointer per kind keeps ID-less
+requests (the current frontend) working. Old entries are evicted by age and total size, least recently used first.
+
+Artifacts from before the registry (data/last_uploaded.*, artifacts/latest_model.pkl + artifacts/X_test.*) are imported
+as a regular entry the first time an ID-less request finds no "latest" pointer; the legacy files are left in place.
+
+Entries can also be registered under a content key (<root>/keys/<key>): datasets under the hash of their parsed
+content, models under the hash of (dataset content, target, training config). Repeated uploads and training runs
+resolve to the existing entry instead of writing a new one.
+'''
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from app.core.config import DATA_DIR, ARTIFACTS_DIR, DATASETS_DIR, MODELS_DIR, ARTIFACT_MAX_AGE_HOURS, DATASETS_MAX_TOTAL_BYTES, \
+    MODELS_MAX_TOTAL_BYTES
+from app.utils.artifact_store import migrate_csv_artifact
+
+DATASET_FILE = "dataset.arrow"
+PROFILE_FILE = "profile.json"
+MODEL_FILE = "model.pkl"
+PREPROCESSOR_FILE = "preprocessor.json"
+X_TEST_FILE = "X_test.arrow"
+SHAP_CACHE_SUBDIR = "shap_cache"
+META_FILE = "meta.json"
+RESULT_FILE = "result.json"
+LATEST_FILE = "latest"
+KEYS_SUBDIR = "keys"
+LEGACY_IMPORT_FILE = "legacy_imported"
+
+_ROOTS = {"dataset": DATASETS_DIR, "model": MODELS_DIR}
+_MAX_TOTAL_BYTES = {"dataset": DATASETS_MAX_TOTAL_BYTES, "model": MODELS_MAX_TOTAL_BYTES}
+# The file that has to exist before an entry can be used (it is written last)
+_READY_FILE = {"dataset": DATASET_FILE, "model": MODEL_FILE}
+_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$") # sha256 hex digests
+
+
+class UnknownArtifactError(LookupError):
+    pass
+
+
+def _entry_dir(kind: str, entry_id: str) -> str:
+    # IDs come straight from query parameters/request bodies, so only well-formed IDs ever reach the filesystem
+    if not isinstance(entry_id, str) or not _ID_PATTERN.match(entry_id):
+        raise UnknownArtifactError(f"Invalid {kind} id: {entry_id!r}")
+    return os.path.join(_ROOTS[kind], entry_id)
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _create_entry(kind: str, meta: dict) -> str:
+    entry_id = uuid.uuid4().hex[:16]
+    entry_dir = _entry_dir(kind, entry_id)
+    os.makedirs(entry_dir)
+    _write_json(os.path.join(entry_dir, META_FILE), {"id": entry_id, "created_at": time.time(), **meta})
+    return entry_id
+
+
+############################################################
+### Paths
+
+def dataset_path(dataset_id: str) -> str:
+    return os.path.join(_entry_dir("dataset", dataset_id), DATASET_FILE)
+
+def profile_path(dataset_id: str) -> str:
+    return os.path.join(_entry_dir("dataset", dataset_id), PROFILE_FILE)
+
+def model_path(model_id: str) -> str:
+    return os.path.join(_entry_dir("model", model_id), MODEL_FILE)
+
+def preprocessor_path(model_id: str) -> str:
+    return os.path.join(_entry_dir("model", model_id), PREPROCESSOR_FILE)
+
+def x_test_path(model_id: str) -> str:
+    return os.path.join(_entry_dir("model", model_id), X_TEST_FILE)
+
+def shap_cache_dir(model_id: str) -> str:
+    return os.path.join(_entry_dir("model", model_id), SHAP_CACHE_SUBDIR)
+
+def result_path(model_id: str) -> str:
+    return os.path.join(_entry_dir("model", model_id), RESULT_FILE)
+
+
+############################################################
+### Registration and lookup
+
+def create_dataset(content_hash: str = None) -> str:
+    return _create_entry("dataset", {"content_hash": content_hash})
+
+def create_model(dataset_id: str, target: str, training_key: str = None) -> str:
+    return _create_entry("model", {"dataset_id": dataset_id, "target": target, "training_key": training_key})
+
+def read_meta(kind: str, entry_id: str) -> dict:
+    with open(os.path.join(_entry_dir(kind, entry_id), META_FILE)) as f:
+        return json.load(f)
+
+# Training response (metrics etc.) stored with the model, so a deduplicated training request can return it as is
+def save_result(model_id: str, result: dict):
+    _write_json(result_path(model_id), result)
+
+def load_result(model_id: str):
+    try:
+        with open(result_path(model_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Records a use of the entry; retention evicts the least recently used entries first
+def touch_entry(kind: str, entry_id: str):
+    meta_path = os.path.join(_entry_dir(kind, entry_id), META_FILE)
+    try:
+        meta = read_meta(kind, entry_id)
+    except (OSError, ValueError):
+        return # evicted concurrently
+    _write_json(meta_path, {**meta, "last_used_at": time.time()})
+
+# Called once an entry's files are fully written; ID-less requests resolve to it from then on
+def mark_latest(kind: str, entry_id: str):
+    _entry_dir(kind, entry_id)
+    _write_json(os.path.join(_ROOTS[kind], LATEST_FILE), {"id": entry_id})
+
+def _read_latest(kind: str):
+    try:
+        with open(os.path.join(_ROOTS[kind], LATEST_FILE)) as f:
+            return json.load(f)["id"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _resolve(kind: str, entry_id: str = None) -> str:
+    if entry_id is None:
+        entry_id = _read_latest(kind) or import_legacy_artifacts(kind)
+        if entry_id is None:
+            raise UnknownArtifactError(f"No {kind} available yet.")
+
+    if not os.path.exists(os.path.join(_entry_dir(kind, entry_id), _READY_FILE[kind])):
+        raise UnknownArtifactError(f"Unknown {kind} id: {entry_id}")
+    return entry_id
+
+# Returns the given ID if it exists, or the latest one when no ID is passed
+def resolve_dataset_id(dataset_id: str = None) -> str:
+    return _resolve("dataset", dataset_id)
+
+def resolve_model_id(model_id: str = None) -> str:
+    return _resolve("model", model_id)
+
+
+############################################################
+### Pre-registry artifacts
+
+# Single-file layout used before the registry. Frames may still be CSV (before the Arrow store) or Arrow.
+_LEGACY_FILES = {
+    "dataset": {DATASET_FILE: os.path.join(DATA_DIR, "last_uploaded.arrow"), PROFILE_FILE: os.path.join(DATA_DIR, "last_uploaded.profile.json")},
+    "model": {X_TEST_FILE: os.path.join(ARTIFACTS_DIR, "X_test.arrow"), MODEL_FILE: os.path.join(ARTIFACTS_DIR, "latest_model.pkl")},
+}
+
+def _legacy_source(path: str):
+    if os.path.exists(path):
+        return path
+    csv_path = os.path.splitext(path)[0] + ".csv"
+    return csv_path if path.endswith(".arrow") and os.path.exists(csv_path) else None
+
+def _copy_into(source: str, path: str):
+    if source.endswith(".csv") and path.endswith(".arrow"):
+        migrate_csv_artifact(source, path)
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, path)
+
+# Registers the pre-registry artifacts of a kind as a new entry and marks it latest. Runs at most once per root (the
+# first worker to claim the marker file does the import); returns the new ID, or None if there is nothing to import.
+def import_legacy_artifacts(kind: str):
+    sources = {name: _legacy_source(path) for name, path in _LEGACY_FILES[kind].items()}
+    if sources[_READY_FILE[kind]] is None or (kind == "model" and sources[X_TEST_FILE] is None):
+        return None # a legacy model is only usable together with its X_test
+    os.makedirs(_ROOTS[kind], exist_ok=True)
+    try:
+        os.close(os.open(os.path.join(_ROOTS[kind], LEGACY_IMPORT_FILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return _read_latest(kind) # imported already (or being imported by another worker)
+
+    meta = {"dataset_id": None, "target": None, "training_key": None} if kind == "model" else {"content_hash": None}
+    entry_id = _create_entry(kind, {**meta, "legacy": True})
+    entry_dir = _entry_dir(kind, entry_id)
+    # Ready file last (dict order), so the entry only becomes visible once it is complete
+    for name, source in sources.items():
+        if source is not None:
+            _copy_into(source, os.path.join(entry_dir, name))
+    mark_latest(kind, entry_id)
+    return entry_id
+
+
+############################################################
+### Content keys (dedupe)
+
+def _key_path(kind: str, key: str) -> str:
+    if not isinstance(key, str) or not _KEY_PATTERN.match(key):
+        raise ValueError(f"Invalid content key: {key!r}")
+    return os.path.join(_ROOTS[kind], KEYS_SUBDIR, key)
+
+# Call after the entry is complete (its ready file exists)
+def register_key(kind: str, key: str, entry_id: str):
+    _entry_dir(kind, entry_id)
+    path = _key_path(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_json(path, {"id": entry_id})
+
+# Returns the ID of the complete entry registered under key, or None. Keys of evicted entries are cleaned up here.
+def find_by_key(kind: str, key: str):
+    path = _key_path(kind, key)
+    try:
+        with open(path) as f:
+            entry_id = json.load(f)["id"]
+        return _resolve(kind, entry_id)
+    except (OSError, ValueError, KeyError):
+        return None
+    except UnknownArtifactError:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+
+############################################################
+### Retention / eviction
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass # removed concurrently
+    return total
+
+def _list_entries(kind: str) -> list:
+    root = _ROOTS[kind]
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    for entry_id in os.listdir(root):
+        if not _ID_PATTERN.match(entry_id):
+            continue
+        try:
+            meta = read_meta(kind, entry_id)
+            last_used_at = meta.get("last_used_at") or meta["created_at"]
+        except (OSError, ValueError, KeyError):
+            last_used_at = os.path.getmtime(os.path.join(root, entry_id))
+        entries.append((last_used_at, entry_id))
+    entries.sort() # least recently used first
+    return entries
+
+def remove_entry(kind: str, entry_id: str):
+    shutil.rmtree(_entry_dir(kind, entry_id), ignore_errors=True)
+
+# Drops entries unused for ARTIFACT_MAX_AGE_HOURS, then the least recently used ones until the total size fits the budget.
+# keep: IDs that must survive (e.g. the entry that was just created). The entry "latest" points to always survives too:
+# requests without an ID resolve to it, however long ago it was last used.
+def enforce_retention(kind: str, keep: tuple = ()) -> list:
+    evicted = []
+    keep = set(keep) | ({_read_latest(kind)} - {None})
+    entries = [(last_used_at, entry_id) for last_used_at, entry_id in _list_entries(kind) if entry_id not in keep]
+    cutoff = time.time() - ARTIFACT_MAX_AGE_HOURS * 3600
+
+    remaining = []
+    for last_used_at, entry_id in entries:
+        if last_used_at < cutoff:
+            remove_entry(kind, entry_id)
+            evicted.append(entry_id)
+        else:
+            remaining.append(entry_id)
+
+    sizes = {entry_id: _dir_size(os.path.join(_ROOTS[kind], entry_id)) for entry_id in remaining}
+    total = sum(sizes.values()) + sum(_dir_size(os.path.join(_ROOTS[kind], entry_id)) for entry_id in keep)
+    for entry_id in remaining:
+        if total <= _MAX_TOTAL_BYTES[kind]:
+            break
+        remove_entry(kind, entry_id)
+        evicted.append(entry_id)
+        total -= sizes[entry_id]
+
+    return evicted
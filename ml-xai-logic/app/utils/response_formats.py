@@ -0,0 +1,62 @@
+'''
+Response formats for /explain-model. The verbose JSON (one dict per row, feature names repeated in every row) stays
+the default for the frontend; clients that handle many rows can opt into a compact format with ?format=... or the
+Accept header:
+
+- columnar: JSON with feature/class names once and contributions as flat row-major arrays
+- arrow:    Arrow IPC stream, one record per row (per row and class for classification) with the contributions as a
+            fixed-size list column; feature names and the global part of the response are in the schema metadata
+'''
+import json
+import numpy as np
+import pyarrow as pa
+
+RESPONSE_FORMATS = {
+    "verbose": "application/json",
+    "columnar": "application/vnd.xai.columnar+json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+# The query parameter wins over the Accept header; anything unrecognised gets the verbose default
+def negotiate_format(format_param: str = None, accept: str = None) -> str:
+    if format_param:
+        return format_param
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        for name, format_media_type in RESPONSE_FORMATS.items():
+            if name != "verbose" and media_type == format_media_type:
+                return name
+    return "verbose"
+
+
+# payload: shap_values(..., output="arrays"), so the columns are built straight from the computed numpy arrays
+def explanation_to_arrow_ipc(payload: dict) -> bytes:
+    local = payload["local_explanations"]
+    features = list(local["features"])
+    row_index = np.asarray(local["row_index"], dtype=np.int64)
+
+    if "classes" in local:
+        num_classes = len(local["classes"])
+        columns = {
+            "row_index": pa.array(np.repeat(row_index, num_classes)),
+            "class": pa.array(list(local["classes"]) * len(row_index)),
+            "prediction": pa.array([p for p in local["prediction"] for _ in range(num_classes)]),
+            "probability": pa.array(np.asarray(local["probability"], dtype=float).ravel()),
+            "check": pa.array(np.asarray(local["check"], dtype=float).ravel()),
+        }
+    else:
+        columns = {"row_index": pa.array(row_index), "prediction": pa.array(np.asarray(local["prediction"], dtype=float)),
+                   "check": pa.array(np.asarray(local["check"], dtype=float))}
+    contributions = np.asarray(local["contributions"], dtype=float).ravel()
+    columns["contributions"] = pa.FixedSizeListArray.from_arrays(pa.array(contributions), len(features))
+
+    summary = {key: value for key, value in payload.items() if key != "local_explanations"}
+    table = pa.table(columns).replace_schema_metadata({
+        "xai.features": json.dumps(features),
+        "xai.summary": json.dumps(summary),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,226 @@
+'''
+Mergeable column sketches for approximate profiling of uploads too large to load into memory.
+
+A CSV is sketched chunk by chunk (sketch_frame) and the per-chunk sketches are merged (FrameSketch.merge), in any
+order and in any process, into a DatasetProfile with error bounds (FrameSketch.to_profile). Memory is bounded by the
+chunk size plus a fixed size per column:
+
+- distinct values: exact (a set of value hashes) up to PROFILE_EXACT_DISTINCT_LIMIT, then a HyperLogLog with
+  2 ** PROFILE_HLL_PRECISION registers (1.04 / sqrt(registers) relative standard error). Estimates use Ertl's improved
+  estimator ("New cardinality estimation algorithms for HyperLogLog sketches", 2017), which stays unbiased across the
+  whole range without the empirical bias tables of HyperLogLog++.
+- nulls and rows: plain counters, exact
+- numeric coercion of text columns: measured on a random sample of each chunk (PROFILE_COERCION_SAMPLE_ROWS),
+  so numeric_ratio is an estimate and numeric_nunique only counts the sampled values (a lower bound)
+
+Error bounds are ~95% intervals (two standard errors).
+'''
+from dataclasses import dataclass, field
+import math
+import numpy as np
+import pandas as pd
+from app.core.config import PROFILE_HLL_PRECISION, PROFILE_EXACT_DISTINCT_LIMIT, PROFILE_COERCION_SAMPLE_ROWS
+from app.utils.profile import ColumnProfile, DatasetProfile, identifier_keywords, _dtype_class
+
+
+def value_hashes(series: pd.Series) -> np.ndarray:
+    """64-bit hashes of the non-null values. Numbers are hashed as float64, so 5 and 5.0 (int and float chunks) match."""
+    series = series.dropna()
+    if pd.api.types.is_numeric_dtype(series):
+        series = series.astype("float64") + 0.0 # + 0.0 turns -0.0 into 0.0 (equal values, different bytes)
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+
+def _sigma(x: float) -> float:
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous, z = z, z + x * y
+        y += y
+        if z == previous:
+            return z
+
+def _tau(x: float) -> float:
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class DistinctCounter:
+    def __init__(self, precision: int = PROFILE_HLL_PRECISION, exact_limit: int = PROFILE_EXACT_DISTINCT_LIMIT):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.hashes = np.empty(0, dtype=np.uint64) # sorted distinct hashes while the count is exact
+        self.registers = None # HyperLogLog registers once there are more than exact_limit distinct values
+
+    @property
+    def exact(self) -> bool:
+        return self.registers is None
+
+    def add(self, hashes: np.ndarray):
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) > self.exact_limit:
+                self._switch_to_registers()
+        else:
+            self._update_registers(hashes)
+
+    def _switch_to_registers(self):
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        self._update_registers(self.hashes)
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def _update_registers(self, hashes: np.ndarray):
+        if not len(hashes):
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.intp)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Position of the leftmost 1 bit in the remaining bits; frexp gives the bit length exactly (rest < 2 ** 53)
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (width - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "DistinctCounter") -> "DistinctCounter":
+        if self.exact and other.exact:
+            self.add(other.hashes)
+            return self
+        if self.exact:
+            self._switch_to_registers()
+        other_registers = other.registers
+        if other_registers is None:
+            self._update_registers(other.hashes)
+        else:
+            np.maximum(self.registers, other_registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        if self.exact:
+            return len(self.hashes)
+        m, q = len(self.registers), 64 - self.precision
+        counts = np.bincount(self.registers, minlength=q + 2) # histogram of register values 0..q+1
+        z = m * _tau(1 - counts[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + counts[k])
+        z += m * _sigma(counts[0] / m)
+        estimate = m * m / (2 * math.log(2) * z)
+        return max(int(round(estimate)), self.exact_limit + 1)
+
+    def relative_error(self) -> float:
+        return 0.0 if self.exact else 2 * 1.04 / np.sqrt(len(self.registers))
+
+
+@dataclass
+class ColumnSketch:
+    name: str
+    rows: int = 0
+    null_count: int = 0
+    dtypes: set = field(default_factory=set) # pandas dtypes seen across chunks
+    dtype_classes: set = field(default_factory=set) # profile dtype classes of the chunks that had values
+    distinct: DistinctCounter = field(default_factory=DistinctCounter)
+    # Numeric coercion, estimated from per-chunk samples: estimated coercible rows and the variance of that estimate
+    numeric_rows: float = 0.0
+    numeric_rows_variance: float = 0.0
+    numeric_distinct: DistinctCounter = field(default_factory=DistinctCounter)
+
+    def merge(self, other: "ColumnSketch") -> "ColumnSketch":
+        self.rows += other.rows
+        self.null_count += other.null_count
+        self.dtypes |= other.dtypes
+        self.dtype_classes |= other.dtype_classes
+        self.distinct.merge(other.distinct)
+        self.numeric_rows += other.numeric_rows
+        self.numeric_rows_variance += other.numeric_rows_variance
+        self.numeric_distinct.merge(other.numeric_distinct)
+        return self
+
+
+def _sketch_column(name, series: pd.Series, rng) -> ColumnSketch:
+    sketch = ColumnSketch(name=name, rows=len(series), dtypes={str(series.dtype)})
+    sketch.null_count = int(series.isnull().sum())
+    if sketch.null_count < len(series):
+        # A chunk where the column is all null is parsed as float64: it says nothing about the column's type
+        sketch.dtype_classes.add(_dtype_class(series))
+
+    if pd.api.types.is_numeric_dtype(series):
+        hashes = value_hashes(series)
+        sketch.distinct.add(hashes)
+        sketch.numeric_rows = float(len(series) - sketch.null_count) # every non-null value is a number
+        sketch.numeric_distinct.add(hashes)
+    elif len(series):
+        sample = series if len(series) <= PROFILE_COERCION_SAMPLE_ROWS else series.sample(n=PROFILE_COERCION_SAMPLE_ROWS, random_state=rng)
+        coerced = pd.to_numeric(sample, errors="coerce")
+        share = float(coerced.notnull().mean())
+        sketch.numeric_rows = share * len(series)
+        if len(sample) < len(series):
+            # Sampling without replacement from the chunk: binomial variance with finite population correction
+            sketch.numeric_rows_variance = len(series) ** 2 * share * (1 - share) / len(sample) * (1 - len(sample) / len(series))
+        sketch.numeric_distinct.add(value_hashes(coerced))
+        if share:
+            # Text with numbers in it: hash the numbers as numbers, so "5" here and 5 in a chunk parsed as numeric are
+            # one value. Only for chunks whose sample has numbers, as coercing a whole chunk of plain text is slow.
+            numbers = pd.to_numeric(series, errors="coerce")
+            sketch.distinct.add(np.concatenate([value_hashes(numbers), value_hashes(series[numbers.isnull()])]))
+        else:
+            sketch.distinct.add(value_hashes(series))
+    return sketch
+
+
+@dataclass
+class FrameSketch:
+    row_count: int = 0
+    columns: dict = field(default_factory=dict) # column name -> ColumnSketch, in file column order
+
+    def merge(self, other: "FrameSketch") -> "FrameSketch":
+        if self.columns and list(other.columns) != list(self.columns):
+            raise ValueError("Cannot merge sketches of frames with different columns")
+        self.row_count += other.row_count
+        for name, column in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                self.columns[name] = column
+        return self
+
+    def to_profile(self) -> DatasetProfile:
+        row_count = self.row_count
+        columns = []
+        for name, sketch in self.columns.items():
+            classes, dtypes = sketch.dtype_classes, sketch.dtypes
+            # numeric in some chunks and text in others is "other"; an all-null column is parsed as float64, i.e. numeric
+            dtype_class = next(iter(classes)) if len(classes) == 1 else ("other" if classes else "numeric")
+            dtype = next(iter(dtypes)) if len(dtypes) == 1 else ("float64" if dtypes <= {"int64", "float64"} else "object")
+
+            profile = ColumnProfile(
+                name=name,
+                dtype=dtype,
+                dtype_class=dtype_class,
+                nunique=min(sketch.distinct.estimate(), row_count - sketch.null_count),
+                null_count=sketch.null_count,
+                nunique_error=round(sketch.distinct.relative_error(), 4),
+            )
+            if dtype_class == "other":
+                profile.numeric_ratio = sketch.numeric_rows / row_count if row_count else 0.0
+                profile.numeric_ratio_error = round(2 * np.sqrt(sketch.numeric_rows_variance) / row_count, 4) if row_count else 0.0
+                profile.numeric_nunique = sketch.numeric_distinct.estimate()
+
+            profile.high_cardinality = profile.nunique > 0.9 * row_count
+            profile.likely_identifier = profile.high_cardinality and any(keyword in str(name).lower() for keyword in identifier_keywords)
+            columns.append(profile)
+
+        return DatasetProfile(row_count=row_count, columns=columns, approximate=True)
+
+
+def sketch_frame(chunk: pd.DataFrame, seed: int = 0) -> FrameSketch:
+    rng = np.random.default_rng(seed)
+    return FrameSketch(row_count=len(chunk), columns={col: _sketch_column(col, chunk[col], rng) for col in chunk.columns})
@@ -0,0 +1,219 @@
+'''
+In-process benchmark suite: times every stage of the pipeline on synthetic datasets, so we can see how it scales
+and catch performance regressions before deploy (no server needed, unlike end_to_end_test.py).
+
+Stages: read_uploaded_csv -> validate_dataframe -> train_model -> shap_values (cold, then a warm page)
+Results go to tests/results/benchmark_results.json; pass --baseline to compare against a stored run.
+
+    python tests/benchmark.py                                  # default scenarios
+    python tests/benchmark.py --rows 1000 10000 --classes 5    # custom sizes
+    python tests/benchmark.py --cardinality 2000 --encoding sparse_one_hot   # wide categorical data
+    python tests/benchmark.py --training-profile fast          # capped forests (see TRAINING_PROFILES)
+    python tests/benchmark.py --save-baseline                  # store this run as tests/results/benchmark_baseline.json
+    python tests/benchmark.py --baseline results/benchmark_baseline.json
+'''
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import platform
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # make the app package importable from tests/
+
+# Configuration - adjust as needed (all of it can be overridden from the command line)
+CONFIG = {
+    "rows": [1000, 5000],
+    "numeric_cols": 10,
+    "categorical_cols": 3,
+    "cardinality": 10, # distinct levels per categorical column
+    "classes": 3, # for the classification scenarios
+    "encoding": "one_hot", # categorical encoding used by train_model: one_hot, sparse_one_hot or ordinal
+    "training_profile": "balanced", # fast, balanced or accurate
+    "tasks": ["regression", "classification"],
+    "local_rows": 10, # rows requested from shap_values
+    "seed": 42,
+    "track_memory": True, # peak memory per stage via tracemalloc (adds some overhead to the timings)
+    "results_path": os.path.join(os.path.dirname(__file__), "results", "benchmark_results.json"),
+    "baseline_path": os.path.join(os.path.dirname(__file__), "results", "benchmark_baseline.json"),
+    "tolerance": 0.25, # a stage is a regression when it is >25% slower than the baseline...
+    "min_delta_seconds": 0.05, # ...and slower by more than this (ignores noise on very fast stages)
+}
+
+
+def generate_dataset(rows, numeric_cols, categorical_cols, cardinality, task, classes, seed):
+    """Synthetic table with numeric + categorical features and a target that depends on both"""
+    rng = np.random.default_rng(seed)
+    data = {f"num{i}": rng.normal(size=rows) for i in range(numeric_cols)}
+    for i in range(categorical_cols):
+        data[f"cat{i}"] = rng.choice([f"level{j}" for j in range(cardinality)], size=rows)
+    df = pd.DataFrame(data)
+
+    score = sum(df[f"num{i}"] * (i + 1) for i in range(min(numeric_cols, 5))) + rng.normal(scale=0.5, size=rows)
+    for i in range(categorical_cols):
+        score = score + df[f"cat{i}"].str.len() # level names of different lengths shift the target
+    if task == "regression":
+        df["target"] = score
+    else:
+        df["target"] = pd.qcut(score, q=classes, labels=[f"class{k}" for k in range(classes)]).astype(str)
+    return df
+
+
+def run_stage(results, name, fn, *args):
+    """Run one stage, record its wall time (and peak traced memory) and return its output"""
+    if CONFIG["track_memory"]:
+        tracemalloc.start()
+    started = time.perf_counter()
+    output = fn(*args)
+    results[name] = {"seconds": round(time.perf_counter() - started, 4)}
+    if CONFIG["track_memory"]:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name]["peak_memory_mb"] = round(peak / 1024 ** 2, 2)
+    return output
+
+
+def run_scenario(task, rows):
+    from starlette.datastructures import UploadFile
+    from app.utils.io import read_uploaded_csv, validate_dataframe
+    from app.utils.profile import profile_dataframe
+    from app.ml_core.train import train_model
+    from app.ml_core.explain import shap_values
+
+    df = generate_dataset(rows, CONFIG["numeric_cols"], CONFIG["categorical_cols"], CONFIG["cardinality"], task, CONFIG["classes"], CONFIG["seed"])
+    csv_bytes = df.to_csv(index=False).encode()
+    stages = {}
+
+    df = run_stage(stages, "read_uploaded_csv", lambda: read_uploaded_csv(UploadFile(io.BytesIO(csv_bytes), filename="benchmark.csv")))
+    profile = run_stage(stages, "profile_dataframe", profile_dataframe, df)
+    run_stage(stages, "validate_dataframe", validate_dataframe, df, profile)
+    result = run_stage(stages, "train_model", train_model, df, "target", profile, None, None, CONFIG["encoding"], CONFIG["training_profile"], 0)
+    run_stage(stages, "shap_values_cold", shap_values, 0, CONFIG["local_rows"], result["model_id"])
+    run_stage(stages, "shap_values_warm", shap_values, CONFIG["local_rows"], 2 * CONFIG["local_rows"], result["model_id"])
+
+    return {
+        "task": task,
+        "rows": rows,
+        "columns": CONFIG["numeric_cols"] + CONFIG["categorical_cols"],
+        "cardinality": CONFIG["cardinality"],
+        "classes": CONFIG["classes"] if task == "classification" else None,
+        "encoding": CONFIG["encoding"],
+        "training_profile": CONFIG["training_profile"],
+        "csv_mb": round(len(csv_bytes) / 1024 ** 2, 2),
+        "encoded_columns": len(result["final_columns"]),
+        "model_size_mb": round(result["model_size_bytes"] / 1024 ** 2, 2),
+        "single_row_predict_ms": result["inference_latency"]["single_row_ms"],
+        "stages": stages,
+    }
+
+
+def scenario_key(scenario):
+    return f"{scenario['task']}-{scenario['rows']}x{scenario['columns']}-card{scenario['cardinality']}-cls{scenario['classes']}-{scenario.get('encoding', 'one_hot')}-{scenario.get('training_profile', 'accurate')}"
+
+
+def compare_to_baseline(current, baseline):
+    """List every stage that got slower than the baseline beyond the configured tolerance"""
+    baseline_by_key = {scenario_key(s): s for s in baseline["scenarios"]}
+    regressions = []
+    for scenario in current["scenarios"]:
+        previous = baseline_by_key.get(scenario_key(scenario))
+        if previous is None:
+            continue
+        for stage, measured in scenario["stages"].items():
+            before = previous["stages"].get(stage)
+            if before is None:
+                continue
+            delta = measured["seconds"] - before["seconds"]
+            if delta > CONFIG["min_delta_seconds"] and measured["seconds"] > before["seconds"] * (1 + CONFIG["tolerance"]):
+                regressions.append({
+                    "scenario": scenario_key(scenario),
+                    "stage": stage,
+                    "baseline_seconds": before["seconds"],
+                    "seconds": measured["seconds"],
+                    "ratio": round(measured["seconds"] / max(before["seconds"], 1e-9), 2),
+                })
+    return regressions
+
+
+def run_benchmarks():
+    # Artifacts (datasets, models, caches) go to a throwaway directory, never into the working tree
+    workdir = tempfile.mkdtemp(prefix="xai-benchmark-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        scenarios = []
+        for task in CONFIG["tasks"]:
+            for rows in CONFIG["rows"]:
+                print(f"Benchmarking {task} with {rows} rows...")
+                scenarios.append(run_scenario(task, rows))
+    finally:
+        os.chdir(cwd)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in CONFIG.items() if not k.endswith("_path")},
+        "scenarios": scenarios,
+    }
+
+
+def print_report(report):
+    for scenario in report["scenarios"]:
+        print(f"\n{scenario_key(scenario)} ({scenario['csv_mb']} MB CSV, {scenario['encoded_columns']} encoded columns, "
+              f"{scenario.get('model_size_mb')} MB model)")
+        for stage, measured in scenario["stages"].items():
+            memory = f"  peak {measured['peak_memory_mb']} MB" if "peak_memory_mb" in measured else ""
+            print(f"  {stage:<20} {measured['seconds']:>9.3f}s{memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upload, profiling, training and explanation stages")
+    parser.add_argument("--rows", type=int, nargs="+")
+    parser.add_argument("--numeric-cols", type=int)
+    parser.add_argument("--categorical-cols", type=int)
+    parser.add_argument("--cardinality", type=int)
+    parser.add_argument("--classes", type=int)
+    parser.add_argument("--tasks", nargs="+", choices=["regression", "classification"])
+    parser.add_argument("--encoding", choices=["one_hot", "sparse_one_hot", "ordinal"])
+    parser.add_argument("--training-profile", choices=["fast", "balanced", "accurate"])
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (more accurate timings)")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args()
+
+    for key in ("rows", "numeric_cols", "categorical_cols", "cardinality", "classes", "tasks", "encoding", "training_profile"):
+        if getattr(args, key) is not None:
+            CONFIG[key] = getattr(args, key)
+    CONFIG["track_memory"] = not args.no_memory
+
+    report = run_benchmarks()
+    print_report(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare_to_baseline(report, json.load(f))
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['scenario']} {regression['stage']}: {regression['baseline_seconds']}s -> {regression['seconds']}s (x{regression['ratio']})")
+
+    Path(CONFIG["results_path"]).parent.mkdir(exist_ok=True)
+    with open(CONFIG["results_path"], "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nFull results saved to {CONFIG['results_path']}")
+    if args.save_baseline:
+        with open(CONFIG["baseline_path"], "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {CONFIG['baseline_path']}")
+
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
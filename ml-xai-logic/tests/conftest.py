@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # make the app package importable from tests/
+
+# end_to_end_test.py and load_test.py are scripts that drive a running server, not part of the pytest suite
+collect_ignore = ["end_to_end_test.py", "load_test.py"]
+
+
+@pytest.fixture(autouse=True)
+def artifacts_in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # DATA_DIR, ARTIFACTS_DIR and JOBS_DIR are relative to the working directory
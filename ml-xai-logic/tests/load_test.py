@@ -0,0 +1,326 @@
+'''
+Concurrent load test for the HTTP API: starts a local uvicorn server (or targets --base-url), drives /upload-csv,
+/train-model and /explain-model from several concurrent clients with a weighted mix of scenarios, and reports
+throughput, p50/p95/p99 latency and error rate per scenario, plus the server's RSS over time.
+
+A separate probe calls GET /health (which does no work) at a fixed interval: if its latency climbs while the other
+scenarios run, something is blocking the event loop instead of running in the threadpool/process pool.
+
+    python tests/load_test.py                                   # 8 clients for 60s against a local server
+    python tests/load_test.py --clients 32 --duration 120 --workers 4
+    python tests/load_test.py --mix explain=10 explain_columnar=5 train=1
+    python tests/load_test.py --base-url http://localhost:8000  # existing server (RSS only if it runs on this machine, see --server-pid)
+
+Results go to tests/results/load_test_results.json.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import requests
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark import generate_dataset
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Configuration - adjust as needed (all of it can be overridden from the command line)
+CONFIG = {
+    "base_url": None, # None starts a local uvicorn server on "port"
+    "port": 8765,
+    "workers": 1, # uvicorn worker processes of the local server
+    "clients": 8, # concurrent simulated users
+    "duration": 60, # seconds of load (after setup)
+    "mix": {"explain": 6, "explain_columnar": 2, "train": 1, "upload": 1}, # scenario weights
+    "rows": 2000, # rows of the synthetic dataset
+    "numeric_cols": 8,
+    "categorical_cols": 2,
+    "cardinality": 10,
+    "explain_rows": 10, # page size of the explain scenarios
+    "request_timeout": 300,
+    "probe_interval": 0.25, # seconds between /health probes
+    "rss_interval": 1.0, # seconds between RSS samples
+    "seed": 42,
+    "results_path": os.path.join(os.path.dirname(__file__), "results", "load_test_results.json"),
+}
+
+
+############################################################
+### Local server and its memory
+
+def start_server(workdir):
+    # Artifacts (datasets, models, caches) go to a throwaway directory, never into the working tree
+    env = {**os.environ, "PYTHONPATH": str(APP_DIR) + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(CONFIG["port"]), "--workers", str(CONFIG["workers"]),
+               "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=workdir, env=env)
+
+def wait_until_ready(base_url, server=None, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode} before becoming ready")
+        try:
+            if requests.get(f"{base_url}/health/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become ready within {timeout}s")
+
+def process_tree_rss(pid):
+    """RSS in bytes of pid and all its descendants (uvicorn workers, job/SHAP pool processes). Linux only (/proc)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, pending = 0, [pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass # exited in the meantime
+        pending.extend(children.get(current, []))
+    return total
+
+def sample_rss(pid, samples, started, stop):
+    while not stop.is_set():
+        samples.append({"t": round(time.perf_counter() - started, 2), "rss_mb": round(process_tree_rss(pid) / 1024 ** 2, 1)})
+        stop.wait(CONFIG["rss_interval"])
+
+
+############################################################
+### Scenarios: each one performs a single request and returns the response
+
+def make_csv(task, seed):
+    df = generate_dataset(CONFIG["rows"], CONFIG["numeric_cols"], CONFIG["categorical_cols"], CONFIG["cardinality"], task, 3, seed)
+    return df.to_csv(index=False).encode()
+
+def scenario_upload(session, base_url, state, rng):
+    # A new random seed per upload, so content deduplication does not turn it into a no-op
+    csv_bytes = make_csv(rng.choice(["regression", "classification"]), rng.randrange(1 << 30))
+    response = session.post(f"{base_url}/upload-csv", files={"file": ("load.csv", csv_bytes, "text/csv")}, timeout=CONFIG["request_timeout"])
+    if response.ok:
+        state["dataset_ids"].append(response.json()["dataset_id"])
+    return response
+
+# Picks any dataset uploaded so far: the first run on a dataset fits a model, repeated ones reuse it (DEDUPE_ARTIFACTS)
+def scenario_train(session, base_url, state, rng):
+    dataset_id = rng.choice(state["dataset_ids"])
+    return session.post(f"{base_url}/train-model", json={"target": "target", "dataset_id": dataset_id}, timeout=CONFIG["request_timeout"])
+
+def _explain(session, base_url, state, rng, response_format):
+    start = rng.randrange(max(state["test_rows"] - CONFIG["explain_rows"], 1))
+    params = {"start": start, "end": start + CONFIG["explain_rows"], "model_id": state["model_id"], "format": response_format}
+    return session.get(f"{base_url}/explain-model", params=params, timeout=CONFIG["request_timeout"])
+
+def scenario_explain(session, base_url, state, rng):
+    return _explain(session, base_url, state, rng, "verbose")
+
+def scenario_explain_columnar(session, base_url, state, rng):
+    return _explain(session, base_url, state, rng, "columnar")
+
+SCENARIOS = {
+    "upload": scenario_upload,
+    "train": scenario_train,
+    "explain": scenario_explain,
+    "explain_columnar": scenario_explain_columnar,
+}
+
+
+def setup(base_url):
+    """Upload and train once, so the explain scenarios have a model to work on"""
+    response = requests.post(f"{base_url}/upload-csv", files={"file": ("load.csv", make_csv("classification", CONFIG["seed"]), "text/csv")},
+                             timeout=CONFIG["request_timeout"])
+    response.raise_for_status()
+    dataset_id = response.json()["dataset_id"]
+    response = requests.post(f"{base_url}/train-model", json={"target": "target", "dataset_id": dataset_id}, timeout=CONFIG["request_timeout"])
+    response.raise_for_status()
+    result = response.json()
+    # First explain request computes the global importances; warm it up so the run measures steady state
+    requests.get(f"{base_url}/explain-model", params={"model_id": result["model_id"]}, timeout=CONFIG["request_timeout"]).raise_for_status()
+    return {"dataset_ids": [dataset_id], "model_id": result["model_id"], "test_rows": result["row_count_after_preprocessing"] // 5}
+
+
+############################################################
+### Load generation
+
+def run_client(client_index, base_url, state, deadline, records, lock):
+    rng = random.Random(CONFIG["seed"] + client_index)
+    names = list(CONFIG["mix"])
+    weights = [CONFIG["mix"][name] for name in names]
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            response = SCENARIOS[name](session, base_url, state, rng)
+            error = None if response.ok else f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        record = {"scenario": name, "finished": time.perf_counter(), "seconds": time.perf_counter() - started, "error": error}
+        with lock:
+            records.append(record)
+
+def run_probe(base_url, probes, deadline):
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            error = None if session.get(f"{base_url}/health", timeout=30).ok else "HTTP error"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        probes.append({"scenario": "health_probe", "finished": time.perf_counter(), "seconds": time.perf_counter() - started, "error": error})
+        time.sleep(CONFIG["probe_interval"])
+
+
+def summarize(records, duration):
+    seconds = np.array([r["seconds"] for r in records]) if records else np.zeros(0)
+    errors = [r["error"] for r in records if r["error"] is not None]
+    summary = {
+        "requests": len(records),
+        "throughput_rps": round(len(records) / duration, 2) if duration else None,
+        "error_rate": round(len(errors) / len(records), 4) if records else None,
+        "errors": {error: errors.count(error) for error in set(errors)},
+    }
+    if len(seconds):
+        p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+        summary.update(p50_ms=round(p50 * 1000, 1), p95_ms=round(p95 * 1000, 1), p99_ms=round(p99 * 1000, 1),
+                       max_ms=round(seconds.max() * 1000, 1))
+    return summary
+
+def throughput_timeline(records, started, bucket_seconds=5):
+    """Completed requests per second in consecutive buckets, to spot degradation during the run"""
+    buckets = {}
+    for record in records:
+        bucket = int((record["finished"] - started) // bucket_seconds)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    return [{"t": bucket * bucket_seconds, "rps": round(count / bucket_seconds, 2)} for bucket, count in sorted(buckets.items())]
+
+
+def run_load_test(server_pid=None):
+    server, workdir = None, None
+    base_url = CONFIG["base_url"]
+    if base_url is None:
+        workdir = tempfile.mkdtemp(prefix="xai-load-test-")
+        server = start_server(workdir)
+        server_pid = server.pid
+        base_url = f"http://127.0.0.1:{CONFIG['port']}"
+    try:
+        print(f"Waiting for {base_url} ...")
+        wait_until_ready(base_url, server)
+        print("Setting up dataset and model ...")
+        state = setup(base_url)
+
+        records, probes, rss_samples, lock = [], [], [], threading.Lock()
+        stop = threading.Event()
+        started = time.perf_counter()
+        deadline = started + CONFIG["duration"]
+        threads = [threading.Thread(target=run_client, args=(i, base_url, state, deadline, records, lock)) for i in range(CONFIG["clients"])]
+        threads.append(threading.Thread(target=run_probe, args=(base_url, probes, deadline)))
+        if server_pid is not None and os.path.isdir("/proc"):
+            sampler = threading.Thread(target=sample_rss, args=(server_pid, rss_samples, started, stop), daemon=True)
+            sampler.start()
+        print(f"Running {CONFIG['clients']} clients for {CONFIG['duration']}s, mix {CONFIG['mix']} ...")
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join() # clients finish their request in flight, so the run can last a bit longer than the duration
+        duration = time.perf_counter() - started
+        stop.set()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "base_url": base_url,
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in CONFIG.items() if not k.endswith("_path")},
+        "duration_seconds": round(duration, 2),
+        "overall": summarize(records, duration),
+        "scenarios": {name: summarize([r for r in records if r["scenario"] == name], duration)
+                      for name in CONFIG["mix"] if CONFIG["mix"][name] > 0},
+        "health_probe": summarize(probes, duration),
+        "throughput_timeline": throughput_timeline(records, started),
+        "rss_timeline": rss_samples,
+        "peak_rss_mb": max((s["rss_mb"] for s in rss_samples), default=None),
+    }
+
+
+def print_report(report):
+    print(f"\n{report['overall']['requests']} requests in {report['duration_seconds']}s")
+    print(f"{'scenario':<18} {'requests':>8} {'rps':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = {**report["scenarios"], "ALL": report["overall"], "health_probe": report["health_probe"]}
+    for name, summary in rows.items():
+        if not summary["requests"]:
+            print(f"{name:<18} {0:>8}")
+            continue
+        print(f"{name:<18} {summary['requests']:>8} {summary['throughput_rps']:>7} {summary['error_rate']:>7.1%} "
+              f"{summary['p50_ms']:>9} {summary['p95_ms']:>9} {summary['p99_ms']:>9}")
+    if report["rss_timeline"]:
+        print(f"Server RSS: {report['rss_timeline'][0]['rss_mb']} MB at start, peak {report['peak_rss_mb']} MB, "
+              f"{report['rss_timeline'][-1]['rss_mb']} MB at the end")
+    if report["health_probe"].get("p99_ms", 0) > 200:
+        print("WARNING: /health p99 above 200 ms, the event loop is being blocked under load")
+
+
+def parse_mix(values):
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}, expected one of {list(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test of the upload/train/explain API")
+    parser.add_argument("--base-url", help="target an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID of the --base-url server, to sample its RSS")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--clients", type=int)
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--rows", type=int)
+    parser.add_argument("--explain-rows", type=int)
+    parser.add_argument("--mix", nargs="+", help="scenario weights, e.g. explain=6 train=1")
+    args = parser.parse_args()
+
+    for key in ("base_url", "port", "workers", "clients", "duration", "rows", "explain_rows"):
+        if getattr(args, key) is not None:
+            CONFIG[key] = getattr(args, key)
+    if args.mix:
+        CONFIG["mix"] = parse_mix(args.mix)
+
+    report = run_load_test(args.server_pid)
+    print_report(report)
+
+    Path(CONFIG["results_path"]).parent.mkdir(exist_ok=True)
+    with open(CONFIG["results_path"], "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nFull results saved to {CONFIG['results_path']}")
+    return 1 if report["overall"]["error_rate"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
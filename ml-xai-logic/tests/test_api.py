@@ -0,0 +1,105 @@
+'''
+HTTP-level tests through FastAPI's TestClient (run with: python -m pytest tests). Artifacts go to a temporary directory.
+'''
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app) # not used as a context manager: no startup warmup
+
+
+def _csv(rows=200, seed=0) -> bytes:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"rooms": rng.integers(1, 6, rows), "area": rng.normal(100, 20, rows), "city": rng.choice(["a", "b", "c"], rows)})
+    df["price"] = df["area"] * 3 + df["rooms"] * 10 + rng.normal(size=rows)
+    return df.to_csv(index=False).encode()
+
+
+def _upload(content: bytes) -> dict:
+    response = client.post("/upload-csv", files={"file": ("data.csv", content, "text/csv")})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_identical_upload_reuses_the_dataset():
+    first = _upload(_csv())
+    again = _upload(_csv().replace(b"\n", b"\r\n")) # same parsed content, different bytes
+    assert not first["reused"] and again["reused"]
+    assert again["dataset_id"] == first["dataset_id"]
+    assert _upload(_csv(seed=1))["dataset_id"] != first["dataset_id"]
+
+
+def test_training_the_same_upload_twice_reuses_the_model():
+    _upload(_csv())
+    first = client.post("/train-model", json={"target": "price", "training_profile": "fast"}).json()
+    _upload(_csv())
+    second = client.post("/train-model", json={"target": "price", "training_profile": "fast"}).json()
+    assert second["reused"] and second["model_id"] == first["model_id"]
+
+
+def test_profile_csv_streams_multipart_and_raw_bodies():
+    content = _csv(rows=500)
+    multipart = client.post("/profile-csv", files={"file": ("data.csv", content, "text/csv")})
+    raw = client.post("/profile-csv", content=content, headers={"Content-Type": "text/csv"})
+    assert multipart.status_code == raw.status_code == 200
+    assert multipart.json() == raw.json()
+    assert multipart.json()["profile_mode"] == "approximate"
+    assert set(multipart.json()["column_types"]["numeric"]) >= {"area", "price"}
+
+
+def test_profile_csv_rejects_other_files():
+    response = client.post("/profile-csv", files={"file": ("data.xlsx", b"a,b\n1,2\n", "application/octet-stream")})
+    assert response.status_code == 400
+    assert client.post("/profile-csv", data={"note": "x"}, files={"other": ("", b"")}).status_code == 400
+
+
+def _train() -> dict:
+    _upload(_csv())
+    return client.post("/train-model", json={"target": "price", "training_profile": "fast"}).json()
+
+
+def test_compact_explanation_formats_match_the_verbose_response():
+    _train()
+    verbose = client.get("/explain-model", params={"start": 0, "end": 3}).json()
+    rows = verbose["local_explanations"]
+    features = list(rows[0]["shap_contributions"])
+
+    columnar = client.get("/explain-model", params={"start": 0, "end": 3, "format": "columnar"})
+    assert columnar.headers["content-type"] == "application/vnd.xai.columnar+json"
+    local = columnar.json()["local_explanations"]
+    assert local["features"] == features and local["row_index"] == [0, 1, 2]
+    assert local["contributions"]["shape"] == [3, len(features)]
+    assert np.allclose(local["contributions"]["values"], [row["shap_contributions"][f] for row in rows for f in features])
+
+    arrow = client.get("/explain-model", params={"start": 0, "end": 3}, headers={"Accept": "application/vnd.apache.arrow.stream"})
+    assert arrow.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(arrow.content).read_all()
+    assert json.loads(table.schema.metadata[b"xai.features"]) == features
+    assert json.loads(table.schema.metadata[b"xai.summary"])["global_feature_importance"] == verbose["global_feature_importance"]
+    assert table.column("row_index").to_pylist() == [0, 1, 2]
+    assert np.allclose(table.column("prediction").to_pylist(), [row["prediction"] for row in rows])
+    assert np.allclose(table.column("contributions").to_pylist(), [[row["shap_contributions"][f] for f in features] for row in rows])
+
+    assert client.get("/explain-model", params={"format": "xml"}).status_code == 400
+
+
+def test_explanation_stream_sends_global_then_local_batches():
+    _train()
+    verbose = client.get("/explain-model", params={"start": 0, "end": 5}).json()
+
+    ndjson = client.get("/explain-model/stream", params={"start": 0, "end": 5, "batch_rows": 2})
+    assert ndjson.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in ndjson.text.splitlines()]
+    assert [event["event"] for event in events] == ["global", "local", "local", "local", "done"]
+    assert events[0]["global_feature_importance"] == verbose["global_feature_importance"]
+    assert [row for event in events[1:-1] for row in event["local_explanations"]] == verbose["local_explanations"]
+
+    sse = client.get("/explain-model/stream", params={"start": 0, "end": 5, "batch_rows": 2, "format": "sse"})
+    assert sse.headers["content-type"].startswith("text/event-stream")
+    messages = sse.text.strip().split("\n\n")
+    assert [message.splitlines()[0] for message in messages] == [f"event: {event['event']}" for event in events]
+    assert [json.loads(message.splitlines()[1][len("data: "):]) for message in messages] == events
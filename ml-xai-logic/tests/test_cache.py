@@ -0,0 +1,139 @@
+'''
+Tests for the explanation cache (run with: python -m pytest tests).
+'''
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+from app.ml_core import cache
+
+
+@pytest.fixture(autouse=True)
+def empty_memory_cache():
+    cache._memory_cache.clear()
+
+
+def _write(path, content: bytes, mtime=None):
+    with open(path, "wb") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_cache_key_follows_model_and_test_data_content(tmp_path):
+    model = _write(tmp_path / "model.joblib", b"model-1")
+    x_test = _write(tmp_path / "X_test.parquet", b"rows-1")
+    key = cache.explanation_cache_key(model, x_test)
+    assert cache.explanation_cache_key(model, x_test) == key
+
+    _write(model, b"model-1") # rewritten with the same bytes: same entry
+    assert cache.explanation_cache_key(model, x_test) == key
+    _write(model, b"model-2") # retrained
+    assert cache.explanation_cache_key(model, x_test) != key
+    _write(model, b"model-1")
+    _write(x_test, b"rows-2") # new test split
+    assert cache.explanation_cache_key(model, x_test) != key
+
+
+def test_fingerprint_is_rehashed_when_the_file_changes(tmp_path):
+    path = _write(tmp_path / "model.joblib", b"aaaa", mtime=1000)
+    first = cache.file_fingerprint(path)
+    assert cache._fingerprints[path][1] == first
+
+    _write(path, b"bbbb", mtime=1000) # same size and mtime: the memoized digest is trusted
+    assert cache.file_fingerprint(path) == first
+    os.utime(path, (2000, 2000))
+    assert cache.file_fingerprint(path) != first
+
+
+def test_concurrent_requests_compute_once(tmp_path):
+    calls, results = [], []
+    def compute():
+        calls.append(1)
+        time.sleep(0.3)
+        return {"value": 4}
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute_explanation("k", str(tmp_path), compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and results == [{"value": 4}] * 4
+    assert not os.path.exists(cache._marker_path(str(tmp_path), "k"))
+
+
+def test_marker_is_claimed_by_one_owner(tmp_path):
+    marker = cache._marker_path(str(tmp_path), "k")
+    assert cache._claim_marker(marker)
+    assert not cache._claim_marker(marker)
+    with open(marker) as f:
+        assert json.load(f) == {"pid": os.getpid(), "host": socket.gethostname()}
+    assert not cache._marker_abandoned(marker)
+
+
+def _marker(cache_dir, key, pid, age=0.0):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache._marker_path(cache_dir, key)
+    with open(path, "w") as f:
+        json.dump({"pid": pid, "host": socket.gethostname()}, f)
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_marker_of_a_dead_process_is_taken_over(tmp_path):
+    _marker(str(tmp_path), "k", _dead_pid())
+    started = time.time()
+    assert cache.get_or_compute_explanation("k", str(tmp_path), lambda: {"value": 1}) == {"value": 1}
+    assert time.time() - started < 5
+    assert not os.path.exists(cache._marker_path(str(tmp_path), "k")) # released after the computation
+
+
+def test_marker_without_heartbeat_is_taken_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "EXPLANATION_INFLIGHT_TIMEOUT", 30)
+    _marker(str(tmp_path), "k", os.getppid(), age=60) # owner alive, but silent for longer than the timeout
+    assert cache.get_or_compute_explanation("k", str(tmp_path), lambda: {"value": 2}) == {"value": 2}
+
+
+def test_waiter_uses_the_result_of_a_live_computation(tmp_path):
+    _marker(str(tmp_path), "k", os.getpid()) # claimed by a live process that is still computing
+    def finish():
+        time.sleep(0.5)
+        cache.store_explanation("k", {"value": 3}, str(tmp_path))
+        cache._memory_cache.clear()
+    threading.Thread(target=finish).start()
+    computed = []
+    entry = cache.get_or_compute_explanation("k", str(tmp_path), lambda: computed.append(1) or {"value": 0})
+    assert entry == {"value": 3} and computed == []
+
+
+def test_owner_refreshes_its_marker_while_computing(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "EXPLANATION_HEARTBEAT_SECONDS", 0.05)
+    marker = cache._marker_path(str(tmp_path), "k")
+    def compute():
+        first = os.path.getmtime(marker)
+        time.sleep(0.3)
+        return {"refreshed": os.path.getmtime(marker) > first}
+    assert cache.get_or_compute_explanation("k", str(tmp_path), compute) == {"refreshed": True}
+
+
+def test_memory_tier_is_bounded_by_heap_bytes(tmp_path, monkeypatch):
+    import numpy as np
+    monkeypatch.setattr(cache, "SHAP_MEMORY_CACHE_MAX_BYTES", 1000)
+    cache._remember("a", {"shap_values": np.zeros(100)}) # 800 heap bytes
+    cache._remember("b", {"shap_values": np.zeros(100)})
+    assert list(cache._memory_cache) == ["b"]
+
+    stored = cache.store_explanation("c", {"shap_values": np.zeros(1000)}, str(tmp_path)) # 8000 bytes, but mapped from disk
+    assert isinstance(stored["shap_values"], np.memmap)
+    assert list(cache._memory_cache) == ["b", "c"]
@@ -0,0 +1,17 @@
+'''
+Tests for explanation helpers (run with: python -m pytest tests).
+'''
+import pandas as pd
+
+from app.ml_core.explain import budget_cache_suffix
+
+X_test = pd.DataFrame({"a": range(500)})
+
+
+def test_budget_cache_suffix_keeps_budgets_apart():
+    def suffix(budget_rows=None, budget_seconds=None):
+        return budget_cache_suffix(X_test, budget_rows, budget_seconds)[0]
+    assert suffix(budget_seconds=0) != suffix() # an explicit zero budget is not "no budget"
+    assert suffix(budget_seconds=0.501) == suffix(budget_seconds=0.5) # bucketed to two significant digits
+    assert suffix(budget_seconds=0.5) != suffix(budget_seconds=0.6)
+    assert suffix(budget_rows=10_000) == suffix(budget_rows=500) # capped at the test set size
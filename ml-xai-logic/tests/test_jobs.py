@@ -0,0 +1,58 @@
+'''
+Tests for background job state (run with: python -m pytest tests). Job files go to a temporary directory.
+'''
+import time
+import pytest
+
+from app.core import jobs
+
+
+@pytest.fixture(autouse=True)
+def short_job_timeouts(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", 60)
+    monkeypatch.setattr(jobs, "JOB_QUEUE_TIMEOUT", 600)
+
+
+def _job(job_id, status, seconds_ago):
+    jobs._write_job(job_id, {"job_id": job_id, "status": status, "created_at": time.time() - seconds_ago,
+                             "updated_at": time.time() - seconds_ago, "heartbeat_at": time.time() - seconds_ago})
+
+
+def test_job_without_heartbeat_is_failed():
+    _job("a" * 16, "running", 120)
+    state = jobs.get_job("a" * 16)
+    assert state["status"] == "failed" and "heartbeat" in state["error"]
+    assert jobs._read_job("a" * 16)["status"] == "failed" # persisted for every worker
+
+
+def test_cancelling_job_without_heartbeat_is_cancelled():
+    _job("b" * 16, "cancelling", 120)
+    assert jobs.get_job("b" * 16)["status"] == "cancelled"
+
+
+def test_live_and_recently_queued_jobs_are_left_alone():
+    _job("c" * 16, "running", 5)
+    _job("d" * 16, "queued", 120)
+    assert jobs.get_job("c" * 16)["status"] == "running"
+    assert jobs.get_job("d" * 16)["status"] == "queued"
+
+
+def test_job_queued_past_the_timeout_is_failed():
+    _job("9" * 16, "queued", 1200) # e.g. its API worker died before the pool started it
+    state = jobs.get_job("9" * 16)
+    assert state["status"] == "failed" and "not started" in state["error"]
+
+
+def test_job_process_records_its_own_outcome():
+    _job("e" * 16, "queued", 0)
+    jobs._run_job("e" * 16, lambda job_id, value: {"value": value}, 3)
+    assert jobs.get_job("e" * 16)["status"] == "succeeded"
+    assert jobs.get_job("e" * 16)["result"] == {"value": 3}
+
+    def fail(job_id):
+        raise ValueError("Invalid target column")
+    _job("f" * 16, "queued", 0)
+    with pytest.raises(ValueError):
+        jobs._run_job("f" * 16, fail)
+    assert jobs.get_job("f" * 16)["status"] == "failed"
+    assert jobs.get_job("f" * 16)["error"] == "Invalid target column"
@@ -0,0 +1,51 @@
+'''
+Tests for the persisted preprocessing transform (run with: python -m pytest tests).
+'''
+import pandas as pd
+import pytest
+
+from app.ml_core.preprocessing import ENCODING_STRATEGIES, densify, encode, fit_preprocessor, transform
+
+
+def _training_frame():
+    return pd.DataFrame({"rooms": [1, 2, 3, 4, 2, 3], "area": [50.0, 70.5, 90.0, 120.0, 65.0, 80.0],
+                         "city": ["a", "b", "a", "c", "b", "a"]})
+
+
+@pytest.mark.parametrize("encoding", ENCODING_STRATEGIES)
+def test_transform_round_trips_training_rows(encoding):
+    X = _training_frame()
+    preprocessor = fit_preprocessor(X, [], encoding)
+    expected, _ = encode(preprocessor, X)
+    raw = X.astype(str) # rows as they arrive from a CSV or JSON body
+    encoded, positions, skipped_rows, unseen = transform(preprocessor, raw)
+    assert skipped_rows == [] and unseen == {}
+    assert positions.tolist() == list(range(len(X)))
+    assert list(encoded.columns) == preprocessor["encoded_columns"]
+    pd.testing.assert_frame_equal(densify(encoded).astype(float), densify(expected).astype(float))
+
+
+def test_transform_keeps_fractional_values_of_integer_columns():
+    preprocessor = fit_preprocessor(_training_frame(), [])
+    encoded, _, skipped_rows, _ = transform(preprocessor, pd.DataFrame({"rooms": ["2.9", "3"], "area": [60, 70], "city": ["a", "b"]}))
+    assert skipped_rows == []
+    assert encoded["rooms"].tolist() == [2.9, 3.0]
+
+
+def test_transform_reports_unparseable_numbers():
+    preprocessor = fit_preprocessor(_training_frame(), [])
+    encoded, positions, skipped_rows, _ = transform(preprocessor, pd.DataFrame({"rooms": ["x", "3"], "area": [60, 70], "city": ["a", "b"]}))
+    assert positions.tolist() == [1]
+    assert [row["row_index"] for row in skipped_rows] == [0]
+    assert encoded["rooms"].tolist() == [3]
+
+
+@pytest.mark.parametrize("encoding", ENCODING_STRATEGIES)
+def test_bucketed_training_levels_are_not_unseen(encoding):
+    X = pd.DataFrame({"a": range(8), "c": ["x", "x", "x", "y", "y", "z", "w", "v"]})
+    preprocessor = fit_preprocessor(X, [], encoding, max_categories=2)
+    assert preprocessor["input_columns"][1]["other_levels"] == ["v", "w", "y", "z"]
+    _, _, _, unseen = transform(preprocessor, X)
+    assert unseen == {}
+    _, _, _, unseen = transform(preprocessor, pd.DataFrame({"a": [1, 2], "c": ["y", "new"]}))
+    assert unseen == {"c": 1}
@@ -0,0 +1,47 @@
+'''
+Tests for the dataset/model registry (run with: python -m pytest tests). Artifacts go to a temporary directory.
+'''
+import os
+import joblib
+import pandas as pd
+import pytest
+
+from app.utils.artifact_store import load_frame, save_frame
+from app.utils import registry
+from app.utils.registry import UnknownArtifactError, dataset_path, model_path, resolve_dataset_id, resolve_model_id, x_test_path
+
+
+def test_pre_registry_artifacts_are_imported_once():
+    df = pd.DataFrame({"a": [1, 2, 3], "y": [0.5, 1.5, 2.5]})
+    os.makedirs("data")
+    os.makedirs("artifacts")
+    df.to_csv("data/last_uploaded.csv", index=False)
+    df[["a"]].to_csv("artifacts/X_test.csv", index=False)
+    joblib.dump({"model": "legacy"}, "artifacts/latest_model.pkl")
+
+    dataset_id, model_id = resolve_dataset_id(), resolve_model_id()
+    pd.testing.assert_frame_equal(load_frame(dataset_path(dataset_id)), df)
+    pd.testing.assert_frame_equal(load_frame(x_test_path(model_id)), df[["a"]])
+    assert joblib.load(model_path(model_id)) == {"model": "legacy"}
+    assert (resolve_dataset_id(), resolve_model_id()) == (dataset_id, model_id)
+
+
+def test_resolve_without_any_artifacts():
+    with pytest.raises(UnknownArtifactError):
+        resolve_model_id()
+
+
+@pytest.mark.parametrize("limit", ["age", "size"])
+def test_retention_never_evicts_the_latest_entry(limit, monkeypatch):
+    if limit == "age":
+        monkeypatch.setattr(registry, "ARTIFACT_MAX_AGE_HOURS", 0) # everything is too old
+    else:
+        monkeypatch.setitem(registry._MAX_TOTAL_BYTES, "dataset", 0) # nothing fits
+    ids = [registry.create_dataset() for _ in range(3)]
+    for dataset_id in ids:
+        save_frame(pd.DataFrame({"a": [1, 2, 3]}), dataset_path(dataset_id))
+    registry.mark_latest("dataset", ids[0]) # the least recently used one
+
+    evicted = registry.enforce_retention("dataset", keep=(ids[2],))
+    assert evicted == [ids[1]]
+    assert resolve_dataset_id() == ids[0]
@@ -0,0 +1,68 @@
+'''
+Tests for the mergeable profile sketches (run with: python -m pytest tests).
+'''
+import numpy as np
+import pandas as pd
+
+from app.utils.sketch import DistinctCounter, sketch_frame, FrameSketch, value_hashes
+from app.utils.io import profile_error_bounds
+
+
+def _counter(values, exact_limit=100) -> DistinctCounter:
+    counter = DistinctCounter(precision=12, exact_limit=exact_limit)
+    counter.add(value_hashes(pd.Series(values)))
+    return counter
+
+
+def test_distinct_count_is_exact_below_the_limit():
+    counter = _counter(np.arange(50).repeat(3))
+    assert counter.exact and counter.estimate() == 50 and counter.relative_error() == 0
+
+
+def test_distinct_estimate_is_within_its_error_bound():
+    for distinct in (1_000, 20_000, 200_000):
+        counter = _counter(np.arange(distinct))
+        assert not counter.exact
+        assert abs(counter.estimate() - distinct) <= counter.relative_error() * distinct
+
+
+def test_merged_counters_match_a_single_counter():
+    values = np.arange(30_000)
+    whole = _counter(values)
+    # overlapping halves, one still exact: the union is counted once
+    merged = _counter(values[:20_000]).merge(_counter(values[10_000:])).merge(_counter(values[:10]))
+    assert np.array_equal(merged.registers, whole.registers)
+    assert merged.estimate() == whole.estimate()
+
+
+def test_merged_exact_counters_stay_exact():
+    merged = _counter(np.arange(40)).merge(_counter(np.arange(20, 80)))
+    assert merged.exact and merged.estimate() == 80
+
+
+def test_chunked_profile_bounds_contain_the_true_values():
+    rng = np.random.default_rng(0)
+    rows = 60_000
+    df = pd.DataFrame({
+        "order_id": np.arange(rows),
+        # numbers in the first chunks, text mixed in later: profiled as "other" with an estimated numeric ratio
+        "mixed": np.where((rng.random(rows) < 0.3) & (np.arange(rows) >= 20_000), "n/a", rng.integers(0, 1000, rows).astype(str)),
+        "store": rng.choice(["a", "b", None], rows),
+    })
+    merged = FrameSketch()
+    for index, start in enumerate(range(0, rows, 10_000)):
+        chunk = df.iloc[start:start + 10_000]
+        if start < 20_000:
+            chunk = chunk.astype({"mixed": int}) # as read_csv parses an all-number chunk
+        merged.merge(sketch_frame(chunk, seed=index))
+    profile = merged.to_profile()
+    bounds = profile_error_bounds(profile)
+
+    assert profile.row_count == rows
+    for name in df.columns:
+        column = bounds[name]
+        assert column["null_count"]["estimate"] == int(df[name].isnull().sum())
+        assert column["nunique"]["low"] <= df[name].nunique() <= column["nunique"]["high"]
+    assert bounds["store"]["nunique"]["exact"] and not bounds["order_id"]["nunique"]["exact"]
+    numeric_ratio = pd.to_numeric(df["mixed"], errors="coerce").notnull().mean()
+    assert bounds["mixed"]["numeric_ratio"]["low"] <= numeric_ratio <= bounds["mixed"]["numeric_ratio"]["high"]
@@ -0,0 +1,63 @@
+'''
+Regression tests for train_model (run with: python -m pytest tests). Artifacts go to a temporary directory.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.profile import profile_dataframe
+from app.utils.io import check_high_cardinality_and_identifiers
+from app.ml_core.train import train_model
+
+
+def _bid_frame(rows=300):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"rooms": rng.integers(1, 6, rows), "area": rng.normal(100, 20, rows)})
+    df["bid_price"] = df["area"] * 3 + rng.normal(size=rows) # continuous, unique per row, "id" inside the name
+    return df
+
+
+def test_identifier_check_ignores_columns_outside_the_frame():
+    df = _bid_frame()
+    profile = profile_dataframe(df)
+    assert profile["bid_price"].likely_identifier
+    high_cardinality, likely_ids = check_high_cardinality_and_identifiers(df.drop(columns=["bid_price"]), profile)
+    assert "bid_price" not in high_cardinality
+    assert likely_ids == []
+
+
+def test_target_that_looks_like_an_identifier_trains():
+    df = _bid_frame()
+    result = train_model(df, "bid_price", profile_dataframe(df))
+    assert result["task"] == "regression"
+    assert "bid_price" not in result["dropped_columns"]
+
+
+def test_model_size_cap_bounds_the_fit(monkeypatch):
+    from app.ml_core import train
+    monkeypatch.setitem(train.TRAINING_PROFILES, "fast", {**train.TRAINING_PROFILES["fast"], "max_model_mb": 0.05})
+    result = train_model(_bid_frame(2000), "bid_price", training_profile="fast")
+    params = result["model_params"]
+    assert 1 <= params["n_estimators"] < params["n_estimators_requested"]
+    assert result["model_memory_bytes"] <= 0.05 * 1024 ** 2
+
+
+def test_identical_training_run_reuses_the_model():
+    df = _bid_frame()
+    first = train_model(df, "bid_price", training_profile="fast")
+    second = train_model(df.copy(), "bid_price", training_profile="fast")
+    assert second["reused"] and second["model_id"] == first["model_id"]
+    assert not train_model(df, "area", training_profile="fast").get("reused")
+
+
+@pytest.mark.parametrize("upgrade", ["PREPROCESSOR_VERSION", "scikit-learn"])
+def test_upgrades_invalidate_the_training_key(monkeypatch, upgrade):
+    from app.ml_core import train
+    df = _bid_frame()
+    key = train.training_key(df, "bid_price")
+    if upgrade == "PREPROCESSOR_VERSION":
+        monkeypatch.setattr(train, "PREPROCESSOR_VERSION", train.PREPROCESSOR_VERSION + 1)
+    else:
+        version = train.importlib.metadata.version
+        monkeypatch.setattr(train.importlib.metadata, "version", lambda name: "99.0" if name == "scikit-learn" else version(name))
+    assert train.training_key(df, "bid_price") != key
@@ -0,0 +1,45 @@
+'''
+Tests for the upload body size limit (run with: python -m pytest tests).
+'''
+from fastapi import FastAPI, UploadFile
+from fastapi.testclient import TestClient
+
+from app.core.upload_limits import UploadSizeLimitMiddleware, MULTIPART_OVERHEAD_BYTES
+
+LIMIT = 1000
+handled = []
+
+app = FastAPI()
+app.add_middleware(UploadSizeLimitMiddleware, limits={"/upload": LIMIT})
+
+@app.post("/upload")
+async def upload(file: UploadFile):
+    handled.append(file.filename)
+    return {"size": len(await file.read())}
+
+client = TestClient(app)
+
+
+def _multipart(payload: bytes) -> bytes:
+    return (b'--b\r\nContent-Disposition: form-data; name="file"; filename="d.csv"\r\n\r\n' + payload + b"\r\n--b--\r\n")
+
+
+def test_upload_within_the_limit_is_handled():
+    response = client.post("/upload", files={"file": ("d.csv", b"x" * LIMIT)})
+    assert response.status_code == 200 and response.json() == {"size": LIMIT}
+
+
+def test_content_length_over_the_limit_is_rejected_before_the_handler():
+    handled.clear()
+    response = client.post("/upload", files={"file": ("d.csv", b"x" * (LIMIT + MULTIPART_OVERHEAD_BYTES + 1))})
+    assert response.status_code == 413
+    assert handled == []
+
+
+def test_chunked_body_over_the_limit_is_rejected_while_received():
+    handled.clear()
+    body = _multipart(b"x" * (LIMIT + MULTIPART_OVERHEAD_BYTES + 1))
+    chunks = (body[i:i + 4096] for i in range(0, len(body), 4096)) # a generator is sent without a Content-Length
+    response = client.post("/upload", content=chunks, headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert handled == []